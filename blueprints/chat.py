@@ -1,43 +1,98 @@
 import azure.functions as func
 from azure.functions import HttpRequest
+from azurefunctions.extensions.http.fastapi import Request, StreamingResponse, JSONResponse
 from uuid import uuid4
+import asyncio
 import json
+import logging
+import time
 
 from blueprints.process_training_data_func import clean_utf8_text
-from configs.openai_client import AzureOpenAIClient
+from configs.openai_client import AsyncAzureOpenAIClient, build_chat_completion
 from configs.system_prompt import (
     DEFAULT_PROMPT,
     SMALLTALK_DETECTION_AND_RESPONSE_PROMPT
 )
-from configs.settings import vector_store
-from models.DocumentMetadata import DocumentMetadata
+from configs.settings import (
+    SEMANTIC_CACHE_ENABLED,
+    HISTORY_MAX_MESSAGES,
+    BATCH_MAX_PROMPTS,
+    BATCH_COMPLETION_CONCURRENCY,
+    CHAT_COALESCING_ENABLED,
+)
 from models.ResponseModel import ResponseModel
+from models.RetrievalResult import RetrievalResult
 from models.Roles import Role
-from utils.log_usage_metrics import log_usage_metrics
+from utils.log_usage_metrics import add_usage, alog_usage_metrics, alog_usage_metrics_bulk, share_usage
+from utils.smalltalk_classifier import aclassify_smalltalk
+from utils.semantic_cache import lookup_cached_answer, store_cached_answer
+from utils.context_packer import pack_context
+from utils.embedding_cache import normalize_embedding_text
+from utils.retrieval import resolve_retrieval_strategy, asearch_with_strategy, asearch_vector_store_batch
+from utils.history_compression import build_conversation_key, compress_history
 from utils.token_utils import validate_user_access
+from utils.token_quota import (
+    QuotaExceeded,
+    QuotaExceededError,
+    QuotaReservation,
+    check_tokens,
+    quota_exceeded_payload,
+    reserve_tokens,
+)
+from utils.openai_resilience import CircuitOpenError
+from utils.model_tiering import choose_chat_tier, tier_for
+from utils.low_relevance import answer_low_relevance, check_relevance
+from utils.single_flight import SingleFlight
+from utils.tracing import activate_trace, persist_trace, span, start_trace
+
+SEMANTIC_CACHE_MODEL_NAME = "semantic-cache"
+# HyDE e multi-query fazem uma chamada a mais ao modelo: só professores e admins escolhem a estratégia por requisição
+STRATEGY_OVERRIDE_ROLES = (Role.TEACHER.value, Role.ADMIN.value)
 
 chat_bp = func.Blueprint()
+chat_flights = SingleFlight()
 
 
 def parse_request(req: HttpRequest, student_class_name= str | None):
     try:
         body = req.get_json()
     except ValueError:
-        return None, None, ResponseModel({"error": "Formato JSON inválido."}, status_code=400)
-    
+        return None, None, None, ResponseModel({"error": "Formato JSON inválido."}, status_code=400)
+
+    prompt, history, prompt_enchanced, error = parse_body(body, student_class_name)
+    if error:
+        return None, None, None, ResponseModel(error, status_code=400)
+    return prompt, history, prompt_enchanced, None
 
+def parse_body(body: dict, student_class_name: str | None):
+    """
+    Valida o corpo da requisição de chat. Retorna (prompt, history, prompt_enchanced, erro),
+    onde erro é um dict pronto para ser devolvido com status 400.
+    """
     prompt = body.get("prompt", "").strip()
-    prompt_enchanced = f"Sobre a disciplina {student_class_name}, responda: {prompt}" if student_class_name else prompt
     if not prompt:
-        return None, None, ResponseModel({"error": "Campo 'prompt' é obrigatório."}, status_code=400)
+        return None, None, None, {"error": "Campo 'prompt' é obrigatório."}
+    prompt_enchanced = f"Sobre a disciplina {student_class_name}, responda: {prompt}" if student_class_name else prompt
 
     history = body.get("history", [])
     if not isinstance(history, list):
-        return None, None, ResponseModel({"error": "Campo 'history' deve ser um array."}, status_code=400)
+        return None, None, None, {"error": "Campo 'history' deve ser um array."}
 
-    history = history[-6:]
+    # O orçamento de tokens é aplicado depois, em compress_history
+    history = history[-HISTORY_MAX_MESSAGES:]
     return prompt, history, prompt_enchanced, None
 
+def requested_strategy(user: dict, body: dict) -> str | None:
+    """
+    Estratégia de recuperação pedida no corpo, se o usuário puder escolher; senão, None
+    (vale a da turma ou a padrão).
+    """
+    strategy = body.get("retrieval_strategy")
+    if strategy and user.get("role") not in STRATEGY_OVERRIDE_ROLES:
+        logging.info(f"[chat] retrieval_strategy '{strategy}' ignorada para o papel {user.get('role')}")
+        return None
+    return strategy
+
 def build_history_string(history: list) -> str:
     """
     Recebe uma lista de dicts com chaves 'sender' e 'content' e retorna
@@ -50,7 +105,7 @@ def build_history_string(history: list) -> str:
     ]
     return "\n".join(lines)
 
-def detect_and_respond_smalltalk(user_prompt: str, history: list) -> str:
+async def detect_and_respond_smalltalk(user_prompt: str, history: list) -> str:
     history_str = build_history_string(history)
     combined = (
         f"Histórico de conversa:\n{history_str}\n\n" 
@@ -61,7 +116,8 @@ def detect_and_respond_smalltalk(user_prompt: str, history: list) -> str:
         f"{combined}"
     )
 
-    response_text = AzureOpenAIClient.create_completion_json(prompt=prompt)
+    with span("smalltalk_llm"):
+        response_text = await AsyncAzureOpenAIClient.create_completion_json(prompt=prompt, tier=tier_for("smalltalk"))
     try:
         payload:dict = json.loads(response_text)
     except json.JSONDecodeError:
@@ -72,98 +128,235 @@ def detect_and_respond_smalltalk(user_prompt: str, history: list) -> str:
     return payload.get("smalltalk_response", "").strip()
 
 
-def generate_hypothetical_document(question: str) -> str:
+async def retrieve_context(document: str, user_class: str | None, use_cache: bool = True, strategy: str | None = None) -> RetrievalResult:
     """
-    Gera um documento hipotético a partir de uma pergunta, usando o modelo Azure OpenAI.
-    Esse texto simula a resposta que o seu próprio chatbot daria, e será usado como chave para a busca vetorial.
+    Gera o embedding da pergunta e consulta o cache semântico da turma; em caso de miss,
+    executa a estratégia de recuperação escolhida (requisição > turma > padrão) reaproveitando
+    o mesmo embedding e empacota os chunks no orçamento de tokens do contexto.
     """
-    # Montamos um prompt que indica ao modelo que crie uma resposta bem detalhada para servir de "contexto" na busca.
-    hyde_prompt = (
-        "Você é um sistema de geração de documentos hipotéticos.\n"
-        "Dada a pergunta abaixo, gere uma resposta detalhada que cubra todos os pontos relevantes:\n\n"
-        f"Pergunta: {question}\n"
-        "Resposta detalhada (documento hipotético):"
-    )
-    # create_completion retorna (texto_gerado, resposta_raw). Usamos apenas o texto.
-    hyde_doc, _ = AzureOpenAIClient.create_completion(prompt=hyde_prompt)
-    return hyde_doc
-
-def search_vector_store_hyde(document: str, user_class: str):
-    """
-    1) Gera o documento hipotético (hyde) a partir da pergunta (document).
-    2) Cria embedding desse hyde document.
-    3) Executa a busca vetorial usando esse embedding, aplicando filtros por class_code.
-    4) Retorna lista de textos (context) e metadados.
-    """
-    
-    # 1) Gera o documento hipotético
-    hyde_doc = generate_hypothetical_document(document)
-    embedding = AzureOpenAIClient.create_embedding(input_text=hyde_doc)
-
-    filters = (
-        {"$or": [
-            {"class_code": user_class},
-            {"class_code": "admin"},
-            {"class_code": None}
-        ]}
-        if user_class else {}
-    )
+    with span("embedding"):
+        embedding = await AsyncAzureOpenAIClient.create_embedding(input_text=document)
+    if use_cache and SEMANTIC_CACHE_ENABLED:
+        with span("semantic_cache"):
+            cached_response = await asyncio.to_thread(lookup_cached_answer, user_class, embedding)
+        if cached_response is not None:
+            return RetrievalResult(embedding=embedding, cached_response=cached_response)
 
-    results = vector_store.similarity_search_by_vector(
-        embedding=embedding,
-        k=10,
-        filter=filters
+    strategy = resolve_retrieval_strategy(user_class, strategy)
+    with span("search"):
+        context, metadata, scores, top_similarity, expansion_usage = await asearch_with_strategy(strategy, document, user_class, embedding)
+    with span("pack_context"):
+        context, metadata, scores, _ = pack_context(context, metadata, scores)
+    retrieval = RetrievalResult(
+        context=context, metadata=metadata, scores=scores, embedding=embedding,
+        top_similarity=top_similarity, expansion_usage=expansion_usage,
     )
+    # Sem cache, a pergunta tem histórico: uma continuação ("e o prazo?") pode ter similaridade baixa
+    # sozinha e ainda ser respondida pelo contexto da conversa
+    if use_cache:
+        check_relevance(retrieval)
+    return retrieval
 
-    context = [doc.page_content for doc in results]
-    metadata = [DocumentMetadata(**doc.metadata) for doc in results]
-    return context, metadata
-
-def search_vector_store(document: str, user_class: str):
-    embedding = AzureOpenAIClient.create_embedding(input_text=document)
-    filters = ({"$or": [
-        {"class_code": user_class}, {"class_code": "admin"}, {"class_code": None}
-    ]} if user_class else {})
-    results = vector_store.similarity_search_by_vector(
-        embedding=embedding, k=10, filter=filters
+
+def compose_assistant_messages(context: list, user_prompt: str, user_history: list | None = None, class_name: str | None = None) -> list:
+    """
+    Monta as mensagens da completion do mais estável ao mais variável, para que o prefixo seja
+    reaproveitado pelo cache de prompt do Azure OpenAI: as instruções fixas (idênticas byte a byte
+    em todas as requisições), a disciplina da turma, o histórico da conversa (que só cresce no fim)
+    e, por último, o contexto recuperado e a pergunta.
+    """
+    messages = [{"role": "system", "content": DEFAULT_PROMPT}]
+    if class_name:
+        messages.append({"role": "system", "content": f"Disciplina do aluno: {class_name}"})
+    if user_history:
+        messages.append({"role": "user", "content": f"Histórico de conversa:\n{build_history_string(user_history)}"})
+    messages.append({
+        "role": "user",
+        "content": f"Baseado nas seguintes informações: {'; '.join(context)}\nPergunta do usuário: {user_prompt}",
+    })
+    return messages
+
+
+async def detect_smalltalk_or_retrieve(user, user_prompt: str, history: list, prompt_enchanced: str, strategy: str | None = None, classified: tuple | None = None):
+    """
+    Decide se a mensagem é smalltalk e obtém o contexto da busca vetorial quando não for.
+    O classificador local resolve os casos confiantes sem chamar o LLM; nos demais, o gate via LLM
+    roda em paralelo com a recuperação especulativa (embedding + busca vetorial).
+    `classified` recebe o resultado do classificador quando quem chama já o executou.
+    Retorna (resposta_smalltalk, None) se a mensagem for smalltalk, descartando a recuperação,
+    ou (None, RetrievalResult) caso contrário.
+    """
+    use_cache = not history
+    if classified is None:
+        with span("smalltalk_classifier"):
+            classified = await aclassify_smalltalk(user_prompt, user.get("name"))
+    is_smalltalk, canned_reply = classified
+    if is_smalltalk:
+        return canned_reply, None
+    if is_smalltalk is False:
+        return None, await retrieve_context(prompt_enchanced, user.get("classCode"), use_cache, strategy)
+
+    retrieval_task = asyncio.create_task(
+        retrieve_context(prompt_enchanced, user.get("classCode"), use_cache, strategy)
     )
-    context = [doc.page_content for doc in results]
-    metadata = [DocumentMetadata(**doc.metadata) for doc in results]
-    return context, metadata
+    try:
+        smalltalk_reply = await detect_and_respond_smalltalk(user_prompt, history)
+    except BaseException:
+        retrieval_task.cancel()
+        raise
 
+    if smalltalk_reply is not None:
+        retrieval_task.cancel()
+        return smalltalk_reply, None
+    return None, await retrieval_task
 
-def compose_assistant_prompt(context: list, user_prompt: str, user_history: list | None = []) -> str:
-    context_str = "; ".join(context)
-    history_str = build_history_string(user_history) 
 
-    return (
-        f"{DEFAULT_PROMPT}\n"
-        f"Baseado nas seguintes informações: {context_str}\n"
-        f"Pergunta do usuário: {user_prompt}\n"
-        f"\nHistórico de conversa:\n{history_str}"
+def quota_exceeded_response(exceeded: QuotaExceeded) -> ResponseModel:
+    return ResponseModel(
+        quota_exceeded_payload(exceeded), status_code=429, headers={"Retry-After": str(exceeded.retry_after)}
+    )
+
+def circuit_open_response(error: CircuitOpenError) -> ResponseModel:
+    retry_after = max(1, round(error.retry_after))
+    return ResponseModel(
+        {"error": str(error), "retry_after": retry_after}, status_code=503, headers={"Retry-After": str(retry_after)}
     )
 
+async def generate_answer(user, user_prompt: str, user_history: list | None, retrieval: RetrievalResult):
+    """
+    Gera a resposta a partir do contexto recuperado (ou a devolve do cache semântico). Quando
+    nenhum chunk é relevante, pula a completion com contexto (ver utils/low_relevance.py).
+    Retorna (resposta, ChatCompletion), com o usage da recuperação (HyDE, multi-query) somado.
+    """
+    user_class = user.get("classCode")
+    # Respostas dependentes do histórico não são reaproveitáveis entre alunos
+    use_cache = not user_history
+    if retrieval.cached_response is not None:
+        assistant_response = retrieval.cached_response
+        raw_resp = build_chat_completion(assistant_response, SEMANTIC_CACHE_MODEL_NAME)
+    elif retrieval.short_circuited:
+        with span("low_relevance"):
+            assistant_response, raw_resp = await answer_low_relevance(user_prompt)
+    else:
+        assistant_messages = compose_assistant_messages(retrieval.context, user_prompt, user_history, user.get("className"))
+        tier = choose_chat_tier(user_prompt, retrieval.scores, user_history)
+        with span("completion"):
+            assistant_response, raw_resp = await AsyncAzureOpenAIClient.create_completion(messages=assistant_messages, tier=tier)
+        if use_cache and SEMANTIC_CACHE_ENABLED and retrieval.embedding:
+            with span("cache_store"):
+                await asyncio.to_thread(store_cached_answer, user_class, user_prompt, retrieval.embedding, assistant_response)
+    return assistant_response, add_usage(raw_resp, retrieval.expansion_usage)
+
 
-def core_agent_flow(user, user_prompt: str, user_history: list, log_usage=True):
-    context, metadata = search_vector_store(user_prompt, user.get("classCode"))
-    assistant_prompt = compose_assistant_prompt(context, user_prompt, user_history)
-    assistant_response, raw_resp = AzureOpenAIClient.create_completion(prompt=assistant_prompt)
+async def core_agent_flow(user, user_prompt: str, user_history: list | None = None, log_usage=True, retrieval: RetrievalResult | None = None, request_id: str | None = None, quota: QuotaReservation | None = None):
+    retrieval = retrieval or await retrieve_context(user_prompt, user.get("classCode"), not user_history)
+    assistant_response, raw_resp = await generate_answer(user, user_prompt, user_history, retrieval)
+    if quota:
+        quota.record(raw_resp)
 
     if log_usage:
-        log_usage_metrics(
+        with span("log_usage"):
+            await alog_usage_metrics(
+                user=user,
+                prompt=user_prompt,
+                response=raw_resp,
+                metadata=retrieval.metadata,
+                request_id=request_id,
+                top_similarity=retrieval.top_similarity,
+                short_circuited=retrieval.short_circuited,
+            )
+    return assistant_response, retrieval.context
+
+def coalescing_key(user: dict, prompt_enchanced: str, strategy: str | None) -> str:
+    # O prompt já inclui a disciplina; a turma define as partições consultadas
+    user_class = user.get("classCode")
+    strategy = resolve_retrieval_strategy(user_class, strategy)
+    return f"{user_class}\x1f{strategy}\x1f{normalize_embedding_text(prompt_enchanced).casefold()}"
+
+
+def shared_user(user: dict) -> dict:
+    # Só os campos da turma, os mesmos para todas as requisições agrupadas pela chave
+    return {"classCode": user.get("classCode"), "className": user.get("className")}
+
+
+async def shared_agent_flow(class_user: dict, user_prompt: str, prompt_enchanced: str, strategy: str | None, classified: tuple):
+    """
+    Parte da resposta a uma pergunta sem histórico que não depende do aluno: gate de smalltalk
+    via LLM, recuperação e completion. Recebe só os campos da turma (shared_user), e não o aluno
+    que iniciou a execução. `classified` é o resultado do classificador local, já executado pela
+    requisição. Retorna (resposta_smalltalk, None, None) ou (None, (resposta, ChatCompletion), RetrievalResult).
+    """
+    smalltalk_reply, retrieval = await detect_smalltalk_or_retrieve(class_user, user_prompt, [], prompt_enchanced, strategy, classified)
+    if smalltalk_reply is not None:
+        return smalltalk_reply, None, None
+    return None, await generate_answer(class_user, prompt_enchanced, [], retrieval), retrieval
+
+
+async def coalesced_agent_flow(user: dict, user_prompt: str, prompt_enchanced: str, strategy: str | None, request_id: str, quota: QuotaReservation | None = None) -> str:
+    """
+    Responde uma pergunta sem histórico compartilhando a execução com as requisições simultâneas
+    da mesma turma com o mesmo prompt normalizado (ver utils/single_flight.py). Cada requisição
+    registra nas métricas e na cota a sua parte dos tokens da chamada compartilhada.
+    A execução compartilhada herda o trace de quem a iniciou: só essa requisição tem em
+    request_spans as etapas de recuperação e completion; nas demais, o tempo de espera aparece
+    apenas no span `single_flight`.
+    """
+    # As respostas prontas de smalltalk usam o nome do aluno e não podem ser compartilhadas
+    with span("smalltalk_classifier"):
+        classified = await aclassify_smalltalk(user_prompt, user.get("name"))
+    is_smalltalk, canned_reply = classified
+    if is_smalltalk:
+        return canned_reply
+
+    with span("single_flight"):
+        flight = await chat_flights.do(
+            coalescing_key(user, prompt_enchanced, strategy),
+            lambda: shared_agent_flow(shared_user(user), user_prompt, prompt_enchanced, strategy, classified),
+        )
+    smalltalk_reply, answer, retrieval = flight.value
+    if smalltalk_reply is not None:
+        return smalltalk_reply
+    if flight.index == 0 and flight.participants > 1:
+        logging.info(f"[chat] {flight.participants} requisições compartilharam a resposta de {request_id}")
+
+    assistant_response, raw_resp = answer
+    raw_resp = share_usage(raw_resp, flight.participants, flight.index)
+    if quota:
+        quota.record(raw_resp)
+    with span("log_usage"):
+        await alog_usage_metrics(
             user=user,
-            prompt=user_prompt,
+            prompt=prompt_enchanced,
             response=raw_resp,
-            metadata=metadata,
+            metadata=retrieval.metadata,
+            request_id=request_id,
+            top_similarity=retrieval.top_similarity,
+            short_circuited=retrieval.short_circuited,
         )
-    return assistant_response, context
+    return assistant_response
+
+async def traced(route: str, handler, req: HttpRequest) -> func.HttpResponse:
+    """
+    Executa o handler cronometrando as etapas da requisição: devolve as durações no header
+    Server-Timing e as enfileira para request_spans.
+    """
+    request_id = str(uuid4())
+    trace = start_trace(request_id, route)
+    with span("total"):
+        response = await handler(req, request_id)
+    response.headers["Server-Timing"] = trace.server_timing()
+    persist_trace(trace)
+    return response
 
 @chat_bp.function_name(name="chat")
 @chat_bp.route(route="chat", methods=["POST"],auth_level=func.AuthLevel.ANONYMOUS)
-def main(req: HttpRequest) -> func.HttpResponse:
-    request_id = str(uuid4())
+async def main(req: HttpRequest) -> func.HttpResponse:
+    return await traced("chat", answer_chat, req)
+
+async def answer_chat(req: HttpRequest, request_id: str) -> func.HttpResponse:
     try:
-        user = validate_user_access(req, allowed_roles=[Role.TEACHER, Role.ADMIN, Role.STUDENT])
+        with span("auth"):
+            user = validate_user_access(req, allowed_roles=[Role.TEACHER, Role.ADMIN, Role.STUDENT])
         if isinstance(user, ResponseModel):
             return user
 
@@ -171,22 +364,364 @@ def main(req: HttpRequest) -> func.HttpResponse:
         if err:
             return err
 
-        smalltalk_reply = detect_and_respond_smalltalk(user_prompt, history)
-        if smalltalk_reply is not None:
+        with span("quota"):
+            reservation = reserve_tokens(user, [prompt_enchanced], history)
+        if isinstance(reservation, QuotaExceeded):
+            return quota_exceeded_response(reservation)
+
+        try:
+            body = req.get_json()
+            if not history and CHAT_COALESCING_ENABLED:
+                assistant_response = await coalesced_agent_flow(
+                    user, user_prompt, prompt_enchanced, requested_strategy(user, body), request_id, reservation
+                )
+                return ResponseModel({"id": request_id, "response": assistant_response, "history": history}, status_code=200)
+
+            with span("history"):
+                prompt_history = await asyncio.to_thread(
+                    compress_history, history, build_conversation_key(user, body.get("conversation_id"))
+                )
+            smalltalk_reply, retrieval = await detect_smalltalk_or_retrieve(
+                user, user_prompt, prompt_history, prompt_enchanced, requested_strategy(user, body)
+            )
+            if smalltalk_reply is not None:
+                payload = {
+                    "id": request_id,
+                    "response": smalltalk_reply,
+                    "history": history
+                }
+                return ResponseModel(payload, status_code=200)
+
+            assistant_response, _ = await core_agent_flow(
+                user, prompt_enchanced, prompt_history, True, retrieval, request_id, reservation
+            )
             payload = {
                 "id": request_id,
-                "response": smalltalk_reply,
+                "response": assistant_response,
                 "history": history
             }
             return ResponseModel(payload, status_code=200)
+        finally:
+            # Acerta a reserva com o uso real: devolve o que sobrou ou cobra o excedente
+            if reservation:
+                reservation.settle()
+
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except Exception as e:
+        return ResponseModel({"error": str(e)}, status_code=500)
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_timings(trace) -> dict:
+    return {stage: round(duration, 1) for stage, duration in trace.durations().items()}
 
-        assistant_response, _ = core_agent_flow(user, prompt_enchanced, history)
-        payload = {
+async def stream_chat_events(trace, user: dict, user_prompt: str, history: list, prompt_enchanced: str, body: dict):
+    """
+    Gera os eventos SSE do chat: um evento `delta` para cada trecho da resposta, e ao final
+    um evento `done` com o tempo até o primeiro token e a duração de cada etapa (o streaming
+    não tem o header Server-Timing). Em caso de falha, emite um evento `error`.
+    A cota é reservada aqui dentro, e não na rota, para que o `finally` sempre acerte a reserva:
+    se o cliente desconectar antes de o gerador começar, nada chega a ser reservado.
+    """
+    activate_trace(trace)
+    request_id = trace.request_id
+    started_at = time.perf_counter()
+    reservation = None
+    try:
+        reservation = reserve_tokens(user, [prompt_enchanced], history)
+        if isinstance(reservation, QuotaExceeded):
+            yield format_sse("error", {"id": request_id, **quota_exceeded_payload(reservation)})
+            reservation = None
+            return
+
+        with span("history"):
+            prompt_history = await asyncio.to_thread(
+                compress_history, history, build_conversation_key(user, body.get("conversation_id"))
+            )
+        smalltalk_reply, retrieval = await detect_smalltalk_or_retrieve(
+            user, user_prompt, prompt_history, prompt_enchanced, requested_strategy(user, body)
+        )
+        if smalltalk_reply is not None:
+            yield format_sse("delta", {"content": smalltalk_reply})
+            ttft_ms = (time.perf_counter() - started_at) * 1000
+            yield format_sse("done", {"id": request_id, "history": history, "ttft_ms": round(ttft_ms), "timings": stream_timings(trace)})
+            return
+
+        if retrieval.cached_response is not None:
+            yield format_sse("delta", {"content": retrieval.cached_response})
+            ttft_ms = (time.perf_counter() - started_at) * 1000
+            with span("log_usage"):
+                await alog_usage_metrics(
+                    user=user,
+                    prompt=prompt_enchanced,
+                    response=build_chat_completion(retrieval.cached_response, SEMANTIC_CACHE_MODEL_NAME),
+                    metadata=[],
+                    request_id=request_id,
+                )
+            yield format_sse("done", {"id": request_id, "history": history, "ttft_ms": round(ttft_ms), "timings": stream_timings(trace)})
+            return
+
+        if retrieval.short_circuited:
+            with span("low_relevance"):
+                assistant_response, raw_resp = await answer_low_relevance(prompt_enchanced)
+            raw_resp = add_usage(raw_resp, retrieval.expansion_usage)
+            yield format_sse("delta", {"content": assistant_response})
+            ttft_ms = (time.perf_counter() - started_at) * 1000
+            if reservation:
+                reservation.record(raw_resp)
+            with span("log_usage"):
+                await alog_usage_metrics(
+                    user=user,
+                    prompt=prompt_enchanced,
+                    response=raw_resp,
+                    metadata=retrieval.metadata,
+                    request_id=request_id,
+                    top_similarity=retrieval.top_similarity,
+                    short_circuited=True,
+                )
+            yield format_sse("done", {"id": request_id, "history": history, "ttft_ms": round(ttft_ms), "timings": stream_timings(trace)})
+            return
+
+        assistant_messages = compose_assistant_messages(retrieval.context, prompt_enchanced, prompt_history, user.get("className"))
+        with span("completion"):
+            stream = await AsyncAzureOpenAIClient.create_completion_stream(
+                messages=assistant_messages, tier=choose_chat_tier(prompt_enchanced, retrieval.scores, prompt_history)
+            )
+
+            ttft_ms = None
+            async for delta in stream:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started_at) * 1000
+                yield format_sse("delta", {"content": delta})
+
+        completion = add_usage(stream.completion, retrieval.expansion_usage)  # type: ignore
+        if reservation:
+            reservation.record(completion)
+        with span("log_usage"):
+            await alog_usage_metrics(
+                user=user,
+                prompt=prompt_enchanced,
+                response=completion,
+                metadata=retrieval.metadata,
+                request_id=request_id,
+                top_similarity=retrieval.top_similarity,
+                short_circuited=False,
+            )
+        if not prompt_history and SEMANTIC_CACHE_ENABLED and retrieval.embedding:
+            with span("cache_store"):
+                await asyncio.to_thread(
+                    store_cached_answer,
+                    user.get("classCode"), prompt_enchanced, retrieval.embedding, completion.choices[0].message.content,
+                )
+
+        model_ttft_ms = stream.time_to_first_token * 1000 if stream.time_to_first_token is not None else None
+        logging.info(
+            f"[chat_stream] {request_id} time-to-first-token: {ttft_ms or 0:.0f} ms "
+            f"(modelo: {model_ttft_ms or 0:.0f} ms)"
+        )
+        yield format_sse("done", {
             "id": request_id,
-            "response": assistant_response,
-            "history": history
-        }
-        return ResponseModel(payload, status_code=200)
+            "history": history,
+            "ttft_ms": round(ttft_ms) if ttft_ms is not None else None,
+            "timings": stream_timings(trace),
+        })
+    except Exception as e:
+        logging.error(f"Erro no streaming do chat {request_id}: {str(e)}")
+        yield format_sse("error", {"id": request_id, "error": str(e)})
+    finally:
+        if reservation:
+            reservation.settle()
+        trace.record("total", trace.started_at, time.perf_counter())
+        persist_trace(trace)
+
+@chat_bp.function_name(name="chat_stream")
+@chat_bp.route(route="chat/stream", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
+async def chat_stream(req: Request) -> StreamingResponse | JSONResponse:
+    request_id = str(uuid4())
+    trace = start_trace(request_id, "chat/stream")
+    with span("auth"):
+        user = validate_user_access(req, allowed_roles=[Role.TEACHER, Role.ADMIN, Role.STUDENT])  # type: ignore
+    if isinstance(user, ResponseModel):
+        return JSONResponse(json.loads(user.get_body()), status_code=user.status_code)
+
+    try:
+        body = await req.json()
+    except ValueError:
+        return JSONResponse({"error": "Formato JSON inválido."}, status_code=400)
+
+    user_prompt, history, prompt_enchanced, err = parse_body(body, user.get("className", None))
+    if err:
+        return JSONResponse(err, status_code=400)
+
+    # Só confere o saldo: a reserva é feita pelo gerador, que sempre a acerta ao terminar
+    with span("quota"):
+        exceeded = check_tokens(user, [prompt_enchanced], history)
+    if exceeded:
+        return JSONResponse(
+            quota_exceeded_payload(exceeded), status_code=429, headers={"Retry-After": str(exceeded.retry_after)}
+        )
+
+    return StreamingResponse(
+        stream_chat_events(trace, user, user_prompt, history, prompt_enchanced, body),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Request-Id": request_id},
+    )
+
+
+def parse_batch_body(body: dict, student_class_name: str | None):
+    """
+    Valida o corpo do chat em lote. Retorna (prompts, prompts_enchanced, erro).
+    """
+    prompts = body.get("prompts")
+    if not isinstance(prompts, list) or not prompts:
+        return None, None, {"error": "Campo 'prompts' deve ser um array não vazio."}
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return None, None, {"error": f"Máximo de {BATCH_MAX_PROMPTS} perguntas por lote."}
+    if not all(isinstance(prompt, str) and prompt.strip() for prompt in prompts):
+        return None, None, {"error": "Todas as perguntas devem ser textos não vazios."}
+
+    prompts = [prompt.strip() for prompt in prompts]
+    prompts_enchanced = [
+        f"Sobre a disciplina {student_class_name}, responda: {prompt}" if student_class_name else prompt
+        for prompt in prompts
+    ]
+    return prompts, prompts_enchanced, None
+
+
+async def retrieve_context_batch(documents: list, user_class: str | None) -> list:
+    """
+    Versão em lote de retrieve_context: todos os embeddings em uma única chamada, o cache
+    semântico consultado por pergunta e as buscas vetoriais dos misses em uma única consulta.
+    O lote usa sempre a busca vetorial simples.
+    """
+    with span("embedding"):
+        embeddings = await AsyncAzureOpenAIClient.create_embeddings(documents)
+    cached = [None] * len(documents)
+    if SEMANTIC_CACHE_ENABLED:
+        with span("semantic_cache"):
+            cached = await asyncio.gather(*(
+                asyncio.to_thread(lookup_cached_answer, user_class, embedding) for embedding in embeddings
+            ))
+
+    results = [
+        RetrievalResult(embedding=embedding, cached_response=cached_response) if cached_response is not None else None
+        for embedding, cached_response in zip(embeddings, cached)
+    ]
+    misses = [index for index, result in enumerate(results) if result is None]
+    if misses:
+        with span("search"):
+            searches = await asearch_vector_store_batch(user_class, [embeddings[index] for index in misses])
+        for index, (context, metadata, scores, top_similarity, _) in zip(misses, searches):
+            with span("pack_context"):
+                context, metadata, scores, _ = pack_context(context, metadata, scores)
+            results[index] = RetrievalResult(
+                context=context, metadata=metadata, scores=scores, embedding=embeddings[index], top_similarity=top_similarity
+            )
+            check_relevance(results[index])
+    return results
+
+
+async def answer_batch_item(semaphore: asyncio.Semaphore, user: dict, prompt: str, retrieval: RetrievalResult, reservation: QuotaReservation | None = None):
+    """
+    Gera a resposta de uma pergunta do lote, reservando a estimativa da pergunta na cota só
+    quando a completion vai começar. Retorna (resposta, ChatCompletion).
+    """
+    if retrieval.cached_response is not None:
+        return retrieval.cached_response, build_chat_completion(retrieval.cached_response, SEMANTIC_CACHE_MODEL_NAME)
+
+    async with semaphore:
+        if retrieval.short_circuited:
+            with span("low_relevance"):
+                return await answer_low_relevance(prompt)
+        exceeded = reservation.extend([prompt]) if reservation else None
+        if exceeded:
+            raise QuotaExceededError(exceeded)
+        with span("completion"):
+            assistant_response, raw_resp = await AsyncAzureOpenAIClient.create_completion(
+                messages=compose_assistant_messages(retrieval.context, prompt, class_name=user.get("className")),
+                tier=choose_chat_tier(prompt, retrieval.scores),
+            )
+    if SEMANTIC_CACHE_ENABLED and retrieval.embedding:
+        with span("cache_store"):
+            await asyncio.to_thread(
+                store_cached_answer, user.get("classCode"), prompt, retrieval.embedding, assistant_response
+            )
+    return assistant_response, raw_resp
+
+
+@chat_bp.function_name(name="chat_batch")
+@chat_bp.route(route="chat/batch", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
+async def chat_batch(req: HttpRequest) -> func.HttpResponse:
+    return await traced("chat/batch", answer_chat_batch, req)
+
+async def answer_chat_batch(req: HttpRequest, request_id: str) -> func.HttpResponse:
+    """
+    Responde várias perguntas independentes (sem histórico) da turma do usuário.
+    As respostas voltam na ordem das perguntas; uma falha em uma pergunta não derruba o lote.
+    """
+    try:
+        with span("auth"):
+            user = validate_user_access(req, allowed_roles=[Role.TEACHER, Role.ADMIN, Role.STUDENT])
+        if isinstance(user, ResponseModel):
+            return user
+
+        try:
+            body = req.get_json()
+        except ValueError:
+            return ResponseModel({"error": "Formato JSON inválido."}, status_code=400)
+
+        prompts, prompts_enchanced, err = parse_batch_body(body, user.get("className", None))
+        if err:
+            return ResponseModel(err, status_code=400)
+
+        # Para entrar, o lote reserva a estimativa de uma pergunta; cada completion reserva a sua ao
+        # começar, para que o lote não deixe os buckets muito negativos antes do acerto
+        with span("quota"):
+            reservation = reserve_tokens(user, prompts_enchanced[:1])
+        if isinstance(reservation, QuotaExceeded):
+            return quota_exceeded_response(reservation)
+
+        try:
+            user_class = user.get("classCode")
+            retrievals = await retrieve_context_batch(prompts_enchanced, user_class)
+
+            semaphore = asyncio.Semaphore(BATCH_COMPLETION_CONCURRENCY)
+            answers = await asyncio.gather(
+                *(
+                    answer_batch_item(semaphore, user, prompt, retrieval, reservation)
+                    for prompt, retrieval in zip(prompts_enchanced, retrievals)
+                ),
+                return_exceptions=True,
+            )
+            if reservation:
+                for answer in answers:
+                    if not isinstance(answer, BaseException):
+                        reservation.record(answer[1])
+        finally:
+            if reservation:
+                reservation.settle()
+
+        results, usage_entries, usage_request_ids, usage_relevance = [], [], [], []
+        for index, (prompt, retrieval, answer) in enumerate(zip(prompts_enchanced, retrievals, answers)):
+            if isinstance(answer, BaseException):
+                logging.error(f"Erro ao responder a pergunta {index} do lote {request_id}: {str(answer)}")
+                results.append({"index": index, "prompt": prompts[index], "error": str(answer)})
+                continue
+            assistant_response, raw_resp = answer
+            results.append({"index": index, "prompt": prompts[index], "response": assistant_response})
+            usage_entries.append((prompt, raw_resp, retrieval.metadata))
+            usage_request_ids.append(f"{request_id}:{index}")
+            usage_relevance.append((retrieval.top_similarity, retrieval.short_circuited))
+
+        with span("log_usage"):
+            await alog_usage_metrics_bulk(
+                user=user, entries=usage_entries, request_ids=usage_request_ids, relevance=usage_relevance
+            )
+        return ResponseModel({"id": request_id, "results": results}, status_code=200)
 
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
     except Exception as e:
-        return ResponseModel({"error": str(e)}, status_code=500)
\ No newline at end of file
+        return ResponseModel({"error": str(e)}, status_code=500)
@@ -10,6 +10,12 @@ from models.Roles import Role
 from models.ResponseModel import ResponseModel
 from utils.token_utils import validate_user_access
 from utils.db_session import SessionLocal
+from utils.tracing import stage_latency_percentiles
+from utils.token_quota import list_token_buckets
+from utils.openai_resilience import resilience_status
+from utils.deployment_pool import completion_pool
+from utils.model_tiering import tier_for, tier_stats
+from utils.low_relevance import relevance_histogram, relevance_stats
 
 # Blueprint
 dashboard_bp = func.Blueprint()
@@ -27,7 +33,7 @@ def generate_daily_summary(class_code: str, d: date, prompts: List[str]) -> str:
         f"com base nestas interações:\n\n{sample_prompts}\n\n"
         "Responda em linguagem clara e objetiva, sem citar nomes de alunos. Aponte apenas as dúvidas mais recorrentes e relevantes. Não traga explicações.\n"
     )
-    summary, _ = AzureOpenAIClient.create_completion(prompt=prompt, max_tokens=300)
+    summary, _ = AzureOpenAIClient.create_completion(prompt=prompt, max_tokens=300, tier=tier_for("daily_summary"))
     return summary.strip()
 
 def extract_insights(metrics: List[MetricsModel]) -> Dict[str, Any]:
@@ -185,3 +191,98 @@ def get_dashboard(req: func.HttpRequest) -> func.HttpResponse:
         return ResponseModel({"error": str(e)}, status_code=500)
     finally:
         db_session.close()
+
+
+@dashboard_bp.function_name(name="get_latency_dashboard")
+@dashboard_bp.route(route="dashboard/latency", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+def get_latency_dashboard(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    p50/p95/p99 (ms) de cada etapa do chat. Parâmetros opcionais: hours (padrão 24) e route
+    (chat, chat/stream ou chat/batch).
+    """
+    user = validate_user_access(req, allowed_roles=[Role.ADMIN])
+    if isinstance(user, ResponseModel):
+        return user
+
+    try:
+        hours = int(req.params.get("hours", "24"))
+    except ValueError:
+        return ResponseModel({"error": "Parâmetro 'hours' deve ser um número inteiro."}, status_code=400)
+
+    try:
+        stages = stage_latency_percentiles(hours=hours, route=req.params.get("route"))
+        return ResponseModel({"hours": hours, "stages": stages}, status_code=200)
+    except Exception as e:
+        logging.error(f"Erro ao recuperar latências: {str(e)}")
+        return ResponseModel({"error": str(e)}, status_code=500)
+
+
+@dashboard_bp.function_name(name="get_quota_dashboard")
+@dashboard_bp.route(route="dashboard/quotas", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+def get_quota_dashboard(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Saldo, consumo e requisições recusadas dos buckets de cota. O admin vê todos; o professor,
+    os das suas turmas e dos alunos delas.
+    """
+    user = validate_user_access(req, allowed_roles=[Role.ADMIN, Role.TEACHER])
+    if isinstance(user, ResponseModel):
+        return user
+
+    try:
+        if user.get("role") == Role.ADMIN.value:
+            buckets = list_token_buckets()
+        else:
+            db_session = SessionLocal()
+            try:
+                classes = db_session.execute(
+                    select(ClassModel).where(ClassModel.teacher.has(email=user.get("email")))
+                ).scalars().all()
+                class_codes = [c.class_code for c in classes]
+                emails = [email for c in classes for email in (c.students or [])]
+            finally:
+                db_session.close()
+            buckets = list_token_buckets(class_codes=class_codes, emails=emails)
+        return ResponseModel({"buckets": buckets}, status_code=200)
+    except Exception as e:
+        logging.error(f"Erro ao recuperar as cotas de tokens: {str(e)}")
+        return ResponseModel({"error": str(e)}, status_code=500)
+
+
+@dashboard_bp.function_name(name="get_openai_dashboard")
+@dashboard_bp.route(route="dashboard/openai", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+def get_openai_dashboard(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Contadores de novas tentativas, failover, circuit breaker e hedge das chamadas ao Azure OpenAI
+    desta instância, a saúde de cada deployment do pool de completions e as chamadas, falhas,
+    respostas truncadas ou vazias e latências de cada camada de modelo.
+    """
+    user = validate_user_access(req, allowed_roles=[Role.ADMIN])
+    if isinstance(user, ResponseModel):
+        return user
+    return ResponseModel(
+        {**resilience_status(), "deployments": completion_pool.status(), "tiers": tier_stats.snapshot()}, status_code=200
+    )
+
+
+@dashboard_bp.function_name(name="get_relevance_dashboard")
+@dashboard_bp.route(route="dashboard/relevance", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+def get_relevance_dashboard(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Histograma da similaridade do melhor chunk e taxa de respostas pelo atalho de baixa relevância,
+    para calibrar LOW_RELEVANCE_THRESHOLD. Parâmetros opcionais: hours (padrão 168) e class_code.
+    """
+    user = validate_user_access(req, allowed_roles=[Role.ADMIN])
+    if isinstance(user, ResponseModel):
+        return user
+
+    try:
+        hours = int(req.params.get("hours", "168"))
+    except ValueError:
+        return ResponseModel({"error": "Parâmetro 'hours' deve ser um número inteiro."}, status_code=400)
+
+    try:
+        histogram = relevance_histogram(hours=hours, class_code=req.params.get("class_code"))
+        return ResponseModel({"hours": hours, **histogram, "instance": relevance_stats.snapshot()}, status_code=200)
+    except Exception as e:
+        logging.error(f"Erro ao recuperar a distribuição de relevância: {str(e)}")
+        return ResponseModel({"error": str(e)}, status_code=500)
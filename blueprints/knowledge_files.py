@@ -11,6 +11,9 @@ from models.ResponseModel import ResponseModel
 from utils.token_utils import validate_user_access
 from utils.blob_utils import upload_file, delete_blob
 from utils.db_session import SessionLocal
+from utils.semantic_cache import invalidate_class_cache
+from utils.ann_index import ANN_METHODS, CONFIGURED_LAYOUT, QUANTIZATIONS, IndexLayout, ann_index_status, start_ann_rebuild
+from configs.settings import ANN_INDEX_METHOD
 
 files_bp = func.Blueprint()
 
@@ -108,6 +111,7 @@ def upload_file_endpoint(req: func.HttpRequest) -> func.HttpResponse:
         db_session.add(file_record)
         db_session.commit()
         db_session.close()
+        invalidate_class_cache(folder)
 
         return ResponseModel({
             'message': 'Arquivo enviado com sucesso.',
@@ -143,10 +147,57 @@ def delete_file_endpoint(req: func.HttpRequest) -> func.HttpResponse:
             {"file_id": file_id}
         )
         # Remove metadata do Postgres
+        class_code = file_rec.class_code
         db_session.delete(file_rec)
         db_session.commit()
         db_session.close()
+        invalidate_class_cache(class_code)
 
         return ResponseModel({'message': 'Arquivo removido com sucesso.'}, status_code=200)
     except Exception as e:
         return ResponseModel({'error': str(e)}, status_code=500)
+
+@files_bp.function_name(name="get_vector_index_status")
+@files_bp.route(route="files/index", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+def get_vector_index_status(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        user = validate_user_access(req, allowed_roles=[Role.ADMIN])
+        if isinstance(user, ResponseModel):
+            return user
+
+        return ResponseModel(ann_index_status(), status_code=200)
+    except Exception as e:
+        return ResponseModel({'error': str(e)}, status_code=500)
+
+@files_bp.function_name(name="rebuild_vector_index")
+@files_bp.route(route="files/index/rebuild", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
+def rebuild_vector_index(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        user = validate_user_access(req, allowed_roles=[Role.ADMIN])
+        if isinstance(user, ResponseModel):
+            return user
+
+        try:
+            data = req.get_json()
+        except ValueError:
+            data = {}
+        method = data.get('method', ANN_INDEX_METHOD)
+        if method not in ANN_METHODS:
+            return ResponseModel({'error': "Campo 'method' deve ser 'hnsw' ou 'ivfflat'."}, status_code=400)
+        quantization = data.get('quantization', CONFIGURED_LAYOUT.quantization)
+        if quantization not in QUANTIZATIONS:
+            return ResponseModel({'error': "Campo 'quantization' deve ser 'none', 'halfvec' ou 'binary'."}, status_code=400)
+        prefix_dimensions = data.get('prefix_dimensions', CONFIGURED_LAYOUT.prefix_dimensions) or 0
+        if not isinstance(prefix_dimensions, int):
+            return ResponseModel({'error': "Campo 'prefix_dimensions' deve ser um número inteiro."}, status_code=400)
+
+        layout = IndexLayout(quantization, prefix_dimensions)
+        try:
+            started = start_ann_rebuild(method, layout)
+        except ValueError as e:
+            return ResponseModel({'error': str(e)}, status_code=400)
+        if not started:
+            return ResponseModel({'error': 'Já existe uma reconstrução em andamento.'}, status_code=409)
+        return ResponseModel({'message': f'Reconstrução dos índices ({method}, {layout.as_dict()}) iniciada.'}, status_code=202)
+    except Exception as e:
+        return ResponseModel({'error': str(e)}, status_code=500)
@@ -14,6 +14,10 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document as LangchainDocument
 
 from configs.settings import embeddings, vector_store
+from utils.semantic_cache import invalidate_class_cache
+from utils.vector_search import migrate_knowledge_schema, ensure_class_partition
+from utils.token_counter import token_count
+from utils.model_tiering import tier_for
 from PyPDF2 import PdfReader
 from docx import Document as DocxDocument
 
@@ -90,13 +94,25 @@ def process_raw_training_data(blob: func.InputStream):
             logging.debug(f"Bloco semântico com metadata {doc.metadata} gerou {len(sub_chunks)} sub-chunks.")
             for chunk in sub_chunks:
                 cleared_text = chunk.replace("\n", " ").replace("\r", " ").strip()
+                # A contagem de tokens fica no metadata para o empacotamento de contexto não tokenizar na consulta
                 final_docs.append(
-                    LangchainDocument(page_content=cleared_text, metadata=doc.metadata)
+                    LangchainDocument(
+                        page_content=cleared_text,
+                        metadata={**doc.metadata, "token_count": token_count(cleared_text)}
+                    )
                 )
 
-        # 5) Armazena os chunks finais no vector store
+        # 5) Armazena os chunks finais no vector store (o tsvector da busca híbrida é gerado na inserção)
+        try:
+            migrate_knowledge_schema()
+        except Exception as e:
+            # A inserção não depende da migração; a próxima ingestão (ou o comando de migração) tenta de novo
+            logging.error(f"Erro ao migrar o schema da base de conhecimento: {str(e)}")
         vector_store.add_documents(final_docs)
+        ensure_class_partition(class_code)
         logging.info(f"{len(final_docs)} chunks inseridos no vector store.")
+        # O upload já invalidou o cache, mas respostas geradas durante o processamento ficariam desatualizadas
+        invalidate_class_cache(class_code)
 
     except Exception as e:
         logging.error(f"Erro ao processar o arquivo {blob.name}: {str(e)}")
@@ -113,7 +129,7 @@ def extract_metadata(text: str) -> DocumentMetadata:
             "Responda no formato JSON: {\"tags\": [\"...\"], \"category\": \"...\", \"subcategory\": \"...\"}"
         )
         response_text = AzureOpenAIClient.create_completion_json(
-            prompt=prompt, max_tokens=300, temperature=0.6
+            prompt=prompt, max_tokens=300, temperature=0.6, tier=tier_for("metadata")
         )
         if not response_text:
             return DocumentMetadata(text=text, category="Outros", subcategory="Outros", tags=[])
@@ -152,11 +168,3 @@ def clean_utf8_text(raw_text: str) -> str:
     text = unicodedata.normalize("NFKC", raw_text)
     text = ''.join(c for c in text if unicodedata.category(c)[0] != 'C')
     return text.strip()
-
-def token_count(input_string) -> int:
-    import tiktoken
-
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = encoding.encode(input_string)
-    token_count = len(tokens)
-    return token_count
\ No newline at end of file
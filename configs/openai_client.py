@@ -1,40 +1,155 @@
 import logging
 import os
-from openai import AzureOpenAI
+import time
+from uuid import uuid4
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.completion_usage import CompletionUsage
+from constants import EMBEDDING_DIMENSIONS
+from utils.embedding_cache import embedding_cache
+from utils.openai_resilience import call_with_retry, acall_with_retry
+from utils.deployment_pool import completion_pool
+from utils.model_tiering import STRONG
 
 DEFAULT_TEMPERATURE = 0.4
 DEFAULT_MAX_TOKENS = 400
 
+def build_chat_completion(content: str, model: str, usage: CompletionUsage | None = None, finish_reason: str = "stop") -> ChatCompletion:
+    """
+    Monta uma ChatCompletion a partir do texto final, para que respostas que não vieram
+    de uma chamada única (ex.: streaming) possam seguir o mesmo fluxo de métricas.
+    """
+    return ChatCompletion(
+        id=f"chatcmpl-{uuid4().hex}",
+        object="chat.completion",
+        created=int(time.time()),
+        model=model,
+        choices=[
+            Choice(
+                index=0,
+                finish_reason=finish_reason,  # type: ignore
+                message=ChatCompletionMessage(role="assistant", content=content),
+            )
+        ],
+        usage=usage or CompletionUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0),
+    )
+
+
+def build_messages(prompt: str | None, messages: list[dict] | None) -> list[dict]:
+    """
+    Usa as mensagens estruturadas quando informadas; senão, envia o prompt como uma única mensagem de sistema.
+    """
+    return messages if messages is not None else [{"content": prompt, "role": "system"}]
+
+
+class CompletionStream:
+    """
+    Itera sobre os trechos de texto de uma completion em streaming, conforme chegam do Azure OpenAI.
+    Aceita tanto o stream do cliente síncrono (`for`) quanto o do assíncrono (`async for`).
+    Ao final da iteração, `completion` contém a ChatCompletion consolidada (com usage) e
+    `time_to_first_token` o tempo, em segundos, entre a chamada e o primeiro trecho recebido.
+    """
+
+    def __init__(self, stream, model: str, started_at: float):
+        self._stream = stream
+        self._model = model
+        self._started_at = started_at
+        self._parts: list[str] = []
+        self._usage: CompletionUsage | None = None
+        self._finish_reason = "stop"
+        self.time_to_first_token: float | None = None
+        self.completion: ChatCompletion | None = None
+
+    def _handle_chunk(self, chunk) -> str | None:
+        # Com include_usage, o último chunk traz apenas o usage e nenhuma choice
+        if chunk.usage:
+            self._usage = chunk.usage
+        if not chunk.choices:
+            return None
+
+        choice = chunk.choices[0]
+        if choice.finish_reason:
+            self._finish_reason = choice.finish_reason
+        delta = choice.delta.content if choice.delta else None
+        if not delta:
+            return None
+
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self._started_at
+        self._parts.append(delta)
+        return delta
+
+    def _finish(self) -> None:
+        self.completion = build_chat_completion("".join(self._parts), self._model, self._usage, self._finish_reason)
+
+    def __iter__(self):
+        for chunk in self._stream:
+            delta = self._handle_chunk(chunk)
+            if delta:
+                yield delta
+        self._finish()
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            delta = self._handle_chunk(chunk)
+            if delta:
+                yield delta
+        self._finish()
+
+
 class AzureOpenAIClient:
     EMBEDDING_MODEL = os.environ["OPENAI_EMBEDDING_MODEL"]
     COMPLETION_MODEL= os.environ["AZURE_OPENAI_MODEL"]
-    CLIENT = AzureOpenAI()
+    # Cliente dos embeddings; as completions usam o pool de deployments (utils/deployment_pool.py).
+    # As novas tentativas ficam a cargo de utils/openai_resilience.py
+    CLIENT = AzureOpenAI(max_retries=0)
 
     @staticmethod
-    def create_completion(prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS, temperature: float = DEFAULT_TEMPERATURE):
+    def create_completion(prompt: str | None = None, max_tokens: int = DEFAULT_MAX_TOKENS, temperature: float = DEFAULT_TEMPERATURE, messages: list[dict] | None = None, tier: str = STRONG):
         try:
-            response = AzureOpenAIClient.CLIENT.chat.completions.create(
-                model=AzureOpenAIClient.COMPLETION_MODEL,
-                messages=[{"content": prompt, "role": "system"}],
+            response, _ = completion_pool.call("completion", lambda deployment: deployment.client.chat.completions.with_raw_response.create(
+                model=deployment.deployment,
+                messages=build_messages(prompt, messages),
                 max_tokens=max_tokens,
                 temperature=temperature,
-            )
-            print(response)
+            ), tier=tier)
             return (response.choices[0].message.content, response)
         except Exception as e:
             logging.error(f"Erro ao criar completion: {str(e)}")
             raise
 
     @staticmethod
-    def create_completion_json(prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS, temperature: float = DEFAULT_TEMPERATURE):
+    def create_completion_stream(prompt: str | None = None, max_tokens: int = DEFAULT_MAX_TOKENS, temperature: float = DEFAULT_TEMPERATURE, messages: list[dict] | None = None, tier: str = STRONG) -> CompletionStream:
+        try:
+            started_at = time.perf_counter()
+            # Só a abertura do stream é repetida; depois do primeiro trecho, uma falha vai ao cliente
+            stream, deployment = completion_pool.call("completion", lambda deployment: deployment.client.chat.completions.with_raw_response.create(
+                model=deployment.deployment,
+                messages=build_messages(prompt, messages),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+            ), tier=tier)
+            return CompletionStream(stream, deployment.deployment, started_at)
+        except Exception as e:
+            logging.error(f"Erro ao criar completion em streaming: {str(e)}")
+            raise
+
+    @staticmethod
+    def create_completion_json(prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS, temperature: float = DEFAULT_TEMPERATURE, tier: str = STRONG, with_response: bool = False):
         try:
-            response = AzureOpenAIClient.CLIENT.chat.completions.create(
-                model=AzureOpenAIClient.COMPLETION_MODEL,
+            response, _ = completion_pool.call("completion_json", lambda deployment: deployment.client.chat.completions.with_raw_response.create(
+                model=deployment.deployment,
                 messages=[{"content": prompt, "role": "system"}],
                 max_tokens=max_tokens,
                 temperature=temperature,
                 response_format={"type": "json_object"}
-            )
+            ), tier=tier)
+            # with_response devolve também a ChatCompletion, para contabilizar o usage
+            if with_response:
+                return (response.choices[0].message.content, response)
             return response.choices[0].message.content
         except Exception as e:
             logging.error(f"Erro ao criar completion JSON: {str(e)}")
@@ -42,13 +157,105 @@ class AzureOpenAIClient:
 
     @staticmethod
     def create_embedding(input_text: str):
+        return AzureOpenAIClient.create_embeddings([input_text])[0]
+
+    @staticmethod
+    def create_embeddings(input_texts: list[str]) -> list[list[float]]:
+        """
+        Gera os embeddings dos textos em uma única chamada à API, apenas para os que não estão
+        no cache de embeddings (memória + Postgres).
+        """
+        def request_embeddings(missing: list[str]) -> list[list[float]]:
+            try:
+                response = call_with_retry("embedding", lambda: AzureOpenAIClient.CLIENT.embeddings.create(
+                    model=AzureOpenAIClient.EMBEDDING_MODEL,
+                    dimensions=EMBEDDING_DIMENSIONS,
+                    input=missing
+                ))
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except Exception as e:
+                logging.error(f"Erro ao criar embedding: {str(e)}")
+                raise
+
+        return embedding_cache.get_or_create(
+            input_texts, AzureOpenAIClient.EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, request_embeddings
+        )
+
+
+class AsyncAzureOpenAIClient:
+    """
+    Variante assíncrona do AzureOpenAIClient, para que um worker atenda vários chats
+    concorrentes enquanto aguarda o Azure OpenAI.
+    """
+    CLIENT = AsyncAzureOpenAI(max_retries=0)
+
+    @staticmethod
+    async def create_completion(prompt: str | None = None, max_tokens: int = DEFAULT_MAX_TOKENS, temperature: float = DEFAULT_TEMPERATURE, messages: list[dict] | None = None, tier: str = STRONG):
         try:
-            embedding = AzureOpenAIClient.CLIENT.embeddings.create(
-                model=AzureOpenAIClient.EMBEDDING_MODEL,
-                dimensions=1536,
-                input=input_text
-            )
-            return embedding.data[0].embedding
+            response, _ = await completion_pool.acall("completion", lambda deployment: deployment.aclient.chat.completions.with_raw_response.create(
+                model=deployment.deployment,
+                messages=build_messages(prompt, messages),
+                max_tokens=max_tokens,
+                temperature=temperature,
+            ), tier=tier)
+            return (response.choices[0].message.content, response)
         except Exception as e:
-            logging.error(f"Erro ao criar embedding: {str(e)}")
+            logging.error(f"Erro ao criar completion: {str(e)}")
             raise
+
+    @staticmethod
+    async def create_completion_stream(prompt: str | None = None, max_tokens: int = DEFAULT_MAX_TOKENS, temperature: float = DEFAULT_TEMPERATURE, messages: list[dict] | None = None, tier: str = STRONG) -> CompletionStream:
+        try:
+            started_at = time.perf_counter()
+            stream, deployment = await completion_pool.acall("completion", lambda deployment: deployment.aclient.chat.completions.with_raw_response.create(
+                model=deployment.deployment,
+                messages=build_messages(prompt, messages),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+            ), tier=tier)
+            return CompletionStream(stream, deployment.deployment, started_at)
+        except Exception as e:
+            logging.error(f"Erro ao criar completion em streaming: {str(e)}")
+            raise
+
+    @staticmethod
+    async def create_completion_json(prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS, temperature: float = DEFAULT_TEMPERATURE, tier: str = STRONG, with_response: bool = False):
+        try:
+            response, _ = await completion_pool.acall("completion_json", lambda deployment: deployment.aclient.chat.completions.with_raw_response.create(
+                model=deployment.deployment,
+                messages=[{"content": prompt, "role": "system"}],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                response_format={"type": "json_object"}
+            ), tier=tier)
+            # with_response devolve também a ChatCompletion, para contabilizar o usage
+            if with_response:
+                return (response.choices[0].message.content, response)
+            return response.choices[0].message.content
+        except Exception as e:
+            logging.error(f"Erro ao criar completion JSON: {str(e)}")
+            raise
+
+    @staticmethod
+    async def create_embedding(input_text: str):
+        return (await AsyncAzureOpenAIClient.create_embeddings([input_text]))[0]
+
+    @staticmethod
+    async def create_embeddings(input_texts: list[str]) -> list[list[float]]:
+        async def request_embeddings(missing: list[str]) -> list[list[float]]:
+            try:
+                response = await acall_with_retry("embedding", lambda: AsyncAzureOpenAIClient.CLIENT.embeddings.create(
+                    model=AzureOpenAIClient.EMBEDDING_MODEL,
+                    dimensions=EMBEDDING_DIMENSIONS,
+                    input=missing
+                ))
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except Exception as e:
+                logging.error(f"Erro ao criar embedding: {str(e)}")
+                raise
+
+        return await embedding_cache.aget_or_create(
+            input_texts, AzureOpenAIClient.EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, request_embeddings
+        )
@@ -1,19 +1,162 @@
+import json
 import os
-from langchain_postgres import PGVector
-from langchain_openai import AzureOpenAIEmbeddings
+
+# Cache de embeddings (utils/embedding_cache.py). Definido antes do import abaixo, porque o
+# módulo do cache lê estes valores de configs.settings ao ser importado.
+# Cada entrada em memória ocupa 4 bytes por dimensão (~6 KB com 1536 dimensões)
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.environ.get("EMBEDDING_CACHE_MEMORY_SIZE", "5000"))
+EMBEDDING_CACHE_PERSISTENT = os.environ.get("EMBEDDING_CACHE_PERSISTENT", "true").lower() == "true"
+
+from langchain_postgres import PGVector  # noqa: E402
+from langchain_openai import AzureOpenAIEmbeddings  # noqa: E402
+from utils.embedding_cache import CachedEmbeddings  # noqa: E402
+from constants import EMBEDDING_DIMENSIONS, KNOWLEDGE_COLLECTION_NAME  # noqa: E402
 
 USERS_TABLE = "users"
 CLASSES_TABLE = "classes"
 METRICS_TABLE = "metrics"
 DASHBOARD_TABLE = "dashboard"
 
-embeddings = AzureOpenAIEmbeddings(
-    model=os.environ.get("OPENAI_EMBEDDING_MODEL"),
-    dimensions=os.environ.get("OPENAI_EMBEDDING_MODEL_DIMENSIONS")
+EMBEDDING_MODEL = os.environ.get("OPENAI_EMBEDDING_MODEL", "")
+
+# A ingestão usa o mesmo cache de embeddings e a mesma dimensão (constants.EMBEDDING_DIMENSIONS) do AzureOpenAIClient
+embeddings = CachedEmbeddings(
+    AzureOpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS
+    ),
+    model=EMBEDDING_MODEL,
+    dimensions=EMBEDDING_DIMENSIONS,
 )
 vector_store = PGVector(
     embeddings=embeddings,
-    collection_name="knowledge",
+    collection_name=KNOWLEDGE_COLLECTION_NAME,
     connection=os.environ.get("PGSQL_CONNECTION"),
     use_jsonb=True,
-)
\ No newline at end of file
+)
+
+# Gate local de smalltalk (utils/smalltalk_classifier.py)
+SMALLTALK_CONFIDENCE_THRESHOLD = float(os.environ.get("SMALLTALK_CONFIDENCE_THRESHOLD", "0.8"))
+SMALLTALK_TRAINING_METRICS_LIMIT = int(os.environ.get("SMALLTALK_TRAINING_METRICS_LIMIT", "500"))
+
+# Cache semântico de respostas (utils/semantic_cache.py)
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SEMANTIC_CACHE_MAX_ENTRIES_PER_CLASS = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES_PER_CLASS", "500"))
+
+# Empacotamento do contexto recuperado (utils/context_packer.py)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+# Estratégias de recuperação (utils/retrieval.py): plain, hyde, hybrid ou multi_query
+DEFAULT_RETRIEVAL_STRATEGY = os.environ.get("RETRIEVAL_STRATEGY", "hybrid")
+# Ex.: {"TURMA-2025-1": "hyde"}
+RETRIEVAL_STRATEGY_BY_CLASS = json.loads(os.environ.get("RETRIEVAL_STRATEGY_BY_CLASS", "{}"))
+# Prazo da etapa de expansão da consulta; ao estourar, a estratégia cai para a busca vetorial simples
+RETRIEVAL_LATENCY_BUDGETS_MS = json.loads(os.environ.get("RETRIEVAL_LATENCY_BUDGETS_MS", '{"hyde": 1500, "multi_query": 1200}'))
+HYDE_CACHE_SIZE = int(os.environ.get("HYDE_CACHE_SIZE", "1000"))
+HYDE_CACHE_TTL_SECONDS = int(os.environ.get("HYDE_CACHE_TTL_SECONDS", str(24 * 3600)))
+MULTI_QUERY_COUNT = int(os.environ.get("MULTI_QUERY_COUNT", "3"))
+
+# Busca híbrida textual + vetorial (utils/vector_search.py)
+# Candidatos de cada busca antes da fusão; os RETRIEVAL_CANDIDATES primeiros da fusão passam pelo MMR
+HYBRID_SEARCH_CANDIDATES = int(os.environ.get("HYBRID_SEARCH_CANDIDATES", "30"))
+HYBRID_SEARCH_RRF_K = int(os.environ.get("HYBRID_SEARCH_RRF_K", "60"))
+
+# Compressão do histórico de conversa (utils/history_compression.py)
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "600"))
+HISTORY_MAX_MESSAGES = int(os.environ.get("HISTORY_MAX_MESSAGES", "50"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.environ.get("HISTORY_SUMMARY_MAX_TOKENS", "200"))
+
+# Chat em lote (POST /api/chat/batch)
+BATCH_MAX_PROMPTS = int(os.environ.get("BATCH_MAX_PROMPTS", "50"))
+BATCH_COMPLETION_CONCURRENCY = int(os.environ.get("BATCH_COMPLETION_CONCURRENCY", "8"))
+
+# Índices aproximados (ANN) da base de conhecimento (utils/ann_index.py): hnsw ou ivfflat
+ANN_INDEX_METHOD = os.environ.get("ANN_INDEX_METHOD", "hnsw")
+ANN_HNSW_M = int(os.environ.get("ANN_HNSW_M", "16"))
+ANN_HNSW_EF_CONSTRUCTION = int(os.environ.get("ANN_HNSW_EF_CONSTRUCTION", "64"))
+ANN_IVFFLAT_LISTS = int(os.environ.get("ANN_IVFFLAT_LISTS", "100"))
+# Recall desejado na busca; define hnsw.ef_search / ivfflat.probes de cada consulta
+ANN_RECALL_TARGET = float(os.environ.get("ANN_RECALL_TARGET", "0.95"))
+# Quantização do índice ANN: "none" (float32), "halfvec" (float16) ou "binary" (1 bit por dimensão).
+# Com quantização, o índice busca candidatos a mais e eles são reordenados pelo vetor completo da tabela.
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "none")
+# Índice ANN só com as primeiras N dimensões do embedding (Matryoshka), com reordenação pelo vetor completo; 0 desliga
+VECTOR_SEARCH_PREFIX_DIMENSIONS = int(os.environ.get("VECTOR_SEARCH_PREFIX_DIMENSIONS", "0"))
+# Quantas vezes mais candidatos o primeiro estágio busca antes da reordenação, por quantização e com prefixo
+# (os fatores se multiplicam)
+VECTOR_RESCORE_OVERSAMPLING = json.loads(os.environ.get("VECTOR_RESCORE_OVERSAMPLING", json.dumps({"halfvec": 2, "binary": 8, "prefix": 4})))
+
+# Recuperação com k adaptativo e diversificação por MMR (utils/mmr.py)
+RETRIEVAL_CANDIDATES = int(os.environ.get("RETRIEVAL_CANDIDATES", "30"))
+RETRIEVAL_MIN_K = int(os.environ.get("RETRIEVAL_MIN_K", "2"))
+RETRIEVAL_MAX_K = int(os.environ.get("RETRIEVAL_MAX_K", "10"))
+# Queda mínima de similaridade entre dois candidatos consecutivos para cortar a lista ali
+ADAPTIVE_K_MIN_DROP = float(os.environ.get("ADAPTIVE_K_MIN_DROP", "0.05"))
+# 1 = só relevância; 0 = só diversidade
+MMR_LAMBDA = float(os.environ.get("MMR_LAMBDA", "0.5"))
+
+# Gravação das métricas de uso em segundo plano (utils/metrics_writer.py)
+# memory: fila em memória, sem garantia em caso de queda do processo; spool: cada registro vai antes para um arquivo local
+METRICS_WRITE_MODE = os.environ.get("METRICS_WRITE_MODE", "memory")
+METRICS_SPOOL_DIR = os.environ.get("METRICS_SPOOL_DIR", os.path.join(os.environ.get("TMPDIR", "/tmp"), "metrics-spool"))
+METRICS_FLUSH_SIZE = int(os.environ.get("METRICS_FLUSH_SIZE", "100"))
+METRICS_FLUSH_INTERVAL_SECONDS = float(os.environ.get("METRICS_FLUSH_INTERVAL_SECONDS", "2"))
+METRICS_FLUSH_RETRIES = int(os.environ.get("METRICS_FLUSH_RETRIES", "3"))
+METRICS_QUEUE_MAX_SIZE = int(os.environ.get("METRICS_QUEUE_MAX_SIZE", "10000"))
+
+# Cotas de tokens por aluno (e-mail) e por turma (utils/token_quota.py)
+QUOTA_ENABLED = os.environ.get("QUOTA_ENABLED", "true").lower() == "true"
+QUOTA_USER_TOKENS_PER_MINUTE = int(os.environ.get("QUOTA_USER_TOKENS_PER_MINUTE", "20000"))
+QUOTA_USER_BURST_TOKENS = int(os.environ.get("QUOTA_USER_BURST_TOKENS", "40000"))
+QUOTA_CLASS_TOKENS_PER_MINUTE = int(os.environ.get("QUOTA_CLASS_TOKENS_PER_MINUTE", "200000"))
+QUOTA_CLASS_BURST_TOKENS = int(os.environ.get("QUOTA_CLASS_BURST_TOKENS", "400000"))
+QUOTA_SYNC_INTERVAL_SECONDS = float(os.environ.get("QUOTA_SYNC_INTERVAL_SECONDS", "5"))
+
+# Perguntas idênticas e simultâneas (sem histórico) da mesma turma compartilham uma única execução (utils/single_flight.py)
+CHAT_COALESCING_ENABLED = os.environ.get("CHAT_COALESCING_ENABLED", "true").lower() == "true"
+
+# Resiliência das chamadas ao Azure OpenAI (utils/openai_resilience.py)
+# Novas tentativas por tipo de chamada; o atraso é exponencial com jitter, ou o Retry-After da resposta
+OPENAI_RETRY_POLICIES = json.loads(os.environ.get("OPENAI_RETRY_POLICIES", json.dumps({
+    "completion": {"max_retries": 3, "base_delay_ms": 500, "max_delay_ms": 8000},
+    "completion_json": {"max_retries": 2, "base_delay_ms": 300, "max_delay_ms": 4000},
+    "embedding": {"max_retries": 4, "base_delay_ms": 200, "max_delay_ms": 4000},
+})))
+OPENAI_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("OPENAI_CIRCUIT_FAILURE_THRESHOLD", "5"))
+OPENAI_CIRCUIT_RESET_SECONDS = float(os.environ.get("OPENAI_CIRCUIT_RESET_SECONDS", "30"))
+OPENAI_EMBEDDING_HEDGE_ENABLED = os.environ.get("OPENAI_EMBEDDING_HEDGE_ENABLED", "true").lower() == "true"
+# A segunda requisição de embedding sai quando a primeira passa deste percentil das latências recentes
+OPENAI_EMBEDDING_HEDGE_PERCENTILE = float(os.environ.get("OPENAI_EMBEDDING_HEDGE_PERCENTILE", "0.95"))
+OPENAI_EMBEDDING_HEDGE_MIN_SAMPLES = int(os.environ.get("OPENAI_EMBEDDING_HEDGE_MIN_SAMPLES", "50"))
+
+# Pool de deployments de completion do Azure OpenAI (utils/deployment_pool.py)
+# Ex.: [{"name": "eastus", "endpoint": "https://...", "api_key": "...", "deployment": "gpt-4o-mini", "weight": 2}]
+# Vazio: um único deployment com AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY e AZURE_OPENAI_MODEL
+AZURE_OPENAI_DEPLOYMENTS = json.loads(os.environ.get("AZURE_OPENAI_DEPLOYMENTS", "[]"))
+DEPLOYMENT_LATENCY_EWMA_ALPHA = float(os.environ.get("DEPLOYMENT_LATENCY_EWMA_ALPHA", "0.2"))
+# Abaixo desta cota restante (x-ratelimit-remaining-tokens), o peso do deployment cai proporcionalmente
+DEPLOYMENT_LOW_QUOTA_TOKENS = int(os.environ.get("DEPLOYMENT_LOW_QUOTA_TOKENS", "10000"))
+
+# Camadas de modelo (utils/model_tiering.py): "fast" (barato) ou "strong"; "auto" escolhe pela complexidade da pergunta
+MODEL_TIER_BY_CALL = json.loads(os.environ.get("MODEL_TIER_BY_CALL", json.dumps({
+    "chat": "auto",
+    "smalltalk": "fast",
+    "metadata": "fast",
+    "hyde": "fast",
+    "multi_query": "fast",
+    "history_summary": "fast",
+    "daily_summary": "strong",
+})))
+# Perguntas com complexidade estimada (0 a 1) a partir deste valor vão para a camada "strong"
+MODEL_TIER_COMPLEXITY_THRESHOLD = float(os.environ.get("MODEL_TIER_COMPLEXITY_THRESHOLD", "0.45"))
+# Deployment da camada "fast" no mesmo endpoint, quando AZURE_OPENAI_DEPLOYMENTS não é usado
+AZURE_OPENAI_FAST_MODEL = os.environ.get("AZURE_OPENAI_FAST_MODEL")
+
+# Atalho para perguntas sem material relevante (utils/low_relevance.py)
+# "template": resposta pronta com o canal institucional; "fast_model": camada "fast" sem contexto; "off": desativado
+LOW_RELEVANCE_MODE = os.environ.get("LOW_RELEVANCE_MODE", "template")
+# Abaixo desta similaridade de cosseno entre a pergunta e o melhor chunk, a completion com contexto é pulada
+LOW_RELEVANCE_THRESHOLD = float(os.environ.get("LOW_RELEVANCE_THRESHOLD", "0.3"))
@@ -0,0 +1,129 @@
+"""
+Exemplos rotulados usados para treinar o classificador local de smalltalk
+(utils/smalltalk_classifier.py) e as respostas prontas de cada intenção.
+
+Intenções sem resposta pronta (ex.: "conversation") nunca são respondidas localmente:
+quando o classificador as identifica, a decisão é delegada ao LLM, que tem o histórico.
+"""
+
+DOMAIN_INTENT = "domain"
+
+SMALLTALK_EXAMPLES = {
+    "greeting": [
+        "oi", "olá", "ola", "oie", "oii", "oi tudo bem", "olá tudo bem", "bom dia", "boa tarde", "boa noite",
+        "bom dia professor", "boa tarde assistente", "e aí", "eai", "opa", "salve", "hey", "hello", "hi",
+        "oi, bom dia", "olá, boa noite", "oi sagefy", "olá assistente",
+    ],
+    "wellbeing": [
+        "tudo bem?", "tudo bem com você?", "como você está?", "como vai?", "tudo certo?", "beleza?",
+        "tudo joia?", "como você tá?", "está tudo bem?", "como estão as coisas?",
+    ],
+    "thanks": [
+        "obrigado", "obrigada", "muito obrigado", "muito obrigada", "valeu", "valeu mesmo", "brigado",
+        "obrigado pela ajuda", "obrigada pela resposta", "agradeço", "show, obrigado", "perfeito, obrigado",
+        "ajudou muito, valeu", "entendi, obrigado", "ok obrigado", "thanks",
+    ],
+    "farewell": [
+        "tchau", "até mais", "até logo", "até amanhã", "falou", "flw", "adeus", "até a próxima",
+        "tenha um bom dia", "boa noite, tchau", "vou nessa", "até depois",
+    ],
+    "identity": [
+        "quem é você?", "quem é você", "o que você é?", "você é um robô?", "você é uma ia?",
+        "qual é o seu nome?", "como você se chama?", "o que você faz?", "você é humano?",
+        "para que você serve?", "com o que você pode me ajudar?",
+    ],
+    "praise": [
+        "legal", "muito bom", "show", "top", "massa", "que legal", "ótimo", "otimo", "perfeito",
+        "você é demais", "excelente", "boa", "gostei", "incrível", "ok", "certo", "entendi", "beleza",
+    ],
+    "conversation": [
+        "o que eu disse?", "o que eu falei antes?", "por que?", "mas por quê?", "como assim?",
+        "pode repetir?", "repete por favor", "não entendi", "o que você falou?", "do que estávamos falando?",
+        "explica de novo", "qual foi minha última pergunta?", "sério?", "e aí, o que mais?",
+    ],
+}
+
+DOMAIN_EXAMPLES = [
+    "qual a carga horária total do curso?",
+    "quando começam as aulas?",
+    "qual o prazo máximo para concluir o curso?",
+    "quantas vagas são oferecidas no processo seletivo?",
+    "como funciona a reserva de vagas?",
+    "quais são os requisitos para ingresso no curso?",
+    "em quais campi o curso é oferecido?",
+    "qual o nome completo da instituição?",
+    "como acesso o moodle?",
+    "onde encontro meu e-mail institucional?",
+    "como entro no suap?",
+    "quais disciplinas tem no primeiro semestre?",
+    "qual a data de entrega da atividade?",
+    "quem é o coordenador do curso?",
+    "qual o e-mail da coordenação?",
+    "o curso tem estágio obrigatório?",
+    "como funciona o trabalho de conclusão de curso?",
+    "qual o perfil do egresso?",
+    "onde posso atuar depois de formado?",
+    "como acessar a biblioteca virtual pearson?",
+    "quais são as políticas de inclusão do curso?",
+    "quando é a prova da disciplina?",
+    "o que é multimeios didáticos?",
+    "qual a diferença entre recurso didático e material didático?",
+    "como faço para trancar a matrícula?",
+    "quantos semestres tem o curso?",
+    "as aulas são presenciais ou a distância?",
+    "tem encontros presenciais obrigatórios?",
+    "como falo com o professor da disciplina?",
+    "qual o conteúdo do bloco 2?",
+    "o que devo estudar para a avaliação?",
+    "me explica o que é design instrucional",
+    "o que é um mapa conceitual?",
+    "o que é o suap?",
+    "o que é um recurso didático?",
+    "o que é tcc?",
+    "o que é um objeto de aprendizagem?",
+    "o que é ead?",
+    "o que você sabe sobre o processo seletivo?",
+    "você pode me explicar a estrutura curricular?",
+    "você sabe quando é a matrícula?",
+    "quais são os temas transversais do curso?",
+    "qual a frequência mínima para aprovação?",
+    "como é calculada a média final?",
+    # Perguntas com cara de smalltalk ("quem é...", saudação seguida de dúvida)
+    "quem é a professora da disciplina?",
+    "quem é o tutor da turma?",
+    "quem coordena o curso?",
+    "quem é o responsável pelo estágio?",
+    "quem corrige as atividades?",
+    "legal, e qual o prazo da atividade?",
+    "tudo bem? quando é a prova?",
+    "oi, qual o horário da aula?",
+    "bom dia, como acesso o moodle?",
+    "obrigado, e quando sai a nota?",
+    "beleza, e onde vejo minhas notas?",
+    "olá, tudo bem? preciso de ajuda com a matrícula",
+]
+
+CANNED_REPLIES = {
+    "greeting": [
+        "Oi{nome}! 😊 Sou o assistente virtual do curso Técnico em Multimeios Didáticos. Como posso te ajudar hoje?",
+        "Olá{nome}! Que bom te ver por aqui. Pode mandar sua dúvida sobre o curso ou as disciplinas!",
+    ],
+    "wellbeing": [
+        "Tudo ótimo por aqui{nome}, obrigado por perguntar! 😊 Em que posso te ajudar sobre o curso?",
+    ],
+    "thanks": [
+        "Por nada{nome}! Se surgir outra dúvida, é só chamar. 😊",
+        "Imagina{nome}! Fico feliz em ajudar. Qualquer coisa, estou por aqui.",
+    ],
+    "farewell": [
+        "Até mais{nome}! Bons estudos! 📚",
+        "Tchau{nome}! Quando precisar, é só voltar por aqui.",
+    ],
+    "identity": [
+        "Sou o assistente virtual do curso Técnico em Multimeios Didáticos EaD do IFSP-SJBV. "
+        "Posso te ajudar com dúvidas sobre o curso, as disciplinas, prazos e plataformas como Moodle e SUAP.",
+    ],
+    "praise": [
+        "Que bom que ajudou{nome}! 😊 Se tiver mais alguma dúvida, pode perguntar.",
+    ],
+}
@@ -135,4 +135,27 @@ SMALLTALK_DETECTION_AND_RESPONSE_PROMPT = """
     "is_smalltalk": <true|false>,
     "smalltalk_response": "<resposta amigável, se is_smalltalk for true>"
   }
-"""
\ No newline at end of file
+"""
+# Canais institucionais indicados quando a pergunta não está no material (palavras-chave -> canal).
+# As palavras-chave casam com palavras inteiras da pergunta, no singular ou com plural em -s/-es.
+# O último é o padrão.
+INSTITUTIONAL_CHANNELS = [
+    (("moodle", "atividade", "tarefa", "nota", "prova", "avaliação", "avaliações", "fórum", "aula"), "Moodle", "https://moodle.sbv.ifsp.edu.br/"),
+    (("suap", "matrícula", "rematrícula", "boletim", "histórico", "declaração", "declarações", "documento", "diploma", "certificado"), "SUAP", "https://suap.ifsp.edu.br/"),
+    (("biblioteca", "livro", "pergamum", "pearson", "empréstimo", "acervo"), "Biblioteca Pergamum", "http://pergamum.biblioteca.ifsp.edu.br/"),
+    (("e-mail", "email", "gmail", "senha", "login"), "E-mail Institucional", "https://mail.google.com/a/aluno.ifsp.edu.br"),
+    (("professor", "professora", "docente", "docentes", "tutor", "tutora"), "Docentes do curso", "https://www.sbv.ifsp.edu.br/servidores-campus/docentes"),
+    ((), "IFSP SJBV", "https://www.sbv.ifsp.edu.br/"),
+]
+
+LOW_RELEVANCE_RESPONSE = (
+    "Desculpe, não encontrei informações sobre esse assunto no material do curso. "
+    "Recomendo consultar o canal [{channel}]({url}). Se a dúvida continuar, entre em contato com a coordenação do curso."
+)
+
+LOW_RELEVANCE_PROMPT = """
+Você é o assistente virtual do curso Técnico em Multimeios Didáticos EaD do IFSP-SJBV.
+O material do curso não tem informações sobre a pergunta do aluno. Responda em português, em markdown e em no máximo três frases:
+diga que a informação não está no material, NUNCA invente dados e oriente o aluno a procurar o canal {channel} ({url})
+ou a coordenação do curso. Se a pergunta não tiver relação com o curso ou com o IFSP, diga que só pode responder sobre o curso.
+"""
@@ -1,4 +1,10 @@
+import os
+
 BLOB_CONTAINER_NAME = "training-data"
 INTERMEDIATE_PROCESSED_TRAINING_DATA_CONTAINER = "intermediate-processed-training-data"
 JWT_EXP_DELTA_SECONDS = 3600  # 1 hora
 REFRESH_TOKEN_EXP_DELTA_SECONDS = 3600 * 24 * 30  # 30 dias
+
+# Dimensão dos embeddings da ingestão e das consultas (parâmetro `dimensions` da API de embeddings)
+EMBEDDING_DIMENSIONS = int(os.environ.get("OPENAI_EMBEDDING_MODEL_DIMENSIONS", "1536"))
+KNOWLEDGE_COLLECTION_NAME = "knowledge"
@@ -6,8 +6,10 @@ from sqlalchemy.orm import relationship
 import uuid
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import (
-  Column, String, Integer, JSON, ForeignKey,DateTime,Date, Boolean
+  Column, String, Integer, Float, JSON, ForeignKey,DateTime,Date, Boolean, LargeBinary, text
 )
+from pgvector.sqlalchemy import Vector
+from constants import EMBEDDING_DIMENSIONS
 
 Base = declarative_base()
 
@@ -55,6 +57,9 @@ class MetricsModel(Base):
     prompt_tokens = Column(Integer, nullable=False)
     completion_tokens = Column(Integer, nullable=False)
     total_tokens = Column(Integer, nullable=False)
+    cached_tokens = Column(Integer, nullable=True)  # tokens do prompt servidos pelo cache de prompt do Azure OpenAI
+    top_similarity = Column(Float, nullable=True)  # similaridade de cosseno do melhor chunk recuperado
+    short_circuited = Column(Boolean, nullable=True)  # resposta pelo atalho de baixa relevância, sem a completion com contexto
     timestamp = Column(DateTime, nullable=False)
 
 class DailyDashboardModel(Base):
@@ -72,6 +77,95 @@ class DailyDashboardModel(Base):
     daily_summary = Column(String, nullable=True) 
     updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
+class SemanticCacheModel(Base):
+    __tablename__ = 'semantic_cache'
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    class_code = Column(String, index=True, nullable=False)
+    prompt = Column(String, nullable=False)
+    response = Column(String, nullable=False)
+    embedding = Column(Vector(EMBEDDING_DIMENSIONS), nullable=False)
+    hits = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_hit_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class EmbeddingCacheModel(Base):
+    __tablename__ = 'embedding_cache'
+    key = Column(String, primary_key=True)  # sha256 de (modelo, dimensões, texto normalizado)
+    model = Column(String, nullable=False)
+    dimensions = Column(Integer, nullable=False)
+    vector = Column(LargeBinary, nullable=False)  # float32 empacotado
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class ConversationSummaryModel(Base):
+    __tablename__ = 'conversation_summaries'
+    conversation_key = Column(String, primary_key=True)  # "<email>:<conversation_id>"
+    summary = Column(String, nullable=False)
+    last_folded_fingerprint = Column(String, nullable=False)
+    folded_messages = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class RequestSpanModel(Base):
+    __tablename__ = 'request_spans'
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    request_id = Column(String, index=True, nullable=False)
+    route = Column(String, nullable=False)
+    stage = Column(String, nullable=False)
+    start_ms = Column(Float, nullable=False)  # início da etapa, relativo ao início da requisição
+    duration_ms = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+
+class TokenBucketModel(Base):
+    __tablename__ = 'token_buckets'
+    key = Column(String, primary_key=True)  # "email:<email>" ou "class:<class_code>"
+    tokens = Column(Float, nullable=False)  # saldo no instante updated_at (pode ficar negativo)
+    capacity = Column(Float, nullable=False)
+    refill_per_second = Column(Float, nullable=False)
+    consumed_tokens = Column(Float, default=0, nullable=False)
+    rejected_requests = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
 # Create tables
+with db_engine.begin() as conn:
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
 Base.metadata.create_all(bind=db_engine)
 
+# create_all não altera tabelas existentes: colunas novas em tabelas antigas são adicionadas aqui
+ADDED_COLUMNS = [
+    ("metrics", "cached_tokens", "INTEGER"),
+    ("metrics", "top_similarity", "DOUBLE PRECISION"),
+    ("metrics", "short_circuited", "BOOLEAN"),
+]
+with db_engine.begin() as conn:
+    for table, column, column_type in ADDED_COLUMNS:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}"))
+
+
+
+def check_embedding_dimensions() -> None:
+    """
+    Impede a inicialização quando os vetores já gravados não têm a dimensão configurada em
+    OPENAI_EMBEDDING_MODEL_DIMENSIONS: as consultas seriam comparadas com vetores de outro tamanho.
+    Confere a coluna do cache semântico e uma amostra da base de conhecimento.
+    """
+    with db_engine.connect() as conn:
+        mismatches = []
+        cache_type = conn.execute(text("""
+            SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = 'semantic_cache'::regclass AND attname = 'embedding'
+        """)).scalar()
+        if cache_type and cache_type != f"vector({EMBEDDING_DIMENSIONS})":
+            mismatches.append(f"semantic_cache.embedding é {cache_type}")
+        if conn.execute(text("SELECT to_regclass('langchain_pg_embedding')")).scalar():
+            stored = conn.execute(text(
+                "SELECT DISTINCT vector_dims(embedding) FROM (SELECT embedding FROM langchain_pg_embedding LIMIT 1000) sample"
+            )).scalars().all()
+            if any(dimensions != EMBEDDING_DIMENSIONS for dimensions in stored):
+                mismatches.append(f"langchain_pg_embedding tem vetores com {sorted(stored)} dimensões")
+    if mismatches:
+        raise RuntimeError(
+            f"Dimensão dos embeddings configurada ({EMBEDDING_DIMENSIONS}) diferente da gravada: {'; '.join(mismatches)}. "
+            "Reprocesse os documentos (e esvazie o cache semântico) ou ajuste OPENAI_EMBEDDING_MODEL_DIMENSIONS."
+        )
+
+
+check_embedding_dimensions()
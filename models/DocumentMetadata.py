@@ -4,4 +4,5 @@ from pydantic import BaseModel
 class DocumentMetadata(BaseModel):
     text: Optional[str] = None 
     category: Optional[str] = None 
-    subcategory: Optional[str] = None
\ No newline at end of file
+    subcategory: Optional[str] = None
+    token_count: Optional[int] = None
\ No newline at end of file
@@ -2,9 +2,10 @@ import json
 import azure.functions as func
 
 class ResponseModel(func.HttpResponse):
-    def __init__(self, data, status_code=200):
+    def __init__(self, data, status_code=200, headers=None):
         super().__init__(
             body=json.dumps(data),
             status_code=status_code,
             mimetype="application/json",
-        )
\ No newline at end of file
+            headers=headers,
+        )
@@ -0,0 +1,16 @@
+from typing import List, Optional
+from pydantic import BaseModel
+from openai.types.completion_usage import CompletionUsage
+from models.DocumentMetadata import DocumentMetadata
+
+class RetrievalResult(BaseModel):
+    context: List[str] = []
+    metadata: List[DocumentMetadata] = []
+    scores: List[float] = []
+    embedding: Optional[List[float]] = None
+    cached_response: Optional[str] = None
+    # Maior similaridade de cosseno entre a pergunta e os chunks (None quando não é medida)
+    top_similarity: Optional[float] = None
+    short_circuited: bool = False
+    # Tokens das chamadas ao modelo feitas pela recuperação (HyDE, multi-query), cobrados com a resposta
+    expansion_usage: Optional[CompletionUsage] = None
@@ -0,0 +1,46 @@
+import argparse
+import asyncio
+import time
+from tests.setup_envs import load_local_settings
+load_local_settings()
+from blueprints.chat import core_agent_flow
+from tests.tests_case import TESTS_CASES
+
+user = {
+    "id": "teste_usuario_01",
+    "name": "Usuário de Teste",
+    "classCode": None
+}
+
+
+async def run_serial(queries: list) -> float:
+    started_at = time.perf_counter()
+    for query in queries:
+        await core_agent_flow(user, query, log_usage=False)
+    return time.perf_counter() - started_at
+
+
+async def run_concurrent(queries: list) -> float:
+    started_at = time.perf_counter()
+    await asyncio.gather(*(core_agent_flow(user, query, log_usage=False) for query in queries))
+    return time.perf_counter() - started_at
+
+
+async def main(requests: int):
+    queries = [TESTS_CASES[i % len(TESTS_CASES)]["query"] for i in range(requests)]
+
+    # Aquece conexões e caches para que as duas medições partam do mesmo estado
+    await core_agent_flow(user, queries[0], log_usage=False)
+
+    serial = await run_serial(queries)
+    concurrent = await run_concurrent(queries)
+    print(f"🔎 {requests} requisições")
+    print(f"  Sequencial: {serial:.2f} s ({requests / serial:.2f} req/s)")
+    print(f"  Concorrente: {concurrent:.2f} s ({requests / concurrent:.2f} req/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara a vazão do chat atendido em sequência e de forma concorrente.")
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from tests.setup_envs import load_local_settings
+load_local_settings()
+from scripts.fake_openai_server import FakeDeploymentBehavior, start_fake_server
+
+# Três deployments simulados: um rápido com pouca cota, um lento e um instável
+FAKE_DEPLOYMENTS = [
+    ("rapido", 8091, FakeDeploymentBehavior(latency_ms=150, tokens_per_minute=6000)),
+    ("lento", 8092, FakeDeploymentBehavior(latency_ms=600)),
+    ("instavel", 8093, FakeDeploymentBehavior(latency_ms=200, error_rate=0.3)),
+]
+
+for name, port, behavior in FAKE_DEPLOYMENTS:
+    start_fake_server(port, behavior)
+
+# O pool é criado na importação, então a configuração precisa vir antes
+os.environ["AZURE_OPENAI_DEPLOYMENTS"] = json.dumps([
+    {"name": name, "endpoint": f"http://127.0.0.1:{port}", "api_key": "fake", "deployment": f"gpt-{name}"}
+    for name, port, _ in FAKE_DEPLOYMENTS
+])
+from utils.deployment_pool import completion_pool
+from utils.openai_resilience import resilience_status
+
+
+async def complete(index: int):
+    started_at = time.perf_counter()
+    try:
+        _, deployment = await completion_pool.acall("completion", lambda deployment: deployment.aclient.chat.completions.with_raw_response.create(
+            model=deployment.deployment,
+            messages=[{"role": "user", "content": f"Pergunta {index}: quando é a prova?"}],
+            max_tokens=100,
+        ))
+        return deployment.name, time.perf_counter() - started_at
+    except Exception as e:
+        return f"erro: {type(e).__name__}", time.perf_counter() - started_at
+
+
+async def main(requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(index: int):
+        async with semaphore:
+            return await complete(index)
+
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*(limited(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started_at
+
+    latencies = sorted(latency for _, latency in results)
+    print(f"🔎 {requests} completions em {elapsed:.2f} s ({requests / elapsed:.1f} req/s)")
+    print(f"  p50: {latencies[len(latencies) // 2] * 1000:.0f} ms | p95: {latencies[int(len(latencies) * 0.95)] * 1000:.0f} ms")
+    print(f"  Atendidas por: {dict(Counter(name for name, _ in results))}")
+    print(f"  Contadores: {resilience_status()['counters']}")
+    for status in completion_pool.status():
+        print(f"  {status['name']}: {json.dumps(status, ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exercita o pool de deployments contra servidores Azure OpenAI simulados.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
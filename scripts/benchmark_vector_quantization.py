@@ -0,0 +1,119 @@
+import argparse
+import time
+from tests.setup_envs import load_local_settings
+load_local_settings()
+from sqlalchemy import text
+from configs.openai_client import AzureOpenAIClient
+from configs.settings import ANN_INDEX_METHOD, RETRIEVAL_CANDIDATES
+from constants import KNOWLEDGE_COLLECTION_NAME
+from tests.tests_case import TESTS_CASES
+from utils.ann_index import QUANTIZATIONS, IndexLayout, check_index_layout_support, create_ann_index, embedding_sql, search_tuning_statements
+from utils.db_session import SessionLocal, db_engine
+from utils.vector_search import nearest_neighbors_sql, partitioned_vector_sql, to_pgvector_literal
+
+# Fora do prefixo dos índices gerenciados, para que uma reconstrução não os pegue
+BENCHMARK_INDEX_PREFIX = "ix_benchmark_quantization_"
+
+
+def search_ids(sql: str, embedding: list, k: int, settings: list) -> list:
+    db_session = SessionLocal()
+    try:
+        for statement in settings:
+            db_session.execute(text(statement))
+        rows = db_session.execute(
+            text(sql), {"collection": KNOWLEDGE_COLLECTION_NAME, "embedding": to_pgvector_literal(embedding), "k": k}
+        ).all()
+        return [row.id for row in rows]
+    finally:
+        db_session.close()
+
+
+def exact_ids(embedding: list, k: int) -> list:
+    distance = f"{embedding_sql('e.embedding')} <=> {embedding_sql(':embedding')}"
+    sql = f"SELECT id FROM ({nearest_neighbors_sql(None, distance, ':k')}) nearest"
+    return search_ids(sql, embedding, k, ["SET LOCAL enable_indexscan = off"])
+
+
+def index_size(name: str) -> int:
+    with db_engine.connect() as conn:
+        return conn.execute(text("SELECT pg_relation_size(CAST(:name AS regclass))"), {"name": name}).scalar() or 0
+
+
+def layout_label(layout: IndexLayout) -> str:
+    return f"{layout.quantization}/{layout.prefix_dimensions}" if layout.prefix_dimensions else layout.quantization
+
+
+def index_name(layout: IndexLayout) -> str:
+    return f"{BENCHMARK_INDEX_PREFIX}{layout.quantization}_{layout.prefix_dimensions}"
+
+
+def benchmark_layout(layout: IndexLayout, embeddings: list, truth: list, k: int, method: str) -> dict:
+    name = index_name(layout)
+    started_at = time.perf_counter()
+    create_ann_index(name, method=method, layout=layout)
+    build_seconds = time.perf_counter() - started_at
+
+    sql = f"SELECT id FROM ({partitioned_vector_sql(None, embedding_sql(':embedding'), ':k', layout)}) nearest"
+    settings = search_tuning_statements(k, layout=layout)
+    latencies, recalls = [], []
+    for embedding, expected in zip(embeddings, truth):
+        started_at = time.perf_counter()
+        found = search_ids(sql, embedding, k, settings)
+        latencies.append(time.perf_counter() - started_at)
+        recalls.append(len(set(found) & set(expected)) / max(1, len(expected)))
+
+    latencies.sort()
+    return {
+        "layout": layout_label(layout),
+        "index_mb": index_size(name) / 1024 ** 2,
+        "build_s": build_seconds,
+        "recall": sum(recalls) / len(recalls),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+    }
+
+
+def drop_benchmark_indexes(layouts: list):
+    with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for layout in layouts:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name(layout)}"))
+
+
+def main(queries: int, k: int, layouts: list, method: str, keep_indexes: bool):
+    for layout in layouts:
+        check_index_layout_support(layout)
+    prompts = [TESTS_CASES[i % len(TESTS_CASES)]["query"] for i in range(queries)]
+    embeddings = AzureOpenAIClient.create_embeddings(prompts)
+    truth = [exact_ids(embedding, k) for embedding in embeddings]
+
+    try:
+        results = [benchmark_layout(layout, embeddings, truth, k, method) for layout in layouts]
+    finally:
+        if not keep_indexes:
+            drop_benchmark_indexes(layouts)
+
+    print(f"🔎 {queries} consultas, k={k}, índice {method} na coleção inteira (recall em relação à busca exata)")
+    for result in results:
+        print(
+            f"  {result['layout']:>12}: índice {result['index_mb']:.1f} MB (construído em {result['build_s']:.1f} s) | "
+            f"recall@{k}: {result['recall']:.3f} | p50: {result['p50_ms']:.1f} ms | p95: {result['p95_ms']:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compara tamanho do índice, recall e latência da busca vetorial com e sem quantização e prefixo."
+    )
+    parser.add_argument("--queries", type=int, default=len(TESTS_CASES))
+    parser.add_argument("--k", type=int, default=RETRIEVAL_CANDIDATES)
+    parser.add_argument("--modes", default=",".join(QUANTIZATIONS))
+    parser.add_argument("--prefix-dimensions", default="0,256", help="Prefixos a combinar com cada quantização; 0 é o vetor completo.")
+    parser.add_argument("--method", default=ANN_INDEX_METHOD)
+    parser.add_argument("--keep-indexes", action="store_true", help="Não remove os índices criados para o benchmark.")
+    args = parser.parse_args()
+    layouts = [
+        IndexLayout(mode.strip(), int(prefix))
+        for prefix in args.prefix_dimensions.split(",")
+        for mode in args.modes.split(",")
+    ]
+    main(args.queries, args.k, layouts, args.method, args.keep_indexes)
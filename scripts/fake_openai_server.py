@@ -0,0 +1,133 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+
+class FakeDeploymentBehavior:
+    """
+    Comportamento de um deployment simulado: latência, taxa de erros 5xx e cota de tokens por minuto
+    (com 429 + Retry-After ao estourar e os headers x-ratelimit-remaining-* nas respostas).
+    """
+
+    def __init__(self, latency_ms: float = 300, jitter_ms: float = 100, error_rate: float = 0.0, tokens_per_minute: int = 100000, completion_tokens: int = 60):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.tokens_per_minute = tokens_per_minute
+        self.completion_tokens = completion_tokens
+        self._usage = deque()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int):
+        """
+        Retorna (tokens restantes, segundos até liberar) após tentar consumir `tokens` da janela de 60 s.
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._usage and now - self._usage[0][0] > 60:
+                self._usage.popleft()
+            used = sum(amount for _, amount in self._usage)
+            if used + tokens > self.tokens_per_minute:
+                return self.tokens_per_minute - used, 60 - (now - self._usage[0][0]) if self._usage else 1
+            self._usage.append((now, tokens))
+            return self.tokens_per_minute - used - tokens, 0
+
+
+def make_handler(behavior: FakeDeploymentBehavior):
+    class FakeOpenAIHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(max(0.0, behavior.latency_ms + random.uniform(-behavior.jitter_ms, behavior.jitter_ms)) / 1000)
+
+            if random.random() < behavior.error_rate:
+                self._send_json(503, {"error": {"message": "Serviço indisponível (simulado)", "code": "503"}})
+                return
+
+            prompt_tokens = sum(len(str(message.get("content", ""))) // 4 for message in request.get("messages", []))
+            completion_tokens = min(behavior.completion_tokens, request.get("max_tokens") or behavior.completion_tokens)
+            remaining, retry_after = behavior.reserve(prompt_tokens + completion_tokens)
+            if retry_after:
+                self._send_json(
+                    429,
+                    {"error": {"message": "Cota de tokens excedida (simulado)", "code": "429"}},
+                    {"Retry-After": str(max(1, round(retry_after))), "x-ratelimit-remaining-tokens": str(max(0, remaining))},
+                )
+                return
+
+            model = self.path.split("/deployments/")[-1].split("/")[0]
+            content = f"Resposta simulada por {model}."
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+            headers = {"x-ratelimit-remaining-tokens": str(remaining), "x-ratelimit-remaining-requests": "1000"}
+
+            if request.get("stream"):
+                self._send_stream(model, content, usage, headers)
+                return
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            }, headers)
+
+        def _send_stream(self, model: str, content: str, usage: dict, headers: dict):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            base = {"id": f"chatcmpl-{uuid4().hex}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+            for word in content.split(" "):
+                chunk = {**base, "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n".encode("utf-8"))
+            self.wfile.write(f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+
+    return FakeOpenAIHandler
+
+
+def start_fake_server(port: int, behavior: FakeDeploymentBehavior) -> ThreadingHTTPServer:
+    """
+    Sobe um servidor compatível com a API de chat completions do Azure OpenAI em uma thread.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(behavior))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que simula um deployment do Azure OpenAI.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tokens-per-minute", type=int, default=100000)
+    args = parser.parse_args()
+    start_fake_server(args.port, FakeDeploymentBehavior(
+        latency_ms=args.latency_ms, error_rate=args.error_rate, tokens_per_minute=args.tokens_per_minute
+    ))
+    print(f"Deployment simulado em http://127.0.0.1:{args.port} (Ctrl+C para sair)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,13 @@
+from tests.setup_envs import load_local_settings
+load_local_settings()
+from utils.ann_index import managed_ann_indexes
+from utils.vector_search import migrate_knowledge_schema
+
+
+if __name__ == "__main__":
+    # Reescreve langchain_pg_embedding na primeira execução: rodar no deploy, fora do horário de uso
+    migrate_knowledge_schema()
+    indexes = managed_ann_indexes()
+    print(f"Schema da base de conhecimento migrado: {len(indexes)} índices vetoriais.")
+    for index in indexes:
+        print(f"  {index['name']}: {index['predicate'] or 'coleção inteira'}{'' if index['valid'] else ' (inválido)'}")
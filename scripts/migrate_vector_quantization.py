@@ -0,0 +1,32 @@
+import argparse
+from tests.setup_envs import load_local_settings
+load_local_settings()
+from configs.settings import ANN_INDEX_METHOD
+from utils.ann_index import ANN_METHODS, CONFIGURED_LAYOUT, QUANTIZATIONS, IndexLayout, managed_ann_indexes, rebuild_ann_indexes
+
+
+def print_indexes(title: str):
+    indexes = managed_ann_indexes()
+    total = sum(index["size_bytes"] for index in indexes)
+    print(f"{title}: {len(indexes)} índices, {total / 1024 ** 2:.1f} MB")
+    for index in indexes:
+        prefix = f", prefixo {index['prefix_dimensions']}" if index["prefix_dimensions"] else ""
+        print(f"  {index['name']}: {index['method']}, {index['quantization']}{prefix}, {index['size_bytes'] / 1024 ** 2:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reconstrói os índices ANN da base de conhecimento com outra quantização ou prefixo, sem interromper a busca."
+    )
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default=CONFIGURED_LAYOUT.quantization)
+    parser.add_argument("--prefix-dimensions", type=int, default=CONFIGURED_LAYOUT.prefix_dimensions, help="0 indexa o vetor completo.")
+    parser.add_argument("--method", choices=ANN_METHODS, default=ANN_INDEX_METHOD)
+    args = parser.parse_args()
+
+    print_indexes("Antes")
+    rebuild_ann_indexes(args.method, IndexLayout(args.quantization, args.prefix_dimensions))
+    print_indexes("Depois")
+    print(
+        f"Defina VECTOR_QUANTIZATION={args.quantization} e VECTOR_SEARCH_PREFIX_DIMENSIONS={args.prefix_dimensions} "
+        "para que as próximas reconstruções (e um banco novo) mantenham esse formato."
+    )
@@ -26,7 +26,7 @@ model_config = AzureOpenAIModelConfiguration(
 )
 
 async def execute_test_case(query: str):
-    response, used_docs = core_agent_flow(user, query, log_usage=False)
+    response, used_docs = await core_agent_flow(user, query, log_usage=False)
     return response, used_docs
 
 def save_with_excel_formatting(df: pd.DataFrame, file_name:str = "test_results.xlsx"):
@@ -0,0 +1,41 @@
+import re
+import unittest
+from tests.setup_envs import load_local_settings
+load_local_settings()
+from sqlalchemy import text
+from utils.db_session import db_engine
+from utils.vector_search import TEXT_SEARCH_CONFIG, hybrid_search_sql, text_query_sql
+
+DOCUMENT = "A avaliação do estágio supervisionado será entregue ao coordenador do curso."
+
+
+class HybridTextQueryTest(unittest.TestCase):
+    """
+    Roda a tsquery da busca híbrida no Postgres do local.settings.json contra o mesmo
+    to_tsvector usado na coluna document_tsv.
+    """
+
+    def matches(self, query: str) -> bool:
+        with db_engine.connect() as connection:
+            return connection.execute(
+                text(f"SELECT to_tsvector('{TEXT_SEARCH_CONFIG}', :document) @@ {text_query_sql()}"),
+                {"document": DOCUMENT, "query": query},
+            ).scalar()
+
+    def test_stemmed_words_match_document(self):
+        for query in ["avaliação", "estágio", "como funciona a avaliação do estágio?"]:
+            with self.subTest(query=query):
+                self.assertTrue(self.matches(query))
+
+    def test_any_term_is_enough(self):
+        self.assertTrue(self.matches("avaliação de cálculo numérico"))
+        self.assertFalse(self.matches("cálculo numérico"))
+
+    def test_hybrid_query_does_not_stem_twice(self):
+        sql = str(hybrid_search_sql(None))
+        self.assertIn(text_query_sql(), sql)
+        self.assertIsNone(re.search(r"(?<!plain)to_tsquery\(", sql))
+
+
+if __name__ == "__main__":
+    unittest.main()
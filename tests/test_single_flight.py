@@ -0,0 +1,120 @@
+import asyncio
+import unittest
+from tests.setup_envs import load_local_settings
+load_local_settings()
+from openai.types.completion_usage import CompletionUsage, PromptTokensDetails
+from configs.openai_client import build_chat_completion
+from utils.log_usage_metrics import share_usage
+from utils.single_flight import SingleFlight
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight()
+        calls = 0
+        release = asyncio.Event()
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "resposta"
+
+        tasks = [asyncio.create_task(flights.do("chave", factory)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.assertEqual(flights.in_flight(), 1)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        self.assertEqual(calls, 1)
+        self.assertEqual([result.value for result in results], ["resposta"] * 3)
+        self.assertEqual(sorted(result.index for result in results), [0, 1, 2])
+        self.assertEqual({result.participants for result in results}, {3})
+        self.assertEqual(flights.in_flight(), 0)
+
+    async def test_key_is_released_after_execution(self):
+        flights = SingleFlight()
+
+        async def factory():
+            return "resposta"
+
+        first = await flights.do("chave", factory)
+        second = await flights.do("chave", factory)
+        self.assertEqual((first.index, first.participants), (0, 1))
+        self.assertEqual((second.index, second.participants), (0, 1))
+
+    async def test_leader_failure_reaches_followers(self):
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            raise RuntimeError("falhou")
+
+        tasks = [asyncio.create_task(flights.do("chave", factory)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertIsInstance(result, RuntimeError)
+            self.assertEqual(str(result), "falhou")
+        self.assertEqual(flights.in_flight(), 0)
+
+    async def test_cancelled_participant_does_not_cancel_others(self):
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            return "resposta"
+
+        leader = asyncio.create_task(flights.do("chave", factory))
+        follower = asyncio.create_task(flights.do("chave", factory))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+
+        result = await follower
+        self.assertEqual(result.value, "resposta")
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+
+
+class ShareUsageTest(unittest.TestCase):
+    def setUp(self):
+        usage = CompletionUsage(
+            prompt_tokens=100,
+            completion_tokens=11,
+            total_tokens=111,
+            prompt_tokens_details=PromptTokensDetails(cached_tokens=7),
+        )
+        self.response = build_chat_completion("resposta", "gpt-4o", usage)
+
+    def test_parts_add_up_to_the_shared_usage(self):
+        parts = [share_usage(self.response, 3, index).usage for index in range(3)]
+        self.assertEqual(sum(part.prompt_tokens for part in parts), 100)
+        self.assertEqual(sum(part.completion_tokens for part in parts), 11)
+        self.assertEqual(sum(part.total_tokens for part in parts), 111)
+        self.assertEqual(sum(part.prompt_tokens_details.cached_tokens for part in parts), 7)
+        for part in parts:
+            self.assertEqual(part.total_tokens, part.prompt_tokens + part.completion_tokens)
+
+    def test_remainder_goes_to_the_leader(self):
+        leader = share_usage(self.response, 3, 0).usage
+        follower = share_usage(self.response, 3, 2).usage
+        self.assertEqual((leader.prompt_tokens, leader.completion_tokens, leader.total_tokens), (34, 5, 39))
+        self.assertEqual((follower.prompt_tokens, follower.completion_tokens, follower.total_tokens), (33, 3, 36))
+        self.assertEqual((leader.prompt_tokens_details.cached_tokens, follower.prompt_tokens_details.cached_tokens), (3, 2))
+
+    def test_single_participant_keeps_the_response(self):
+        self.assertIs(share_usage(self.response, 1, 0), self.response)
+
+    def test_original_response_is_not_changed(self):
+        share_usage(self.response, 4, 1)
+        self.assertEqual(self.response.usage.total_tokens, 111)
+
+
+if __name__ == "__main__":
+    unittest.main()
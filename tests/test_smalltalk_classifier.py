@@ -0,0 +1,44 @@
+import unittest
+from tests.setup_envs import load_local_settings
+load_local_settings()
+from utils.smalltalk_classifier import SmalltalkClassifier, classify_smalltalk, is_whole_smalltalk, seed_examples
+
+# Perguntas reais que o classificador confundia com smalltalk e respondia com a resposta pronta
+DOMAIN_LOOKALIKES = [
+    "quem é o coordenador?",
+    "legal, e quem é o professor?",
+    "tudo bem? qual a data da prova",
+]
+
+
+class SmalltalkGateTest(unittest.TestCase):
+    """
+    O gate usa só os exemplos fixos, sem os prompts da tabela metrics.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.classifier = SmalltalkClassifier().train(seed_examples())
+
+    def test_domain_lookalikes_never_get_canned_reply(self):
+        for prompt in DOMAIN_LOOKALIKES:
+            with self.subTest(prompt=prompt):
+                is_smalltalk, reply = classify_smalltalk(prompt, "Ana Souza", self.classifier)
+                self.assertIsNot(is_smalltalk, True)
+                self.assertIsNone(reply)
+
+    def test_domain_lookalikes_are_not_whole_smalltalk(self):
+        for prompt in DOMAIN_LOOKALIKES:
+            with self.subTest(prompt=prompt):
+                self.assertFalse(is_whole_smalltalk(self.classifier, prompt))
+
+    def test_smalltalk_still_gets_canned_reply(self):
+        for prompt in ["oi", "oi, tudo bem?", "obrigado!", "quem é você?", "show, obrigado"]:
+            with self.subTest(prompt=prompt):
+                is_smalltalk, reply = classify_smalltalk(prompt, "Ana Souza", self.classifier)
+                self.assertTrue(is_smalltalk)
+                self.assertTrue(reply)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,333 @@
+import logging
+import math
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from configs.settings import (
+    ANN_INDEX_METHOD,
+    ANN_HNSW_M,
+    ANN_HNSW_EF_CONSTRUCTION,
+    ANN_IVFFLAT_LISTS,
+    ANN_RECALL_TARGET,
+    VECTOR_QUANTIZATION,
+    VECTOR_RESCORE_OVERSAMPLING,
+    VECTOR_SEARCH_PREFIX_DIMENSIONS,
+)
+from constants import EMBEDDING_DIMENSIONS
+from utils.db_session import db_engine
+
+ANN_METHODS = ("hnsw", "ivfflat")
+ANN_INDEX_PREFIX = "ix_langchain_pg_embedding_"
+GLOBAL_ANN_INDEX_NAME = "ix_langchain_pg_embedding_ann"
+REBUILD_SUFFIX = "_rebuild"
+
+QUANTIZATIONS = ("none", "halfvec", "binary")
+OPERATOR_CLASSES = {"none": "vector_cosine_ops", "halfvec": "halfvec_cosine_ops", "binary": "bit_hamming_ops"}
+DISTANCE_OPERATORS = {"none": "<=>", "halfvec": "<=>", "binary": "<~>"}
+# halfvec, binary_quantize e subvector existem a partir do pgvector 0.7.0
+TWO_STAGE_MIN_PGVECTOR = (0, 7, 0)
+# De quanto em quanto tempo o formato do índice em uso é relido do banco
+LAYOUT_REFRESH_SECONDS = 30
+PREFIX_PATTERN = re.compile(r"subvector\([^,]+,\s*1,\s*(\d+)\)")
+
+# Parâmetros de busca com que se espera atingir (aproximadamente) cada recall com os defaults de
+# construção; são pontos de partida, não medições desta base. Para conferir o recall@k real contra a
+# busca exata, use scripts/benchmark_vector_quantization.py. Para um recall alvo, usa-se a primeira
+# linha que o atinge.
+HNSW_EF_SEARCH_BY_RECALL: List[Tuple[float, int]] = [(0.90, 40), (0.95, 100), (0.98, 200), (0.99, 400)]
+IVFFLAT_PROBES_FRACTION_BY_RECALL: List[Tuple[float, float]] = [(0.90, 0.02), (0.95, 0.05), (0.98, 0.1), (0.99, 0.2)]
+
+
+def embedding_sql(column: str) -> str:
+    # Índices ANN exigem dimensão fixa; a coluna do PGVector é `vector` sem dimensão
+    return f"CAST({column} AS vector({EMBEDDING_DIMENSIONS}))"
+
+
+@dataclass(frozen=True)
+class IndexLayout:
+    """
+    O que o índice ANN guarda de cada embedding: o vetor completo ou só as primeiras
+    `prefix_dimensions` dimensões (os embeddings text-embedding-3 são treinados para que o prefixo
+    funcione sozinho), em float32, em meia precisão (halfvec) ou com 1 bit por dimensão (binary).
+    Fora do formato completo em float32, o índice só gera candidatos, reordenados pelo vetor completo.
+    """
+    quantization: str = "none"
+    prefix_dimensions: int = 0
+
+    @property
+    def dimensions(self) -> int:
+        return self.prefix_dimensions or EMBEDDING_DIMENSIONS
+
+    @property
+    def two_stage(self) -> bool:
+        return self.quantization != "none" or bool(self.prefix_dimensions)
+
+    def vector_sql(self, vector: str) -> str:
+        """
+        Expressão indexada para `vector` (já com dimensão fixa, ver embedding_sql).
+        """
+        if self.prefix_dimensions:
+            vector = f"CAST(subvector({vector}, 1, {self.prefix_dimensions}) AS vector({self.prefix_dimensions}))"
+        if self.quantization == "halfvec":
+            return f"CAST({vector} AS halfvec({self.dimensions}))"
+        if self.quantization == "binary":
+            return f"CAST(binary_quantize({vector}) AS bit({self.dimensions}))"
+        return vector
+
+    def distance_sql(self, column: str, query: str) -> str:
+        """
+        Distância usada pelo índice ANN: cosseno no vetor (ou no prefixo, completo ou em meia
+        precisão) ou distância de Hamming no vetor binário.
+        """
+        return f"{self.vector_sql(column)} {DISTANCE_OPERATORS[self.quantization]} {self.vector_sql(query)}"
+
+    def oversampling(self) -> int:
+        """
+        Quantas vezes mais candidatos o índice devolve para a reordenação pelo vetor completo.
+        """
+        factor = 1
+        if self.quantization != "none":
+            factor *= int(VECTOR_RESCORE_OVERSAMPLING.get(self.quantization, 4))
+        if self.prefix_dimensions:
+            factor *= int(VECTOR_RESCORE_OVERSAMPLING.get("prefix", 4))
+        return max(1, factor)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"quantization": self.quantization, "prefix_dimensions": self.prefix_dimensions or None}
+
+
+CONFIGURED_LAYOUT = IndexLayout(VECTOR_QUANTIZATION, VECTOR_SEARCH_PREFIX_DIMENSIONS)
+
+_rebuild_lock = threading.Lock()
+_rebuild_state: Dict[str, Any] = {"running": False, "method": None, "layout": None, "started_at": None, "finished_at": None, "error": None}
+_layout_state: Dict[str, Any] = {"value": None, "checked_at": 0.0}
+
+
+def index_layout(definition: str) -> IndexLayout:
+    if "binary_quantize" in definition:
+        quantization = "binary"
+    elif "halfvec" in definition:
+        quantization = "halfvec"
+    else:
+        quantization = "none"
+    prefix = PREFIX_PATTERN.search(definition)
+    return IndexLayout(quantization, int(prefix.group(1)) if prefix else 0)
+
+
+def index_layout_stale() -> bool:
+    return time.monotonic() - _layout_state["checked_at"] > LAYOUT_REFRESH_SECONDS
+
+
+def active_index_layout() -> IndexLayout:
+    """
+    Formato do índice ANN da coleção, lido da definição do índice (e relido a cada
+    LAYOUT_REFRESH_SECONDS), para que as consultas usem a mesma expressão do índice mesmo
+    logo após uma migração feita por outra instância. Sem índice, o configurado.
+    """
+    if index_layout_stale():
+        try:
+            with db_engine.connect() as conn:
+                definition = conn.execute(
+                    text("SELECT pg_get_indexdef(oid) FROM pg_class WHERE relname = :name"), {"name": GLOBAL_ANN_INDEX_NAME}
+                ).scalar()
+            _layout_state["value"] = index_layout(definition) if definition else CONFIGURED_LAYOUT
+        except Exception as e:
+            logging.error(f"Erro ao verificar o formato do índice vetorial: {str(e)}")
+            _layout_state["value"] = _layout_state["value"] or CONFIGURED_LAYOUT
+        _layout_state["checked_at"] = time.monotonic()
+    return _layout_state["value"]
+
+
+def validate_index_layout(layout: IndexLayout) -> None:
+    if layout.quantization not in QUANTIZATIONS:
+        raise ValueError(f"Quantização inválida: {layout.quantization}")
+    if not 0 <= layout.prefix_dimensions < EMBEDDING_DIMENSIONS:
+        raise ValueError(
+            f"O prefixo do índice ({layout.prefix_dimensions}) deve ser menor que a dimensão dos embeddings ({EMBEDDING_DIMENSIONS})."
+        )
+
+
+def check_index_layout_support(layout: IndexLayout) -> None:
+    validate_index_layout(layout)
+    if not layout.two_stage:
+        return
+    with db_engine.connect() as conn:
+        version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    if not version or tuple(int(part) for part in version.split(".")[:3]) < TWO_STAGE_MIN_PGVECTOR:
+        raise ValueError(f"Quantização e prefixo exigem pgvector 0.7.0 ou superior (instalado: {version}).")
+
+
+# Configuração inválida impede a inicialização, em vez de falhar a cada busca
+validate_index_layout(CONFIGURED_LAYOUT)
+
+
+def ann_index_using_sql(method: str = ANN_INDEX_METHOD, layout: IndexLayout = IndexLayout()) -> str:
+    if method not in ANN_METHODS:
+        raise ValueError(f"Método de índice inválido: {method}")
+    validate_index_layout(layout)
+    if method == "hnsw":
+        options = f"m = {ANN_HNSW_M}, ef_construction = {ANN_HNSW_EF_CONSTRUCTION}"
+    else:
+        options = f"lists = {ANN_IVFFLAT_LISTS}"
+    return f"USING {method} (({layout.vector_sql(embedding_sql('embedding'))}) {OPERATOR_CLASSES[layout.quantization]}) WITH ({options})"
+
+
+def create_ann_index(name: str, predicate: Optional[str] = None, method: str = ANN_INDEX_METHOD, layout: Optional[IndexLayout] = None) -> None:
+    """
+    Cria o índice ANN com CREATE INDEX CONCURRENTLY, sem bloquear a ingestão. Idempotente.
+    Sem `layout`, usa o formato dos índices existentes.
+    """
+    layout = layout or active_index_layout()
+    where = f" WHERE {predicate}" if predicate else ""
+    with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON langchain_pg_embedding {ann_index_using_sql(method, layout)}{where}"
+        ))
+
+
+def ensure_global_ann_index() -> None:
+    """
+    Índice usado pelas buscas sem turma (professores/admin), que percorrem toda a coleção.
+    """
+    try:
+        create_ann_index(GLOBAL_ANN_INDEX_NAME)
+    except Exception as e:
+        logging.error(f"Erro ao criar o índice vetorial da coleção: {str(e)}")
+
+
+def managed_ann_indexes() -> List[Dict[str, Any]]:
+    """
+    Lista os índices ANN da base de conhecimento (global e parciais por turma).
+    """
+    with db_engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT c.relname AS name, am.amname AS method, i.indisvalid AS valid,
+                   pg_get_expr(i.indpred, i.indrelid) AS predicate,
+                   pg_get_indexdef(c.oid) AS definition,
+                   pg_relation_size(c.oid) AS size_bytes
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_am am ON am.oid = c.relam
+            WHERE i.indrelid = 'langchain_pg_embedding'::regclass
+              AND am.amname IN ('hnsw', 'ivfflat')
+              AND c.relname LIKE :prefix
+            ORDER BY c.relname
+        """), {"prefix": f"{ANN_INDEX_PREFIX}%"}).mappings().all()
+    return [
+        {**{key: value for key, value in row.items() if key != "definition"}, **index_layout(row["definition"]).as_dict()}
+        for row in rows
+    ]
+
+
+def build_replacement_index(name: str, predicate: Optional[str], method: str, layout: IndexLayout) -> None:
+    rebuild_name = f"{name}{REBUILD_SUFFIX}"
+    with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Sobra de uma reconstrução interrompida fica inválida e impediria o IF NOT EXISTS
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {rebuild_name}"))
+    create_ann_index(rebuild_name, predicate, method, layout)
+
+
+def rebuild_ann_indexes(method: str = ANN_INDEX_METHOD, layout: IndexLayout = CONFIGURED_LAYOUT) -> None:
+    """
+    Reconstrói todos os índices sem interromper a busca: os novos índices são criados
+    concorrentemente com outro nome e só então substituem os antigos, todos na mesma transação
+    curta, para que a troca de formato valha ao mesmo tempo para todas as partições.
+    Também é a migração entre quantizações e prefixos.
+    """
+    check_index_layout_support(layout)
+    indexes = [index for index in managed_ann_indexes() if not index["name"].endswith(REBUILD_SUFFIX)]
+    if not any(index["name"] == GLOBAL_ANN_INDEX_NAME for index in indexes):
+        indexes.append({"name": GLOBAL_ANN_INDEX_NAME, "predicate": None})
+    for index in indexes:
+        build_replacement_index(index["name"], index["predicate"], method, layout)
+
+    with db_engine.begin() as conn:
+        for index in indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+            conn.execute(text(f"ALTER INDEX {index['name']}{REBUILD_SUFFIX} RENAME TO {index['name']}"))
+    _layout_state.update({"value": layout, "checked_at": time.monotonic()})
+    logging.info(f"[ann_index] {len(indexes)} índices reconstruídos com {method} ({layout.as_dict()})")
+
+
+def _run_rebuild(method: str, layout: IndexLayout) -> None:
+    try:
+        rebuild_ann_indexes(method, layout)
+        _rebuild_state["error"] = None
+    except Exception as e:
+        logging.error(f"Erro ao reconstruir os índices vetoriais: {str(e)}")
+        _rebuild_state["error"] = str(e)
+    finally:
+        _rebuild_state["running"] = False
+        _rebuild_state["finished_at"] = datetime.utcnow().isoformat()
+        _rebuild_lock.release()
+
+
+def start_ann_rebuild(method: str = ANN_INDEX_METHOD, layout: IndexLayout = CONFIGURED_LAYOUT) -> bool:
+    """
+    Dispara a reconstrução de todos os índices ANN em segundo plano.
+    Retorna False se já houver uma reconstrução em andamento.
+    """
+    if method not in ANN_METHODS:
+        raise ValueError(f"Método de índice inválido: {method}")
+    check_index_layout_support(layout)
+    if not _rebuild_lock.acquire(blocking=False):
+        return False
+
+    _rebuild_state.update({
+        "running": True, "method": method, "layout": layout.as_dict(), "started_at": datetime.utcnow().isoformat(), "finished_at": None,
+    })
+    threading.Thread(target=_run_rebuild, args=(method, layout), name="ann-index-rebuild", daemon=True).start()
+    return True
+
+
+def ann_index_status() -> Dict[str, Any]:
+    """
+    Estado dos índices ANN: índices existentes (válidos ou não), construções em andamento no
+    Postgres (pg_stat_progress_create_index) e a última reconstrução disparada neste processo.
+    `method` e o formato vêm do índice global existente (pg_am e a definição do índice); a
+    configuração, que só vale para as próximas construções, fica em `configured`.
+    """
+    indexes = managed_ann_indexes()
+    global_index = next((index for index in indexes if index["name"] == GLOBAL_ANN_INDEX_NAME), None)
+    with db_engine.connect() as conn:
+        progress = conn.execute(text("""
+            SELECT c.relname AS name, p.phase, p.blocks_done, p.blocks_total, p.tuples_done, p.tuples_total
+            FROM pg_stat_progress_create_index p
+            JOIN pg_class c ON c.oid = p.index_relid
+            WHERE p.relid = 'langchain_pg_embedding'::regclass
+        """)).mappings().all()
+    return {
+        "method": global_index["method"] if global_index else None,
+        "embedding_dimensions": EMBEDDING_DIMENSIONS,
+        **active_index_layout().as_dict(),
+        "rescore_oversampling": active_index_layout().oversampling(),
+        "recall_target": ANN_RECALL_TARGET,
+        "configured": {"method": ANN_INDEX_METHOD, **CONFIGURED_LAYOUT.as_dict()},
+        "indexes": indexes,
+        "builds_in_progress": [dict(row) for row in progress],
+        "rebuild": dict(_rebuild_state),
+    }
+
+
+def search_tuning_statements(limit: int, recall_target: float = ANN_RECALL_TARGET, layout: Optional[IndexLayout] = None) -> List[str]:
+    """
+    SET LOCAL dos parâmetros de busca para o recall alvo, a executar na mesma transação da consulta.
+    O ef_search nunca fica abaixo do LIMIT do primeiro estágio, senão o HNSW devolve menos resultados.
+    """
+    limit *= (layout or active_index_layout()).oversampling()
+    ef_search = next((ef for recall, ef in HNSW_EF_SEARCH_BY_RECALL if recall >= recall_target), HNSW_EF_SEARCH_BY_RECALL[-1][1])
+    fraction = next(
+        (fraction for recall, fraction in IVFFLAT_PROBES_FRACTION_BY_RECALL if recall >= recall_target),
+        IVFFLAT_PROBES_FRACTION_BY_RECALL[-1][1],
+    )
+    probes = max(1, math.ceil(ANN_IVFFLAT_LISTS * fraction))
+    return [
+        f"SET LOCAL hnsw.ef_search = {min(max(ef_search, limit), 1000)}",
+        f"SET LOCAL ivfflat.probes = {probes}",
+    ]
@@ -0,0 +1,95 @@
+import logging
+import re
+from typing import List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from configs.settings import CONTEXT_DUPLICATE_THRESHOLD, CONTEXT_TOKEN_BUDGET
+from models.DocumentMetadata import DocumentMetadata
+
+# Chunks ingeridos antes de o token_count ser gravado no metadata usam esta estimativa
+CHARS_PER_TOKEN_ESTIMATE = 4
+SHINGLE_SIZE = 3
+
+
+class PackingStats(BaseModel):
+    candidate_tokens: int = 0
+    packed_tokens: int = 0
+    duplicates_removed: int = 0
+    over_budget_removed: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.candidate_tokens - self.packed_tokens
+
+
+def chunk_tokens(text: str, metadata: DocumentMetadata) -> int:
+    if metadata.token_count is not None:
+        return metadata.token_count
+    return max(1, len(text) // CHARS_PER_TOKEN_ESTIMATE)
+
+
+def word_shingles(text: str) -> Set[Tuple[str, ...]]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def is_near_duplicate(shingles: Set[Tuple[str, ...]], selected: List[Set[Tuple[str, ...]]], threshold: float) -> bool:
+    """
+    Usa a contenção (interseção sobre o menor conjunto) para pegar também chunks que são
+    praticamente um trecho de outro já selecionado.
+    """
+    for other in selected:
+        smallest = min(len(shingles), len(other)) or 1
+        if len(shingles & other) / smallest >= threshold:
+            return True
+    return False
+
+
+def pack_context(
+    context: List[str],
+    metadata: List[DocumentMetadata],
+    scores: Optional[List[float]] = None,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD,
+) -> Tuple[List[str], List[DocumentMetadata], List[float], PackingStats]:
+    """
+    Seleciona os chunks que vão para o prompt: ordena por relevância (score maior primeiro),
+    remove quase-duplicatas e preenche o orçamento de tokens. Chunks que não cabem são pulados,
+    mas os menores seguintes ainda podem entrar.
+    """
+    scores = scores or [0.0] * len(context)
+    ranked = sorted(zip(context, metadata, scores), key=lambda item: item[2], reverse=True)
+
+    stats = PackingStats()
+    packed: List[Tuple[str, DocumentMetadata, float]] = []
+    selected_shingles: List[Set[Tuple[str, ...]]] = []
+    for text, meta, score in ranked:
+        tokens = chunk_tokens(text, meta)
+        stats.candidate_tokens += tokens
+
+        shingles = word_shingles(text)
+        if is_near_duplicate(shingles, selected_shingles, duplicate_threshold):
+            stats.duplicates_removed += 1
+            continue
+        if stats.packed_tokens + tokens > token_budget:
+            stats.over_budget_removed += 1
+            continue
+
+        packed.append((text, meta, score))
+        selected_shingles.append(shingles)
+        stats.packed_tokens += tokens
+
+    logging.info(
+        f"[context_packer] {len(packed)}/{len(context)} chunks, {stats.packed_tokens} tokens de contexto "
+        f"({stats.tokens_saved} economizados, {stats.duplicates_removed} duplicados, "
+        f"{stats.over_budget_removed} fora do orçamento)"
+    )
+    return (
+        [text for text, _, _ in packed],
+        [meta for _, meta, _ in packed],
+        [score for _, _, score in packed],
+        stats,
+    )
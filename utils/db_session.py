@@ -1,6 +1,16 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 
 db_engine = create_engine(os.environ["PGSQL_CONNECTION"])
 SessionLocal = sessionmaker(bind=db_engine, autoflush=False, autocommit=False)
+
+def to_async_url(url: str) -> str:
+    # O psycopg 3 tem driver assíncrono; URLs sem driver explícito cairiam no psycopg2
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
+
+async_db_engine = create_async_engine(to_async_url(os.environ["PGSQL_CONNECTION"]))
+AsyncSessionLocal = async_sessionmaker(bind=async_db_engine, autoflush=False, expire_on_commit=False)
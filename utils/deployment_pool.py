@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from openai import APIStatusError, AzureOpenAI, AsyncAzureOpenAI
+
+from configs.settings import (
+    AZURE_OPENAI_DEPLOYMENTS,
+    AZURE_OPENAI_FAST_MODEL,
+    DEPLOYMENT_LATENCY_EWMA_ALPHA,
+    DEPLOYMENT_LOW_QUOTA_TOKENS,
+)
+from utils.openai_resilience import (
+    RETRY_POLICIES,
+    CircuitOpenError,
+    circuit_breaker,
+    is_retryable,
+    next_retry_delay,
+    resilience_stats,
+    retry_after_seconds,
+)
+from utils.model_tiering import STRONG, tier_stats
+
+# Espera mínima de um deployment que respondeu 429 sem Retry-After
+DEFAULT_THROTTLE_SECONDS = 1.0
+# Quando a cota restante chega a zero, o deployment ainda recebe uma fração mínima do tráfego
+MIN_QUOTA_FACTOR = 0.05
+
+
+class Deployment:
+    """
+    Um deployment de completion (endpoint + nome do deployment) e a saúde observada nele:
+    latência média móvel, cota restante informada nos headers e falhas.
+    """
+
+    def __init__(self, name: str, endpoint: str, api_key: str, deployment: str, api_version: Optional[str] = None, weight: float = 1.0, tier: str = STRONG, **_):
+        self.name = name
+        self.deployment = deployment
+        self.weight = float(weight)
+        self.tier = tier
+        self.client = AzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version, max_retries=0)
+        self.aclient = AsyncAzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version, max_retries=0)
+        self.breaker = circuit_breaker(f"completion:{name}")
+
+        self.latency: Optional[float] = None
+        self.remaining_tokens: Optional[int] = None
+        self.remaining_requests: Optional[int] = None
+        self.throttled_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def quota_factor(self) -> float:
+        if self.remaining_tokens is None:
+            return 1.0
+        return max(MIN_QUOTA_FACTOR, min(1.0, self.remaining_tokens / DEPLOYMENT_LOW_QUOTA_TOKENS))
+
+    def record_success(self, latency: float, headers) -> None:
+        with self._lock:
+            self.requests += 1
+            self.latency = latency if self.latency is None else (
+                DEPLOYMENT_LATENCY_EWMA_ALPHA * latency + (1 - DEPLOYMENT_LATENCY_EWMA_ALPHA) * self.latency
+            )
+            for attribute, header in (("remaining_tokens", "x-ratelimit-remaining-tokens"), ("remaining_requests", "x-ratelimit-remaining-requests")):
+                try:
+                    if headers.get(header) is not None:
+                        setattr(self, attribute, int(float(headers[header])))
+                except (TypeError, ValueError):
+                    pass
+
+    def record_failure(self, error: Exception) -> None:
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.last_error = str(error)
+            if isinstance(error, APIStatusError) and error.status_code == 429:
+                self.throttled += 1
+                self.throttled_until = time.monotonic() + (retry_after_seconds(error) or DEFAULT_THROTTLE_SECONDS)
+                self.remaining_tokens = 0
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "deployment": self.deployment,
+                "tier": self.tier,
+                "weight": self.weight,
+                "circuit": self.breaker.state(),
+                "throttled_for_seconds": round(max(0.0, self.throttled_until - time.monotonic()), 1),
+                "latency_ms": round(self.latency * 1000) if self.latency is not None else None,
+                "remaining_tokens": self.remaining_tokens,
+                "remaining_requests": self.remaining_requests,
+                "requests": self.requests,
+                "failures": self.failures,
+                "throttled": self.throttled,
+                "last_error": self.last_error,
+            }
+
+
+class DeploymentPool:
+    """
+    Distribui as completions entre vários deployments, com probabilidade proporcional ao peso,
+    ao inverso da latência observada e à cota restante, entre os deployments da camada pedida
+    (ou entre todos, se nenhum for dessa camada). Em 429, 5xx ou falha de conexão, a
+    mesma requisição vai imediatamente para outro deployment; só quando todos já falharam
+    ela espera o atraso da política de novas tentativas.
+    """
+
+    def __init__(self, deployments: List[Deployment]):
+        self.deployments = deployments
+
+    @staticmethod
+    def from_settings() -> "DeploymentPool":
+        configs = AZURE_OPENAI_DEPLOYMENTS
+        if not configs:
+            endpoint = {"endpoint": os.environ.get("AZURE_OPENAI_ENDPOINT"), "api_key": os.environ.get("AZURE_OPENAI_API_KEY")}
+            configs = [{"name": "default", "deployment": os.environ["AZURE_OPENAI_MODEL"], **endpoint}]
+            if AZURE_OPENAI_FAST_MODEL:
+                configs.append({"name": "fast", "deployment": AZURE_OPENAI_FAST_MODEL, "tier": "fast", **endpoint})
+        return DeploymentPool([
+            Deployment(**{"api_version": os.environ.get("OPENAI_API_VERSION"), **config}) for config in configs
+        ])
+
+    def _tier_deployments(self, tier: str) -> List[Deployment]:
+        return [d for d in self.deployments if d.tier == tier] or self.deployments
+
+    def _available(self, exclude: Set[str], tier: str) -> List[Deployment]:
+        return [d for d in self._tier_deployments(tier) if d.name not in exclude and d.breaker.state() != "open"]
+
+    def has_alternative(self, exclude: Set[str], tier: str = STRONG) -> bool:
+        return bool(self._available(exclude, tier))
+
+    def choose(self, exclude: Set[str], tier: str = STRONG) -> Deployment:
+        available = self._available(exclude, tier)
+        if not available:
+            retry_after = min((d.breaker.reset_seconds for d in self._tier_deployments(tier)), default=1.0)
+            raise CircuitOpenError("completion", retry_after)
+
+        now = time.monotonic()
+        ready = [d for d in available if d.throttled_until <= now]
+        if not ready:
+            # Todos limitados: vai para o que libera primeiro
+            return min(available, key=lambda d: d.throttled_until)
+
+        known = [d.latency for d in ready if d.latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        scores = [d.weight * d.quota_factor() / (d.latency or default_latency) for d in ready]
+        return random.choices(ready, weights=scores)[0]
+
+    def _on_failure(self, kind: str, tier: str, deployment: Deployment, attempt: int, tried: Set[str], error: Exception) -> Optional[float]:
+        """
+        Registra a falha e decide o próximo passo: None para tentar outro deployment já,
+        ou o atraso antes de recomeçar por todos. Relança o erro quando não há nova tentativa.
+        """
+        if not is_retryable(error):
+            # Erro da requisição, não do deployment: relança sem nova tentativa
+            next_retry_delay(kind, RETRY_POLICIES[kind], deployment.breaker, attempt, error)
+        deployment.record_failure(error)
+        tier_stats.record_failure(tier)
+        tried.add(deployment.name)
+        if attempt < RETRY_POLICIES[kind].max_retries and self.has_alternative(tried, tier):
+            deployment.breaker.record_failure()
+            resilience_stats.increment(kind, "failovers")
+            logging.warning(f"[openai] {kind}: failover de {deployment.name} ({str(error)})")
+            return None
+        tried.clear()
+        return next_retry_delay(kind, RETRY_POLICIES[kind], deployment.breaker, attempt, error)
+
+    def call(self, kind: str, fn: Callable[[Deployment], object], tier: str = STRONG) -> Tuple[object, Deployment]:
+        """
+        Executa `fn(deployment)`, que deve retornar a resposta bruta do SDK (`with_raw_response`),
+        para que os headers de cota sejam lidos. Retorna (resposta já convertida, deployment).
+        """
+        tried: Set[str] = set()
+        attempt = 0
+        while True:
+            deployment = self.choose(tried, tier)
+            try:
+                deployment.breaker.before_call()
+            except CircuitOpenError:
+                tried.add(deployment.name)
+                continue
+            started_at = time.perf_counter()
+            try:
+                raw = fn(deployment)
+            except Exception as e:
+                delay = self._on_failure(kind, tier, deployment, attempt, tried, e)
+                attempt += 1
+                if delay:
+                    time.sleep(delay)
+                continue
+            latency = time.perf_counter() - started_at
+            deployment.breaker.record_success()
+            deployment.record_success(latency, raw.headers)  # type: ignore
+            response = raw.parse()  # type: ignore
+            tier_stats.record(tier, latency, response)
+            return response, deployment
+
+    async def acall(self, kind: str, fn: Callable[[Deployment], Awaitable[object]], tier: str = STRONG) -> Tuple[object, Deployment]:
+        """
+        Variante assíncrona de call; `fn(deployment)` usa `deployment.aclient`.
+        """
+        tried: Set[str] = set()
+        attempt = 0
+        while True:
+            deployment = self.choose(tried, tier)
+            try:
+                deployment.breaker.before_call()
+            except CircuitOpenError:
+                tried.add(deployment.name)
+                continue
+            started_at = time.perf_counter()
+            try:
+                raw = await fn(deployment)
+            except Exception as e:
+                delay = self._on_failure(kind, tier, deployment, attempt, tried, e)
+                attempt += 1
+                if delay:
+                    await asyncio.sleep(delay)
+                continue
+            latency = time.perf_counter() - started_at
+            deployment.breaker.record_success()
+            deployment.record_success(latency, raw.headers)  # type: ignore
+            response = raw.parse()  # type: ignore
+            tier_stats.record(tier, latency, response)
+            return response, deployment
+
+    def status(self) -> List[dict]:
+        return [deployment.status() for deployment in self.deployments]
+
+
+completion_pool = DeploymentPool.from_settings()
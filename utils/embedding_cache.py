@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from models.DatabaseModels import EmbeddingCacheModel
+from utils.db_session import SessionLocal
+from utils.lru_cache import LRUCache
+
+# Gravações do caminho assíncrono, fora da requisição: a busca não espera o INSERT no Postgres
+_persist_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="embedding-cache-persist")
+
+
+def normalize_embedding_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def embedding_cache_key(model: str, dimensions: Optional[int], text: str) -> str:
+    raw = f"{model}\x1f{dimensions}\x1f{normalize_embedding_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def pack_vector(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(data: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(data)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """
+    Cache de embeddings em dois níveis: LRU em memória do processo e tabela embedding_cache
+    no Postgres, compartilhada entre as instâncias. Os vetores são guardados como float32 nos dois
+    níveis (em memória, array("f") ocupa 4 bytes por dimensão, contra ~32 de uma lista de floats).
+    """
+
+    def __init__(self, memory_size: int, persistent: bool):
+        self.memory = LRUCache(memory_size)
+        self.persistent = persistent
+        self._stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name: str, amount: int) -> None:
+        if amount:
+            with self._stats_lock:
+                self._stats[name] += amount
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _load_persisted(self, keys: List[str]) -> Dict[str, List[float]]:
+        db_session = SessionLocal()
+        try:
+            rows = db_session.execute(
+                select(EmbeddingCacheModel.key, EmbeddingCacheModel.vector).where(EmbeddingCacheModel.key.in_(keys))
+            ).all()
+            return {key: unpack_vector(vector) for key, vector in rows}
+        except Exception as e:
+            logging.error(f"Erro ao consultar o cache de embeddings: {str(e)}")
+            return {}
+        finally:
+            db_session.close()
+
+    def _persist(self, model: str, dimensions: Optional[int], vectors: Dict[str, List[float]]) -> None:
+        db_session = SessionLocal()
+        try:
+            stmt = insert(EmbeddingCacheModel).values([
+                {"key": key, "model": model, "dimensions": dimensions or len(vector), "vector": pack_vector(vector)}
+                for key, vector in vectors.items()
+            ]).on_conflict_do_nothing(index_elements=["key"])
+            db_session.execute(stmt)
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            logging.error(f"Erro ao gravar no cache de embeddings: {str(e)}")
+        finally:
+            db_session.close()
+
+    def _lookup_memory(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is not None:
+                found[key] = vector.tolist()
+        self._count("memory_hits", len(found))
+        return found
+
+    def _remember(self, vectors: Dict[str, List[float]]) -> None:
+        for key, vector in vectors.items():
+            self.memory.set(key, array("f", vector))
+
+    def get_or_create(
+        self,
+        texts: List[str],
+        model: str,
+        dimensions: Optional[int],
+        create: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        """
+        Retorna os embeddings de `texts` na mesma ordem, chamando `create` uma única vez,
+        apenas com os textos (distintos) que não estão em nenhum dos dois níveis do cache.
+        """
+        keys = [embedding_cache_key(model, dimensions, text) for text in texts]
+        found = self._lookup_memory(keys)
+
+        pending = [key for key in dict.fromkeys(keys) if key not in found]
+        if pending and self.persistent:
+            persisted = self._load_persisted(pending)
+            self._remember(persisted)
+            found.update(persisted)
+            self._count("db_hits", len(persisted))
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            self._count("misses", len(missing))
+            created = dict(zip(missing.keys(), create(list(missing.values()))))
+            self._remember(created)
+            if self.persistent:
+                self._persist(model, dimensions, created)
+            found.update(created)
+
+        return [found[key] for key in keys]
+
+    async def aget_or_create(
+        self,
+        texts: List[str],
+        model: str,
+        dimensions: Optional[int],
+        create: Callable[[List[str]], Awaitable[List[List[float]]]],
+    ) -> List[List[float]]:
+        """
+        Variante assíncrona de get_or_create: `create` é uma corrotina e o acesso ao Postgres
+        roda em uma thread, sem bloquear o event loop. Os embeddings novos são gravados em segundo
+        plano (falhas ficam no log), sem atrasar a busca.
+        """
+        keys = [embedding_cache_key(model, dimensions, text) for text in texts]
+        found = self._lookup_memory(keys)
+
+        pending = [key for key in dict.fromkeys(keys) if key not in found]
+        if pending and self.persistent:
+            persisted = await asyncio.to_thread(self._load_persisted, pending)
+            self._remember(persisted)
+            found.update(persisted)
+            self._count("db_hits", len(persisted))
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            self._count("misses", len(missing))
+            created = dict(zip(missing.keys(), await create(list(missing.values()))))
+            self._remember(created)
+            if self.persistent:
+                _persist_executor.submit(self._persist, model, dimensions, created)
+            found.update(created)
+
+        return [found[key] for key in keys]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings do LangChain (usados na ingestão) apoiados no mesmo cache do AzureOpenAIClient.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, dimensions: Optional[int]):
+        self.underlying = underlying
+        self.model = model
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return embedding_cache.get_or_create(texts, self.model, self.dimensions, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return embedding_cache.get_or_create(
+            [text], self.model, self.dimensions, lambda missing: [self.underlying.embed_query(missing[0])]
+        )[0]
+
+
+# Importado só aqui: configs.settings importa CachedEmbeddings deste módulo
+from configs.settings import EMBEDDING_CACHE_MEMORY_SIZE, EMBEDDING_CACHE_PERSISTENT  # noqa: E402
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_MEMORY_SIZE, EMBEDDING_CACHE_PERSISTENT)
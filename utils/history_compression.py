@@ -0,0 +1,169 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+
+from configs.openai_client import AzureOpenAIClient
+from configs.settings import HISTORY_SUMMARY_MAX_TOKENS, HISTORY_TOKEN_BUDGET
+from models.DatabaseModels import ConversationSummaryModel
+from utils.db_session import SessionLocal
+from utils.model_tiering import tier_for
+from utils.token_counter import token_count
+
+SUMMARY_SENDER = "resumo da conversa"
+
+# O resumo é atualizado fora do caminho da requisição
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+# Conversas com um resumo em andamento: as requisições seguintes não reenviam as mesmas mensagens
+_folds_in_flight = set()
+_folds_lock = threading.Lock()
+
+
+def message_fingerprint(message: dict) -> str:
+    raw = f"{message.get('sender')}\x1f{message.get('content')}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def build_conversation_key(user: dict, conversation_id: Optional[str]) -> Optional[str]:
+    # O e-mail no prefixo impede que um aluno leia o resumo da conversa de outro
+    return f"{user.get('email')}:{conversation_id}" if conversation_id else None
+
+
+def split_by_token_budget(history: List[dict], token_budget: int) -> int:
+    """
+    Retorna o índice a partir do qual as mensagens mais recentes cabem no orçamento.
+    A última mensagem é sempre mantida.
+    """
+    used = 0
+    for index in range(len(history) - 1, -1, -1):
+        used += token_count(str(history[index].get("content", "")))
+        if used > token_budget and index < len(history) - 1:
+            return index + 1
+    return 0
+
+
+def summarize_messages(previous_summary: Optional[str], messages: List[dict]) -> str:
+    new_messages = "\n".join(f"{m.get('sender')}: {m.get('content')}" for m in messages)
+    prompt = (
+        "Você mantém o resumo de uma conversa entre um aluno e o assistente do curso.\n"
+        "Atualize o resumo incorporando as novas mensagens. Preserve perguntas feitas, respostas dadas, "
+        "datas, nomes e dados concretos; descarte cumprimentos. Responda apenas com o resumo, em português.\n\n"
+        f"Resumo atual:\n{previous_summary or '(vazio)'}\n\n"
+        f"Novas mensagens:\n{new_messages}"
+    )
+    summary, _ = AzureOpenAIClient.create_completion(
+        prompt=prompt, max_tokens=HISTORY_SUMMARY_MAX_TOKENS, temperature=0.2, tier=tier_for("history_summary")
+    )
+    return summary.strip()
+
+
+def fold_into_summary(conversation_key: str, previous_summary: Optional[str], messages: List[dict], folded_before: int) -> None:
+    try:
+        summary = summarize_messages(previous_summary, messages)
+    except Exception as e:
+        logging.error(f"Erro ao resumir o histórico da conversa {conversation_key}: {str(e)}")
+        return
+
+    db_session = SessionLocal()
+    try:
+        record = db_session.get(ConversationSummaryModel, conversation_key) or ConversationSummaryModel(
+            conversation_key=conversation_key
+        )
+        record.summary = summary
+        record.last_folded_fingerprint = message_fingerprint(messages[-1])
+        record.folded_messages = folded_before + len(messages)
+        record.updated_at = datetime.utcnow()
+        db_session.merge(record)
+        db_session.commit()
+    except Exception as e:
+        db_session.rollback()
+        logging.error(f"Erro ao salvar o resumo da conversa {conversation_key}: {str(e)}")
+    finally:
+        db_session.close()
+
+
+def submit_fold(conversation_key: str, previous_summary: Optional[str], messages: List[dict], folded_before: int) -> bool:
+    """
+    Agenda o resumo em segundo plano, a menos que a conversa já tenha um em andamento; as mensagens
+    que ficarem de fora entram na próxima requisição depois que ele terminar.
+    """
+    with _folds_lock:
+        if conversation_key in _folds_in_flight:
+            return False
+        _folds_in_flight.add(conversation_key)
+
+    def run():
+        try:
+            fold_into_summary(conversation_key, previous_summary, messages, folded_before)
+        finally:
+            with _folds_lock:
+                _folds_in_flight.discard(conversation_key)
+
+    try:
+        _summary_executor.submit(run)
+    except Exception:
+        with _folds_lock:
+            _folds_in_flight.discard(conversation_key)
+        raise
+    return True
+
+
+def folded_count(record: Optional[ConversationSummaryModel], older: List[dict], recent: List[dict]) -> int:
+    """
+    Quantas mensagens de `older` já estão no resumo. A última mensagem incorporada é procurada a
+    partir do fim, já que mensagens como "ok" se repetem. Se ela já saiu do histórico enviado, o
+    resumo cobre só o que veio antes de `older`; se está em `recent`, cobre `older` inteiro.
+    """
+    if not record:
+        return 0
+    fingerprints = [message_fingerprint(message) for message in older]
+    for index in range(len(fingerprints) - 1, -1, -1):
+        if fingerprints[index] == record.last_folded_fingerprint:
+            return index + 1
+    if any(message_fingerprint(message) == record.last_folded_fingerprint for message in recent):
+        return len(older)
+    return 0
+
+
+def load_summary(conversation_key: str) -> Optional[ConversationSummaryModel]:
+    db_session = SessionLocal()
+    try:
+        return db_session.get(ConversationSummaryModel, conversation_key)
+    except Exception as e:
+        logging.error(f"Erro ao carregar o resumo da conversa {conversation_key}: {str(e)}")
+        return None
+    finally:
+        db_session.close()
+
+
+def compress_history(history: List[dict], conversation_key: Optional[str], token_budget: int = HISTORY_TOKEN_BUDGET) -> List[dict]:
+    """
+    Mantém as mensagens mais recentes que cabem no orçamento de tokens e substitui as mais antigas
+    pelo resumo acumulado da conversa.
+
+    O resumo é incremental: só as mensagens que saíram da janela desde a última atualização são
+    incorporadas, em segundo plano. Enquanto isso, as mais novas delas que cabem em mais um orçamento
+    seguem na íntegra junto das recentes.
+    Sem conversation_key não há onde guardar o resumo, e as mensagens antigas são descartadas.
+    """
+    split = split_by_token_budget(history, token_budget)
+    older, recent = history[:split], history[split:]
+    if not older or not conversation_key:
+        return recent
+
+    record = load_summary(conversation_key)
+    pending = older[folded_count(record, older, recent):]
+    if pending:
+        submit_fold(
+            conversation_key,
+            record.summary if record else None,
+            pending,
+            record.folded_messages if record else 0,
+        )
+
+    compressed = (pending[split_by_token_budget(pending, token_budget):] if pending else []) + recent
+    if record:
+        compressed = [{"sender": SUMMARY_SENDER, "content": record.summary}] + compressed
+    return compressed
@@ -1,28 +1,30 @@
+import asyncio
 import uuid
-from typing import List
+from typing import List, Optional, Tuple
 from datetime import datetime
 from models.DatabaseModels import MetricsModel
 from models.DocumentMetadata import DocumentMetadata
 from openai.types.chat import ChatCompletion
+from openai.types.completion_usage import CompletionUsage
 from models.Roles import Role
-from utils.db_session import SessionLocal
+from utils.metrics_writer import metrics_writer
 
 
-def log_usage_metrics(
+def build_metric(
     user: dict,
     prompt: str,
     response: ChatCompletion,
-    metadata: List[DocumentMetadata]
-) -> None:
-    """
-    Registra métricas de uso no Postgres na tabela metrics.
-    """
-    db_session = SessionLocal()
-
+    metadata: List[DocumentMetadata],
+    request_id: Optional[str] = None,
+    top_similarity: Optional[float] = None,
+    short_circuited: Optional[bool] = None
+) -> MetricsModel:
     # Tokens
     completion_tokens = response.usage.completion_tokens  # type: ignore
     prompt_tokens = response.usage.prompt_tokens  # type: ignore
     total_tokens = response.usage.total_tokens  # type: ignore
+    prompt_details = getattr(response.usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(prompt_details, "cached_tokens", None)
 
     # Unique row key
     row_key = str(uuid.uuid4())
@@ -32,34 +34,132 @@ def log_usage_metrics(
     user_role = user.get("role")
     class_code = user.get("classCode") if user_role == Role.STUDENT.value else None
 
-    request_id = str(uuid.uuid4())
+    # O request_id da requisição liga a métrica às etapas gravadas em request_spans
+    request_id = request_id or str(uuid.uuid4())
     timestamp = datetime.utcnow()
 
     categories = ", ".join([doc.category for doc in metadata if doc.category])
     subcategories = ", ".join([doc.subcategory for doc in metadata if doc.subcategory])
     assistant_response = response.choices[0].message.content  # type: ignore
 
-    # Persist MetricsModel
-    try:
-        metric = MetricsModel(
-            id=row_key,
-            request_id=request_id,
-            user_email=user_email,
-            user_role=user_role,
-            class_code=class_code,
-            categories=categories,
-            subcategories=subcategories,
-            prompt=prompt,
-            response=assistant_response,
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            total_tokens=total_tokens,
-            timestamp=timestamp
+    return MetricsModel(
+        id=row_key,
+        request_id=request_id,
+        user_email=user_email,
+        user_role=user_role,
+        class_code=class_code,
+        categories=categories,
+        subcategories=subcategories,
+        prompt=prompt,
+        response=assistant_response,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=total_tokens,
+        cached_tokens=cached_tokens,
+        top_similarity=top_similarity,
+        short_circuited=short_circuited,
+        timestamp=timestamp
+    )
+
+
+def log_usage_metrics(
+    user: dict,
+    prompt: str,
+    response: ChatCompletion,
+    metadata: List[DocumentMetadata],
+    request_id: Optional[str] = None,
+    top_similarity: Optional[float] = None,
+    short_circuited: Optional[bool] = None
+) -> None:
+    """
+    Registra métricas de uso no Postgres na tabela metrics. A gravação é feita em lote, em
+    segundo plano, pelo metrics_writer.
+    """
+    metrics_writer.enqueue([build_metric(user, prompt, response, metadata, request_id, top_similarity, short_circuited)])
+
+
+async def alog_usage_metrics(
+    user: dict,
+    prompt: str,
+    response: ChatCompletion,
+    metadata: List[DocumentMetadata],
+    request_id: Optional[str] = None,
+    top_similarity: Optional[float] = None,
+    short_circuited: Optional[bool] = None
+) -> None:
+    """
+    Variante assíncrona de log_usage_metrics, para o caminho assíncrono do chat. No modo spool,
+    a escrita no arquivo local roda em uma thread.
+    """
+    metric = build_metric(user, prompt, response, metadata, request_id, top_similarity, short_circuited)
+    if metrics_writer.mode == "spool":
+        await asyncio.to_thread(metrics_writer.enqueue, [metric])
+    else:
+        metrics_writer.enqueue([metric])
+
+
+async def alog_usage_metrics_bulk(
+    user: dict,
+    entries: List[Tuple[str, ChatCompletion, List[DocumentMetadata]]],
+    request_ids: Optional[List[str]] = None,
+    relevance: Optional[List[Tuple[Optional[float], Optional[bool]]]] = None
+) -> None:
+    """
+    Registra as métricas de várias respostas (prompt, response, metadata) de uma vez.
+    `relevance` traz, na mesma ordem, (top_similarity, short_circuited) de cada resposta.
+    """
+    if not entries:
+        return
+    metrics = [
+        build_metric(user, prompt, response, metadata, request_id, top_similarity, short_circuited)
+        for (prompt, response, metadata), request_id, (top_similarity, short_circuited) in zip(
+            entries, request_ids or [None] * len(entries), relevance or [(None, None)] * len(entries)
         )
-        db_session.add(metric)
-        db_session.commit()
-    except Exception:
-        db_session.rollback()
-        raise
-    finally:
-        db_session.close()
+    ]
+    if metrics_writer.mode == "spool":
+        await asyncio.to_thread(metrics_writer.enqueue, metrics)
+    else:
+        metrics_writer.enqueue(metrics)
+
+
+def add_usage(response: ChatCompletion, extra: Optional[CompletionUsage]) -> ChatCompletion:
+    """
+    Cópia da resposta com o usage de outras chamadas da mesma requisição (ex.: o HyDE) somado,
+    para que a métrica e a cota contem todos os tokens gastos para responder.
+    """
+    if extra is None:
+        return response
+    usage = response.usage or CompletionUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+    combined = usage.model_copy(update={
+        "prompt_tokens": usage.prompt_tokens + extra.prompt_tokens,
+        "completion_tokens": usage.completion_tokens + extra.completion_tokens,
+        "total_tokens": usage.total_tokens + extra.total_tokens,
+    })
+    return response.model_copy(update={"usage": combined})
+
+
+def share_usage(response: ChatCompletion, participants: int, index: int) -> ChatCompletion:
+    """
+    Cópia da resposta com a parte do usage que cabe a uma das `participants` requisições que
+    compartilharam a mesma chamada ao modelo. O resto da divisão fica com a de índice 0.
+    """
+    if participants <= 1 or response.usage is None:
+        return response
+
+    def part(value):
+        if not value:
+            return value
+        return value // participants + (value % participants if index == 0 else 0)
+
+    usage = response.usage
+    details = usage.prompt_tokens_details
+    prompt_tokens = part(usage.prompt_tokens)
+    completion_tokens = part(usage.completion_tokens)
+    # O total é a soma das partes, e não a divisão do total, para fechar em cada requisição
+    shared = usage.model_copy(update={
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": details.model_copy(update={"cached_tokens": part(details.cached_tokens)}) if details else None,
+    })
+    return response.model_copy(update={"usage": shared})
@@ -0,0 +1,150 @@
+import logging
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from configs.openai_client import AsyncAzureOpenAIClient, build_chat_completion
+from configs.settings import LOW_RELEVANCE_MODE, LOW_RELEVANCE_THRESHOLD
+from configs.system_prompt import INSTITUTIONAL_CHANNELS, LOW_RELEVANCE_PROMPT, LOW_RELEVANCE_RESPONSE
+from models.RetrievalResult import RetrievalResult
+from utils.db_session import SessionLocal
+from utils.embedding_cache import normalize_embedding_text
+from utils.model_tiering import FAST
+
+LOW_RELEVANCE_MODEL_NAME = "low-relevance-template"
+LOW_RELEVANCE_MAX_TOKENS = 200
+# Faixas do histograma de similaridade (largura 0,05)
+HISTOGRAM_BUCKETS = 20
+# Palavras inteiras ("nota" não casa com "anotação", nem "prova" com "aprovação"), com plural opcional
+CHANNEL_PATTERNS = [
+    (re.compile(r"\b(?:" + "|".join(map(re.escape, keywords)) + r")(?:s|es)?\b") if keywords else None, channel, url)
+    for keywords, channel, url in INSTITUTIONAL_CHANNELS
+]
+
+
+def is_low_relevance(retrieval: RetrievalResult) -> bool:
+    """
+    A recuperação não trouxe nada parecido com a pergunta: o melhor chunk ficou abaixo de
+    LOW_RELEVANCE_THRESHOLD. Sem similaridade medida (HyDE, cache semântico) nunca é baixa.
+    """
+    if LOW_RELEVANCE_MODE == "off" or retrieval.cached_response is not None or retrieval.top_similarity is None:
+        return False
+    return retrieval.top_similarity < LOW_RELEVANCE_THRESHOLD
+
+
+def institutional_channel(prompt: str) -> Tuple[str, str]:
+    """
+    Canal institucional (nome, link) das palavras-chave da pergunta, ou o canal padrão.
+    """
+    question = normalize_embedding_text(prompt).casefold()
+    # O prefixo da disciplina não diz nada sobre a pergunta
+    question = question.split("responda: ", 1)[-1]
+    for pattern, channel, url in CHANNEL_PATTERNS:
+        if pattern and pattern.search(question):
+            return channel, url
+    _, channel, url = CHANNEL_PATTERNS[-1]
+    return channel, url
+
+
+async def answer_low_relevance(prompt: str):
+    """
+    Responde sem a completion com contexto: a resposta pronta com o canal institucional ou,
+    no modo "fast_model", a camada "fast" sem os chunks. Retorna (resposta, ChatCompletion).
+    """
+    channel, url = institutional_channel(prompt)
+    if LOW_RELEVANCE_MODE == "fast_model":
+        messages = [
+            {"role": "system", "content": LOW_RELEVANCE_PROMPT.format(channel=channel, url=url)},
+            {"role": "user", "content": prompt},
+        ]
+        return await AsyncAzureOpenAIClient.create_completion(messages=messages, max_tokens=LOW_RELEVANCE_MAX_TOKENS, tier=FAST)
+    assistant_response = LOW_RELEVANCE_RESPONSE.format(channel=channel, url=url)
+    return assistant_response, build_chat_completion(assistant_response, LOW_RELEVANCE_MODEL_NAME)
+
+
+class RelevanceStats:
+    """
+    Contadores do processo: perguntas com similaridade medida e quantas foram respondidas pelo atalho.
+    """
+
+    def __init__(self):
+        self.measured = 0
+        self.short_circuited = 0
+        self._lock = threading.Lock()
+
+    def record(self, retrieval: RetrievalResult) -> None:
+        with self._lock:
+            self.measured += 1
+            if retrieval.short_circuited:
+                self.short_circuited += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "measured": self.measured,
+                "short_circuited": self.short_circuited,
+                "short_circuit_rate": round(self.short_circuited / self.measured, 4) if self.measured else None,
+            }
+
+
+relevance_stats = RelevanceStats()
+
+
+def check_relevance(retrieval: RetrievalResult) -> bool:
+    """
+    Marca a recuperação como atalho quando a relevância é baixa e registra a decisão.
+    """
+    if retrieval.cached_response is not None or retrieval.top_similarity is None:
+        return False
+    retrieval.short_circuited = is_low_relevance(retrieval)
+    relevance_stats.record(retrieval)
+    logging.info(
+        f"[relevance] similaridade {retrieval.top_similarity:.3f} (limiar {LOW_RELEVANCE_THRESHOLD:.2f})"
+        + (f" -> atalho {LOW_RELEVANCE_MODE}" if retrieval.short_circuited else "")
+    )
+    return retrieval.short_circuited
+
+
+def relevance_histogram(hours: int = 24, class_code: Optional[str] = None) -> Dict[str, object]:
+    """
+    Histograma da similaridade do melhor chunk e taxa de atalhos nas últimas `hours` horas,
+    a partir da tabela metrics, para calibrar LOW_RELEVANCE_THRESHOLD.
+    """
+    sql = text(f"""
+        SELECT GREATEST(LEAST(FLOOR(top_similarity * {HISTOGRAM_BUCKETS}), {HISTOGRAM_BUCKETS - 1}), 0) AS bucket,
+               COUNT(*) AS count,
+               COUNT(*) FILTER (WHERE short_circuited) AS short_circuited
+        FROM metrics
+        WHERE timestamp >= :since AND top_similarity IS NOT NULL
+          AND (CAST(:class_code AS varchar) IS NULL OR class_code = :class_code)
+        GROUP BY bucket
+        ORDER BY bucket
+    """)
+    db_session = SessionLocal()
+    try:
+        rows = db_session.execute(sql, {"since": datetime.utcnow() - timedelta(hours=hours), "class_code": class_code}).all()
+    finally:
+        db_session.close()
+
+    histogram: List[Dict[str, object]] = [
+        {
+            "from": round(row.bucket / HISTOGRAM_BUCKETS, 2),
+            "to": round((row.bucket + 1) / HISTOGRAM_BUCKETS, 2),
+            "count": row.count,
+            "short_circuited": row.short_circuited,
+        }
+        for row in rows
+    ]
+    total = sum(row.count for row in rows)
+    short_circuited = sum(row.short_circuited for row in rows)
+    return {
+        "mode": LOW_RELEVANCE_MODE,
+        "threshold": LOW_RELEVANCE_THRESHOLD,
+        "measured": total,
+        "short_circuited": short_circuited,
+        "short_circuit_rate": round(short_circuited / total, 4) if total else None,
+        "histogram": histogram,
+    }
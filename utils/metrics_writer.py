@@ -0,0 +1,280 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Sequence
+
+from sqlalchemy import DateTime
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from configs.settings import (
+    METRICS_FLUSH_INTERVAL_SECONDS,
+    METRICS_FLUSH_RETRIES,
+    METRICS_FLUSH_SIZE,
+    METRICS_QUEUE_MAX_SIZE,
+    METRICS_SPOOL_DIR,
+    METRICS_WRITE_MODE,
+)
+from models.DatabaseModels import MetricsModel
+from utils.db_session import SessionLocal
+
+WRITE_MODES = ("memory", "spool")
+RETRY_BASE_DELAY_SECONDS = 0.5
+
+
+def model_to_row(instance) -> Dict:
+    return {column.name: getattr(instance, column.name) for column in instance.__table__.columns}
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_transient(error: Exception) -> bool:
+    # Queda de conexão, failover, timeout: vale tentar de novo. Erros de dados não.
+    return isinstance(error, OperationalError) or (isinstance(error, DBAPIError) and error.connection_invalidated)
+
+
+class MetricsWriter:
+    """
+    Grava as métricas de uso fora do caminho da resposta: os registros são enfileirados e uma
+    thread os insere em lote (INSERT de várias linhas) quando a fila atinge `flush_size` ou a cada
+    `flush_interval` segundos, com novas tentativas em falhas transitórias. `model` permite usar
+    o mesmo mecanismo para outra tabela (ex.: as etapas das requisições, em utils/tracing.py).
+
+    Modos:
+    - memory: fila em memória (limitada a `max_queue`); registros pendentes se perdem se o processo morrer.
+    - spool: cada registro é gravado (com fsync) em um arquivo local antes de retornar; os arquivos
+      só são apagados após o commit no Postgres, e os que sobrarem de outro processo são reenviados.
+    """
+
+    def __init__(
+        self,
+        mode: str = METRICS_WRITE_MODE,
+        spool_dir: str = METRICS_SPOOL_DIR,
+        flush_size: int = METRICS_FLUSH_SIZE,
+        flush_interval: float = METRICS_FLUSH_INTERVAL_SECONDS,
+        retries: int = METRICS_FLUSH_RETRIES,
+        max_queue: int = METRICS_QUEUE_MAX_SIZE,
+        model=MetricsModel,
+        conflict_columns: Sequence[str] = ("request_id",),
+    ):
+        if mode not in WRITE_MODES:
+            raise ValueError(f"METRICS_WRITE_MODE inválido: {mode}")
+        self.mode = mode
+        self.spool_dir = spool_dir
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.max_queue = max_queue
+        self.model = model
+        self.conflict_columns = list(conflict_columns)
+
+        self._pending: List[Dict] = []
+        self._spooled = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._spool_path = os.path.join(spool_dir, f"metrics-{os.getpid()}-{uuid.uuid4().hex}.jsonl")
+        self._spool_file = None
+        if mode == "spool":
+            os.makedirs(spool_dir, exist_ok=True)
+            self._recover_orphaned_spool()
+
+        self._thread = threading.Thread(target=self._run, name=f"{model.__tablename__}-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _recover_orphaned_spool(self) -> None:
+        """
+        Arquivos de processos que morreram (o arquivo ativo e segmentos em envio) voltam a ser
+        segmentos prontos para envio.
+        """
+        for path in glob.glob(os.path.join(self.spool_dir, "metrics-*")):
+            name = os.path.basename(path)
+            if name.endswith((".ready", ".failed")):
+                continue
+            try:
+                pid = int(name.split("-")[1])
+            except (IndexError, ValueError):
+                continue
+            if is_process_alive(pid):
+                continue
+            target = path[:-len(".sending")] if path.endswith(".sending") else f"{path}.{int(time.time() * 1000)}"
+            try:
+                os.rename(path, f"{target}.ready")
+            except FileNotFoundError:
+                continue
+
+    def enqueue(self, metrics: List) -> None:
+        rows = [model_to_row(metric) for metric in metrics]
+        with self._lock:
+            if self.mode == "spool":
+                # No spool, o arquivo é a fila: nada fica em memória
+                self._append_to_spool(rows)
+                self._spooled += len(rows)
+                queued = self._spooled
+            elif len(self._pending) + len(rows) > self.max_queue:
+                logging.warning(f"[metrics_writer] fila cheia; {len(rows)} métricas descartadas")
+                return
+            else:
+                self._pending.extend(rows)
+                queued = len(self._pending)
+            if queued >= self.flush_size:
+                self._wakeup.set()
+
+    def _append_to_spool(self, rows: List[Dict]) -> None:
+        if self._spool_file is None:
+            self._spool_file = open(self._spool_path, "a", encoding="utf-8")
+        for row in rows:
+            self._spool_file.write(json.dumps(row, default=lambda value: value.isoformat(), ensure_ascii=False) + "\n")
+        self._spool_file.flush()
+        os.fsync(self._spool_file.fileno())
+
+    def _take_batch(self) -> List[Dict]:
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._spooled = 0
+            if self.mode == "spool" and self._spool_file is not None:
+                # O arquivo atual passa a ser um segmento a enviar; novos registros vão para outro arquivo
+                self._spool_file.close()
+                self._spool_file = None
+                os.rename(self._spool_path, f"{self._spool_path}.{int(time.time() * 1000)}.ready")
+            return batch
+
+    def _insert(self, rows: List[Dict]) -> None:
+        for attempt in range(self.retries + 1):
+            db_session = SessionLocal()
+            try:
+                for start in range(0, len(rows), self.flush_size):
+                    stmt = insert(self.model).values(rows[start:start + self.flush_size])
+                    if self.conflict_columns:
+                        # Reenvio de um segmento do spool não duplica métricas
+                        stmt = stmt.on_conflict_do_nothing(index_elements=self.conflict_columns)
+                    db_session.execute(stmt)
+                db_session.commit()
+                return
+            except Exception as e:
+                db_session.rollback()
+                if not is_transient(e) or attempt == self.retries:
+                    raise
+                delay = RETRY_BASE_DELAY_SECONDS * 2 ** attempt
+                logging.warning(f"[metrics_writer] falha transitória ao gravar métricas, nova tentativa em {delay:.1f} s: {str(e)}")
+                time.sleep(delay)
+            finally:
+                db_session.close()
+
+    def _insert_isolating_failures(self, rows: List[Dict]) -> List[Dict]:
+        """
+        Grava as linhas e retorna as que falharam por erro nos dados. Quando o lote falha por um erro
+        não transitório, grava uma a uma, para que só as linhas com problema fiquem de fora.
+        Falhas transitórias são relançadas.
+        """
+        try:
+            self._insert(rows)
+            return []
+        except Exception as e:
+            if is_transient(e):
+                raise
+            if len(rows) == 1:
+                logging.error(f"[metrics_writer] métrica {rows[0].get('request_id')} rejeitada: {str(e)}")
+                return rows
+            logging.warning(f"[metrics_writer] lote de {len(rows)} métricas rejeitado, gravando uma a uma: {str(e)}")
+
+        failed = []
+        for row in rows:
+            try:
+                self._insert([row])
+            except Exception as e:
+                if is_transient(e):
+                    raise
+                logging.error(f"[metrics_writer] métrica {row.get('request_id')} rejeitada: {str(e)}")
+                failed.append(row)
+        return failed
+
+    def _flush_memory(self) -> None:
+        batch = self._take_batch()
+        if not batch:
+            return
+        try:
+            failed = self._insert_isolating_failures(batch)
+        except Exception as e:
+            logging.error(f"Erro ao gravar {len(batch)} métricas de uso; registros descartados: {str(e)}")
+            return
+        if failed:
+            logging.error(f"[metrics_writer] {len(failed)} de {len(batch)} métricas descartadas por erro nos dados")
+
+    def _flush_spool(self) -> None:
+        self._take_batch()
+        for segment in sorted(glob.glob(os.path.join(self.spool_dir, "*.ready"))):
+            # Renomear reserva o segmento, caso outro processo esteja reenviando a mesma pasta
+            claimed = f"{segment[:-len('.ready')]}.sending"
+            try:
+                os.rename(segment, claimed)
+            except FileNotFoundError:
+                continue
+
+            with open(claimed, encoding="utf-8") as spool:
+                rows = [json.loads(line) for line in spool if line.strip()]
+            datetime_columns = [column.name for column in self.model.__table__.columns if isinstance(column.type, DateTime)]
+            for row in rows:
+                for column in datetime_columns:
+                    if row.get(column):
+                        row[column] = datetime.fromisoformat(row[column])
+            try:
+                failed = self._insert_isolating_failures(rows) if rows else []
+            except Exception as e:
+                os.rename(claimed, segment)
+                logging.error(f"Erro ao gravar métricas do spool {segment}; nova tentativa no próximo flush: {str(e)}")
+                return
+            if failed:
+                # Só as linhas rejeitadas ficam em quarentena, para análise e reenvio manual
+                with open(f"{segment[:-len('.ready')]}.failed", "w", encoding="utf-8") as quarantine:
+                    for row in failed:
+                        quarantine.write(json.dumps(row, default=lambda value: value.isoformat(), ensure_ascii=False) + "\n")
+                logging.error(f"[metrics_writer] {len(failed)} de {len(rows)} métricas do spool {segment} mantidas em .failed")
+            os.remove(claimed)
+
+    def flush(self) -> None:
+        if self.mode == "spool":
+            self._flush_spool()
+        else:
+            self._flush_memory()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Erro no flush das métricas de uso: {str(e)}")
+
+    def close(self) -> None:
+        """
+        Para a thread e grava o que estiver pendente (chamado também no encerramento do processo).
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error(f"Erro no flush final das métricas de uso: {str(e)}")
+
+
+metrics_writer = MetricsWriter()
@@ -0,0 +1,93 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from configs.settings import (
+    ADAPTIVE_K_MIN_DROP,
+    MMR_LAMBDA,
+    RETRIEVAL_MAX_K,
+    RETRIEVAL_MIN_K,
+)
+
+Candidate = Tuple[str, Dict[str, Any], float, Optional[str]]
+
+
+def parse_pgvector(value: str) -> np.ndarray:
+    # Formato texto do pgvector: "[0.1,0.2,...]"
+    return np.fromstring(value.strip("[]"), sep=",", dtype=np.float32)
+
+
+def adaptive_k(similarities: List[float], min_k: int = RETRIEVAL_MIN_K, max_k: int = RETRIEVAL_MAX_K, min_drop: float = ADAPTIVE_K_MIN_DROP) -> int:
+    """
+    Escolhe quantos chunks manter olhando a curva de similaridade (em ordem decrescente):
+    corta na maior queda entre dois candidatos consecutivos, se ela for de pelo menos `min_drop`.
+    Sem queda relevante, mantém `max_k`.
+    """
+    limit = min(max_k, len(similarities))
+    if limit <= min_k:
+        return limit
+
+    drops = [similarities[i - 1] - similarities[i] for i in range(min_k, limit)]
+    biggest = int(np.argmax(drops))
+    if drops[biggest] < min_drop:
+        return limit
+    return min_k + biggest
+
+
+def mmr_select(
+    query: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    lambda_mult: float = MMR_LAMBDA,
+    relevance: Optional[np.ndarray] = None,
+) -> List[int]:
+    """
+    Maximal Marginal Relevance: escolhe, um a um, o candidato que maximiza
+    lambda * relevância - (1 - lambda) * max sim(já escolhidos). A relevância é a similaridade com
+    a consulta, a menos que `relevance` seja informada (valores entre 0 e 1).
+    Retorna os índices dos escolhidos, na ordem de escolha.
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if relevance is None:
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[selected[0]].copy()
+    while len(selected) < min(k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        chosen = int(np.argmax(scores))
+        selected.append(chosen)
+        redundancy = np.maximum(redundancy, pairwise[chosen])
+    return selected
+
+
+def select_diverse(query_embedding: List[float], candidates: List[Candidate], relevance: Optional[List[float]] = None) -> List[int]:
+    """
+    Escolhe um subconjunto menor e diverso dos candidatos (buscados com seus embeddings): o k vem
+    do corte adaptativo da curva de similaridade e os k chunks são escolhidos por MMR entre todos
+    os candidatos. `relevance` substitui a similaridade no MMR (ex.: o score RRF da busca híbrida)
+    e é normalizada pelo maior valor. Retorna os índices dos escolhidos, na ordem de escolha.
+    """
+    if not candidates:
+        return []
+
+    k = adaptive_k(sorted((similarity for _, _, similarity, _ in candidates), reverse=True))
+    vectors = np.stack([parse_pgvector(embedding) for _, _, _, embedding in candidates])
+    scaled = None
+    if relevance is not None:
+        scaled = np.asarray(relevance, dtype=np.float32)
+        scaled = scaled / max(float(scaled.max()), 1e-12)
+    selected = mmr_select(np.asarray(query_embedding, dtype=np.float32), vectors, k, relevance=scaled)
+    logging.info(f"[mmr] {len(selected)}/{len(candidates)} candidatos selecionados")
+    return selected
+
+
+def diversify(query_embedding: List[float], candidates: List[Candidate]) -> List[Tuple[str, Dict[str, Any], float]]:
+    """
+    Reduz os candidatos da busca vetorial (do mais similar ao menos) com select_diverse.
+    """
+    return [candidates[index][:3] for index in select_diverse(query_embedding, candidates)]
@@ -0,0 +1,127 @@
+import logging
+import re
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from configs.settings import MODEL_TIER_BY_CALL, MODEL_TIER_COMPLEXITY_THRESHOLD
+from utils.embedding_cache import normalize_embedding_text
+from utils.token_counter import token_count
+
+FAST = "fast"
+STRONG = "strong"
+TIERS = (FAST, STRONG)
+LATENCY_WINDOW = 500
+
+# Pedidos de raciocínio, comparação ou explicação
+REASONING_CUES = re.compile(
+    r"\b(por que|por quê|porque|explique|explica|compare|comparar|diferença|diferenças|como funciona|analise|"
+    r"justifique|vantagens|desvantagens|relação entre|calcule|passo a passo|exemplifique|avalie|interprete)\b"
+)
+# Pedidos de respostas longas
+LONG_ANSWER_CUES = re.compile(r"\b(liste|listar|detalhe|detalhadamente|resuma|todos os|todas as|cada|elabore|plano)\b")
+# Perguntas factuais curtas (datas, nomes, prazos)
+FACTOID_CUES = re.compile(r"^(quando|qual|quais|onde|quem|quanto|quantos|quantas)\b|\b(data|prazo|horário|e-mail|link)\b")
+
+
+def tier_for(call_type: str) -> str:
+    tier = MODEL_TIER_BY_CALL.get(call_type, STRONG)
+    return tier if tier in TIERS else STRONG
+
+
+def score_spread(scores: Optional[List[float]]) -> Optional[float]:
+    """
+    Distância relativa entre o melhor chunk e a média dos demais: alta quando um trecho responde
+    sozinho à pergunta, baixa quando a resposta depende de juntar vários.
+    """
+    if not scores or len(scores) < 2:
+        return None
+    ranked = sorted(scores, reverse=True)
+    if ranked[0] <= 0:
+        return None
+    rest = ranked[1:]
+    return (ranked[0] - sum(rest) / len(rest)) / ranked[0]
+
+
+def query_complexity(prompt: str, scores: Optional[List[float]] = None, history: Optional[list] = None) -> float:
+    """
+    Estima, entre 0 e 1, o quanto a pergunta exige do modelo: tamanho, pedidos de raciocínio ou de
+    respostas longas, várias perguntas na mesma mensagem, histórico e a dispersão dos scores da
+    recuperação. Perguntas factuais com um trecho claramente melhor ficam perto de 0.
+    """
+    text = normalize_embedding_text(prompt).casefold()
+    # O prefixo da disciplina não diz nada sobre a pergunta
+    text = text.split("responda: ", 1)[-1]
+
+    complexity = min(token_count(text) / 80, 1.0) * 0.25
+    if REASONING_CUES.search(text):
+        complexity += 0.35
+    if LONG_ANSWER_CUES.search(text):
+        complexity += 0.2
+    if text.count("?") > 1:
+        complexity += 0.15
+    if history:
+        complexity += 0.1
+    if FACTOID_CUES.search(text):
+        complexity -= 0.15
+
+    spread = score_spread(scores)
+    if spread is not None:
+        if spread >= 0.3:
+            complexity -= 0.1
+        elif spread <= 0.1:
+            complexity += 0.15
+    return max(0.0, min(1.0, complexity))
+
+
+def choose_chat_tier(prompt: str, scores: Optional[List[float]] = None, history: Optional[list] = None) -> str:
+    configured = MODEL_TIER_BY_CALL.get("chat", "auto")
+    if configured in TIERS:
+        return configured
+    complexity = query_complexity(prompt, scores, history)
+    tier = STRONG if complexity >= MODEL_TIER_COMPLEXITY_THRESHOLD else FAST
+    logging.info(f"[tiering] complexidade {complexity:.2f} -> {tier}")
+    return tier
+
+
+class TierStats:
+    """
+    Contadores por camada: chamadas, falhas, respostas truncadas (finish_reason "length") ou vazias
+    e latências recentes.
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, int]] = {tier: {"requests": 0, "failures": 0, "truncated": 0, "empty": 0} for tier in TIERS}
+        self._latencies: Dict[str, Deque[float]] = {tier: deque(maxlen=LATENCY_WINDOW) for tier in TIERS}
+        self._lock = threading.Lock()
+
+    def record(self, tier: str, latency: float, response=None) -> None:
+        choice = response.choices[0] if getattr(response, "choices", None) else None
+        with self._lock:
+            counters = self._counters.setdefault(tier, {"requests": 0, "failures": 0, "truncated": 0, "empty": 0})
+            counters["requests"] += 1
+            self._latencies.setdefault(tier, deque(maxlen=LATENCY_WINDOW)).append(latency)
+            if choice is not None:
+                if choice.finish_reason == "length":
+                    counters["truncated"] += 1
+                if not (choice.message.content or "").strip():
+                    counters["empty"] += 1
+
+    def record_failure(self, tier: str) -> None:
+        with self._lock:
+            self._counters.setdefault(tier, {"requests": 0, "failures": 0, "truncated": 0, "empty": 0})["failures"] += 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            result = {}
+            for tier, counters in self._counters.items():
+                samples = sorted(self._latencies.get(tier, ()))
+                result[tier] = {
+                    **counters,
+                    "p50_ms": round(samples[len(samples) // 2] * 1000) if samples else None,
+                    "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000) if samples else None,
+                }
+            return result
+
+
+tier_stats = TierStats()
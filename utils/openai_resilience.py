@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from openai import APIConnectionError, APIStatusError
+
+from configs.settings import (
+    OPENAI_RETRY_POLICIES,
+    OPENAI_CIRCUIT_FAILURE_THRESHOLD,
+    OPENAI_CIRCUIT_RESET_SECONDS,
+    OPENAI_EMBEDDING_HEDGE_ENABLED,
+    OPENAI_EMBEDDING_HEDGE_PERCENTILE,
+    OPENAI_EMBEDDING_HEDGE_MIN_SAMPLES,
+)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+LATENCY_WINDOW = 500
+
+# Tipos de chamada e o deployment (circuit breaker) a que cada um pertence
+CALL_DEPLOYMENTS = {"completion": "completion", "completion_json": "completion", "embedding": "embedding"}
+
+
+class CircuitOpenError(Exception):
+    """
+    O deployment está com o circuito aberto: a chamada falha na hora, sem ir ao Azure OpenAI.
+    """
+
+    def __init__(self, deployment: str, retry_after: float):
+        super().__init__(f"Azure OpenAI ({deployment}) indisponível no momento.")
+        self.deployment = deployment
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_retries: int
+    base_delay: float
+    max_delay: float
+
+    def delay(self, attempt: int, retry_after: Optional[float]) -> Optional[float]:
+        """
+        Atraso antes da próxima tentativa: o Retry-After da resposta, se houver, senão backoff
+        exponencial com full jitter. None quando o Retry-After pede mais que max_delay.
+        """
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_delay else None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    kind: RetryPolicy(
+        max_retries=int(policy.get("max_retries", 0)),
+        base_delay=policy.get("base_delay_ms", 500) / 1000,
+        max_delay=policy.get("max_delay_ms", 8000) / 1000,
+    )
+    for kind, policy in OPENAI_RETRY_POLICIES.items()
+}
+
+
+def is_retryable(error: Exception) -> bool:
+    # APITimeoutError é subclasse de APIConnectionError
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Abre após `failure_threshold` falhas transitórias seguidas e rejeita as chamadas por
+    `reset_seconds`. Depois disso, deixa passar uma única chamada de teste (meio aberto):
+    se ela funcionar, o circuito fecha; se falhar, abre de novo.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = OPENAI_CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = OPENAI_CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+            if remaining <= 0 and not self._probing:
+                self._probing = True
+                return
+        resilience_stats.increment(self.name, "circuit_rejections")
+        raise CircuitOpenError(self.name, max(remaining, 1.0))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                opened = True
+            else:
+                opened = False
+        if opened:
+            resilience_stats.increment(self.name, "circuit_opens")
+            logging.warning(f"[openai] circuito do deployment {self.name} aberto por {self.reset_seconds:.0f} s")
+
+
+class ResilienceStats:
+    """
+    Contadores do processo (tentativas, circuit breaker, hedge) e latências recentes por tipo de chamada.
+    """
+
+    def __init__(self):
+        self._counters: Counter = Counter()
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, kind: str, name: str) -> None:
+        with self._lock:
+            self._counters[f"{kind}.{name}"] += 1
+
+    def record_latency(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(kind, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def latency_percentile(self, kind: str, percentile: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies.get(kind, ()))
+        if len(samples) < min_samples or not samples:
+            return None
+        return samples[min(len(samples) - 1, int(percentile * len(samples)))]
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+resilience_stats = ResilienceStats()
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if name not in circuit_breakers:
+            circuit_breakers[name] = CircuitBreaker(name)
+        return circuit_breakers[name]
+
+
+# Threads das requisições de embedding com hedge no cliente síncrono
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="openai-hedge")
+
+
+def hedge_delay(kind: str) -> Optional[float]:
+    if kind != "embedding" or not OPENAI_EMBEDDING_HEDGE_ENABLED:
+        return None
+    return resilience_stats.latency_percentile(kind, OPENAI_EMBEDDING_HEDGE_PERCENTILE, OPENAI_EMBEDDING_HEDGE_MIN_SAMPLES)
+
+
+def _hedged_call(kind: str, fn: Callable[[], T], delay: float) -> T:
+    first = _hedge_executor.submit(fn)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    resilience_stats.increment(kind, "hedges")
+    second = _hedge_executor.submit(fn)
+    error: Optional[BaseException] = None
+    for future in as_completed([first, second]):
+        if future.exception() is None:
+            if future is second:
+                resilience_stats.increment(kind, "hedge_wins")
+            return future.result()
+        error = future.exception()
+    raise error  # type: ignore
+
+
+async def _ahedged_call(kind: str, fn: Callable[[], Awaitable[T]], delay: float) -> T:
+    first = asyncio.ensure_future(fn())
+    try:
+        return await asyncio.wait_for(asyncio.shield(first), timeout=delay)
+    except asyncio.TimeoutError:
+        pass
+
+    resilience_stats.increment(kind, "hedges")
+    second = asyncio.ensure_future(fn())
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        resilience_stats.increment(kind, "hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error  # type: ignore
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def next_retry_delay(kind: str, policy: RetryPolicy, breaker: CircuitBreaker, attempt: int, error: Exception) -> float:
+    """
+    Registra a falha e retorna o atraso até a próxima tentativa, ou relança o erro quando
+    ele não é transitório ou as tentativas acabaram.
+    """
+    if not is_retryable(error):
+        # O deployment respondeu; o erro é da requisição
+        breaker.record_success()
+        raise error
+    breaker.record_failure()
+    delay = policy.delay(attempt, retry_after_seconds(error))
+    if attempt >= policy.max_retries or delay is None:
+        resilience_stats.increment(kind, "failures")
+        raise error
+    resilience_stats.increment(kind, "retries")
+    logging.warning(f"[openai] {kind}: tentativa {attempt + 1} falhou ({str(error)}); nova tentativa em {delay:.2f} s")
+    return delay
+
+
+def call_with_retry(kind: str, fn: Callable[[], T]) -> T:
+    """
+    Executa `fn` (uma chamada ao Azure OpenAI) com a política de novas tentativas de `kind`,
+    o circuit breaker do deployment e, para embeddings, hedge.
+    """
+    policy = RETRY_POLICIES[kind]
+    breaker = circuit_breaker(CALL_DEPLOYMENTS[kind])
+    attempt = 0
+    while True:
+        breaker.before_call()
+        started_at = time.perf_counter()
+        try:
+            delay = hedge_delay(kind)
+            result = _hedged_call(kind, fn, delay) if delay is not None else fn()
+        except Exception as e:
+            time.sleep(next_retry_delay(kind, policy, breaker, attempt, e))
+            attempt += 1
+            continue
+        breaker.record_success()
+        resilience_stats.record_latency(kind, time.perf_counter() - started_at)
+        return result
+
+
+async def acall_with_retry(kind: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """
+    Variante assíncrona de call_with_retry; `fn` cria a corrotina de cada tentativa.
+    """
+    policy = RETRY_POLICIES[kind]
+    breaker = circuit_breaker(CALL_DEPLOYMENTS[kind])
+    attempt = 0
+    while True:
+        breaker.before_call()
+        started_at = time.perf_counter()
+        try:
+            delay = hedge_delay(kind)
+            result = await (_ahedged_call(kind, fn, delay) if delay is not None else fn())
+        except Exception as e:
+            await asyncio.sleep(next_retry_delay(kind, policy, breaker, attempt, e))
+            attempt += 1
+            continue
+        breaker.record_success()
+        resilience_stats.record_latency(kind, time.perf_counter() - started_at)
+        return result
+
+
+def resilience_status() -> dict:
+    return {
+        "counters": resilience_stats.snapshot(),
+        "circuits": {name: breaker.state() for name, breaker in list(circuit_breakers.items())},
+        "embedding_hedge_after_ms": round(delay * 1000) if (delay := hedge_delay("embedding")) is not None else None,
+    }
@@ -0,0 +1,265 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from openai.types.completion_usage import CompletionUsage
+
+from configs.openai_client import AzureOpenAIClient, AsyncAzureOpenAIClient
+from configs.settings import (
+    DEFAULT_RETRIEVAL_STRATEGY,
+    RETRIEVAL_STRATEGY_BY_CLASS,
+    RETRIEVAL_LATENCY_BUDGETS_MS,
+    HYBRID_SEARCH_CANDIDATES,
+    HYBRID_SEARCH_RRF_K,
+    HYDE_CACHE_SIZE,
+    HYDE_CACHE_TTL_SECONDS,
+    MULTI_QUERY_COUNT,
+    RETRIEVAL_CANDIDATES,
+    RETRIEVAL_MAX_K,
+)
+from models.DocumentMetadata import DocumentMetadata
+from utils.embedding_cache import normalize_embedding_text
+from utils.lru_cache import LRUCache
+from utils.mmr import diversify, select_diverse
+from utils.model_tiering import tier_for
+from utils.vector_search import vector_search, hybrid_search, ahybrid_search, avector_search, avector_search_batch
+
+# (chunks, metadados, scores de ordenação, maior similaridade de cosseno com a pergunta ou None,
+#  usage das chamadas ao modelo feitas pela estratégia (HyDE, multi-query) ou None)
+SearchResult = Tuple[List[str], List[DocumentMetadata], List[float], Optional[float], Optional[CompletionUsage]]
+RetrievalStrategy = Callable[[str, Optional[str], List[float]], SearchResult]
+AsyncRetrievalStrategy = Callable[[str, Optional[str], List[float]], Awaitable[SearchResult]]
+
+# Executor das etapas de expansão da consulta (HyDE, multi-query), para que possam ser abandonadas no prazo
+_expansion_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval-expansion")
+_hyde_cache = LRUCache(HYDE_CACHE_SIZE, ttl_seconds=HYDE_CACHE_TTL_SECONDS)
+
+
+def run_within_budget(strategy: str, fn: Callable, *args):
+    """
+    Executa `fn` respeitando o orçamento de latência da estratégia. Retorna None se o prazo
+    estourar; a execução continua em segundo plano (e, no caso do HyDE, ainda alimenta o cache).
+    """
+    budget_ms = RETRIEVAL_LATENCY_BUDGETS_MS.get(strategy)
+    future = _expansion_executor.submit(fn, *args)
+    try:
+        return future.result(timeout=budget_ms / 1000 if budget_ms else None)
+    except FutureTimeoutError:
+        logging.warning(f"[retrieval] {strategy} excedeu o orçamento de {budget_ms} ms; usando a busca vetorial simples.")
+        return None
+
+
+def search_vector_store(document: str, user_class: Optional[str], embedding: Optional[List[float]] = None) -> SearchResult:
+    """
+    Busca vetorial nas partições da turma, do admin e dos documentos sem turma. Busca
+    RETRIEVAL_CANDIDATES candidatos e os reduz com k adaptativo e MMR (ver utils/mmr.py).
+    O score de relevância é a similaridade de cosseno.
+    """
+    embedding = embedding or AzureOpenAIClient.create_embedding(input_text=document)
+    candidates = vector_search(embedding=embedding, user_class=user_class, k=RETRIEVAL_CANDIDATES, with_embeddings=True)
+    return diversified_result(embedding, candidates)
+
+
+def diversified_result(embedding: List[float], candidates: list) -> SearchResult:
+    results = diversify(embedding, candidates)
+    context = [document for document, _, _ in results]
+    metadata = [DocumentMetadata(**cmetadata) for _, cmetadata, _ in results]
+    scores = [similarity for _, _, similarity in results]
+    # O candidato mais similar pode ter ficado de fora do MMR, mas é ele que mede a relevância
+    top_similarity = max((candidate[2] for candidate in candidates), default=None)
+    return context, metadata, scores, top_similarity, None
+
+
+def diversified_hybrid_result(embedding: List[float], candidates: list) -> SearchResult:
+    """
+    Reduz os candidatos fundidos pelo RRF com k adaptativo e MMR, como na busca vetorial. No MMR,
+    a relevância de cada candidato é o seu score RRF, para que os achados da busca textual contem
+    tanto quanto os da vetorial; os scores retornados continuam sendo os do RRF.
+    """
+    selected = select_diverse(
+        embedding,
+        [(document, cmetadata, similarity, vector) for document, cmetadata, _, similarity, vector in candidates],
+        relevance=[rrf_score for _, _, rrf_score, _, _ in candidates],
+    )
+    results = [candidates[index] for index in selected]
+    context = [document for document, _, _, _, _ in results]
+    metadata = [DocumentMetadata(**cmetadata) for _, cmetadata, _, _, _ in results]
+    scores = [rrf_score for _, _, rrf_score, _, _ in results]
+    top_similarity = max((similarity for _, _, _, similarity, _ in candidates), default=None)
+    return context, metadata, scores, top_similarity, None
+
+
+def generate_hypothetical_document(question: str) -> Tuple[str, Optional[CompletionUsage]]:
+    """
+    Gera um documento hipotético a partir de uma pergunta, usando o modelo Azure OpenAI.
+    Esse texto simula a resposta que o seu próprio chatbot daria, e será usado como chave para a busca vetorial.
+    Os documentos ficam em cache por pergunta normalizada. Retorna (documento, usage da chamada ou None se veio do cache).
+    """
+    cache_key = normalize_embedding_text(question).casefold()
+    cached = _hyde_cache.get(cache_key)
+    if cached is not None:
+        return cached, None
+
+    # Montamos um prompt que indica ao modelo que crie uma resposta bem detalhada para servir de "contexto" na busca.
+    hyde_prompt = (
+        "Você é um sistema de geração de documentos hipotéticos.\n"
+        "Dada a pergunta abaixo, gere uma resposta detalhada que cubra todos os pontos relevantes:\n\n"
+        f"Pergunta: {question}\n"
+        "Resposta detalhada (documento hipotético):"
+    )
+    hyde_doc, raw_resp = AzureOpenAIClient.create_completion(prompt=hyde_prompt, tier=tier_for("hyde"))
+    _hyde_cache.set(cache_key, hyde_doc)
+    return hyde_doc, raw_resp.usage
+
+
+def search_vector_store_hyde(document: str, user_class: Optional[str], embedding: Optional[List[float]] = None) -> SearchResult:
+    """
+    1) Gera o documento hipotético (hyde) a partir da pergunta (document), dentro do orçamento de latência.
+    2) Cria embedding desse hyde document.
+    3) Executa a busca vetorial usando esse embedding, aplicando filtros por class_code.
+    Se o documento hipotético não ficar pronto a tempo, faz a busca com o embedding da própria pergunta.
+    A similaridade com o documento hipotético não mede a relevância para a pergunta e não é retornada.
+    Uma geração abandonada no prazo não tem o usage contabilizado.
+    """
+    generated = run_within_budget("hyde", generate_hypothetical_document, document)
+    if generated is None:
+        return search_vector_store(document, user_class, embedding)
+
+    hyde_doc, usage = generated
+    hyde_embedding = AzureOpenAIClient.create_embedding(input_text=hyde_doc)
+    context, metadata, scores, _, _ = search_vector_store(hyde_doc, user_class, hyde_embedding)
+    return context, metadata, scores, None, usage
+
+
+def search_hybrid(document: str, user_class: Optional[str], embedding: Optional[List[float]] = None) -> SearchResult:
+    """
+    Busca híbrida (textual + vetorial, fundidas por RRF) em uma única ida ao banco. Os
+    RETRIEVAL_CANDIDATES primeiros da fusão são reduzidos com k adaptativo e MMR.
+    Os scores retornados são os do RRF, que definem a ordem de relevância no empacotamento.
+    """
+    embedding = embedding or AzureOpenAIClient.create_embedding(input_text=document)
+    candidates = hybrid_search(
+        query=document,
+        embedding=embedding,
+        user_class=user_class,
+        k=RETRIEVAL_CANDIDATES,
+        candidates=HYBRID_SEARCH_CANDIDATES,
+        rrf_k=HYBRID_SEARCH_RRF_K,
+        with_embeddings=True,
+    )
+    return diversified_hybrid_result(embedding, candidates)
+
+
+def generate_query_variations(question: str) -> Tuple[List[str], Optional[CompletionUsage]]:
+    prompt = (
+        f"Reescreva a pergunta abaixo de {MULTI_QUERY_COUNT} formas diferentes, usando sinônimos e termos "
+        "que provavelmente aparecem em documentos institucionais do curso.\n"
+        f"Pergunta: {question}\n"
+        'Responda no formato JSON: {"queries": ["...", "..."]}'
+    )
+    response_text, raw_resp = AzureOpenAIClient.create_completion_json(
+        prompt=prompt, max_tokens=200, tier=tier_for("multi_query"), with_response=True
+    )
+    queries = json.loads(response_text).get("queries", [])
+    return [q for q in queries if isinstance(q, str) and q.strip()][:MULTI_QUERY_COUNT], raw_resp.usage
+
+
+def search_multi_query(document: str, user_class: Optional[str], embedding: Optional[List[float]] = None) -> SearchResult:
+    """
+    Busca com a pergunta original e suas reformulações (embeddings gerados em uma única chamada),
+    fundindo os rankings com Reciprocal Rank Fusion.
+    """
+    embedding = embedding or AzureOpenAIClient.create_embedding(input_text=document)
+    variations, usage = run_within_budget("multi_query", generate_query_variations, document) or ([], None)
+    if not variations:
+        context, metadata, scores, top_similarity, _ = search_vector_store(document, user_class, embedding)
+        return context, metadata, scores, top_similarity, usage
+
+    rankings = [search_vector_store(document, user_class, embedding)]
+    for variation, variation_embedding in zip(variations, AzureOpenAIClient.create_embeddings(variations)):
+        rankings.append(search_vector_store(variation, user_class, variation_embedding))
+
+    fused: Dict[str, Tuple[DocumentMetadata, float]] = {}
+    for context, metadata, _, _, _ in rankings:
+        for rank, (text, meta) in enumerate(zip(context, metadata), start=1):
+            _, score = fused.get(text, (meta, 0.0))
+            fused[text] = (meta, score + 1.0 / (HYBRID_SEARCH_RRF_K + rank))
+
+    ranked = sorted(fused.items(), key=lambda item: item[1][1], reverse=True)[:RETRIEVAL_MAX_K]
+    return (
+        [text for text, _ in ranked],
+        [meta for _, (meta, _) in ranked],
+        [score for _, (_, score) in ranked],
+        # A relevância vem da busca com a pergunta original
+        rankings[0][3],
+        usage,
+    )
+
+
+RETRIEVAL_STRATEGIES: Dict[str, RetrievalStrategy] = {
+    "plain": search_vector_store,
+    "hyde": search_vector_store_hyde,
+    "hybrid": search_hybrid,
+    "multi_query": search_multi_query,
+}
+
+
+def resolve_retrieval_strategy(user_class: Optional[str], requested: Optional[str] = None) -> str:
+    """
+    Escolhe a estratégia: a pedida na requisição, senão a configurada para a turma, senão a padrão.
+    """
+    for candidate in (requested, RETRIEVAL_STRATEGY_BY_CLASS.get(user_class or ""), DEFAULT_RETRIEVAL_STRATEGY):
+        if candidate in RETRIEVAL_STRATEGIES:
+            return candidate  # type: ignore
+        if candidate:
+            logging.warning(f"[retrieval] estratégia desconhecida: {candidate}")
+    return "plain"
+
+
+def search_with_strategy(strategy: str, document: str, user_class: Optional[str], embedding: List[float]) -> SearchResult:
+    return RETRIEVAL_STRATEGIES[strategy](document, user_class, embedding)
+
+
+async def asearch_vector_store(document: str, user_class: Optional[str], embedding: Optional[List[float]] = None) -> SearchResult:
+    embedding = embedding or await AsyncAzureOpenAIClient.create_embedding(input_text=document)
+    candidates = await avector_search(embedding=embedding, user_class=user_class, k=RETRIEVAL_CANDIDATES, with_embeddings=True)
+    return diversified_result(embedding, candidates)
+
+
+async def asearch_hybrid(document: str, user_class: Optional[str], embedding: Optional[List[float]] = None) -> SearchResult:
+    embedding = embedding or await AsyncAzureOpenAIClient.create_embedding(input_text=document)
+    candidates = await ahybrid_search(
+        query=document,
+        embedding=embedding,
+        user_class=user_class,
+        k=RETRIEVAL_CANDIDATES,
+        candidates=HYBRID_SEARCH_CANDIDATES,
+        rrf_k=HYBRID_SEARCH_RRF_K,
+        with_embeddings=True,
+    )
+    return diversified_hybrid_result(embedding, candidates)
+
+
+# Estratégias com implementação assíncrona nativa; as demais (HyDE, multi-query) rodam em uma thread
+ASYNC_RETRIEVAL_STRATEGIES: Dict[str, AsyncRetrievalStrategy] = {
+    "plain": asearch_vector_store,
+    "hybrid": asearch_hybrid,
+}
+
+
+async def asearch_with_strategy(strategy: str, document: str, user_class: Optional[str], embedding: List[float]) -> SearchResult:
+    if strategy in ASYNC_RETRIEVAL_STRATEGIES:
+        return await ASYNC_RETRIEVAL_STRATEGIES[strategy](document, user_class, embedding)
+    return await asyncio.to_thread(search_with_strategy, strategy, document, user_class, embedding)
+
+
+async def asearch_vector_store_batch(user_class: Optional[str], embeddings: List[List[float]]) -> List[SearchResult]:
+    """
+    Busca vetorial simples de várias perguntas em uma única consulta ao banco.
+    """
+    candidates = await avector_search_batch(
+        embeddings=embeddings, user_class=user_class, k=RETRIEVAL_CANDIDATES, with_embeddings=True
+    )
+    return [diversified_result(embedding, hits) for embedding, hits in zip(embeddings, candidates)]
@@ -0,0 +1,128 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, or_, select
+
+from configs.settings import (
+    SEMANTIC_CACHE_MAX_ENTRIES_PER_CLASS,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL_SECONDS,
+)
+from models.DatabaseModels import SemanticCacheModel
+from utils.db_session import SessionLocal
+
+# Usuários sem turma (professores/admin) buscam em toda a base, então compartilham um escopo próprio
+ALL_CLASSES_SCOPE = "*"
+ADMIN_CLASS_CODE = "admin"
+
+
+def cache_scope(class_code: Optional[str]) -> str:
+    return class_code or ALL_CLASSES_SCOPE
+
+
+def lookup_cached_answer(class_code: Optional[str], embedding: List[float]) -> Optional[str]:
+    """
+    Busca a resposta em cache mais similar à pergunta dentro da mesma turma.
+    Retorna a resposta se a similaridade de cosseno atingir SEMANTIC_CACHE_THRESHOLD e a entrada
+    não estiver expirada; caso contrário, None.
+    """
+    db_session = SessionLocal()
+    try:
+        distance = SemanticCacheModel.embedding.cosine_distance(embedding)
+        cutoff = datetime.utcnow() - timedelta(seconds=SEMANTIC_CACHE_TTL_SECONDS)
+        row = db_session.execute(
+            select(SemanticCacheModel, distance.label("distance"))
+            .where(
+                SemanticCacheModel.class_code == cache_scope(class_code),
+                SemanticCacheModel.created_at >= cutoff,
+            )
+            .order_by(distance)
+            .limit(1)
+        ).first()
+        if row is None:
+            return None
+
+        entry, entry_distance = row
+        similarity = 1 - entry_distance
+        if similarity < SEMANTIC_CACHE_THRESHOLD:
+            logging.debug(f"[semantic_cache] miss (similaridade {similarity:.3f})")
+            return None
+
+        entry.hits += 1
+        entry.last_hit_at = datetime.utcnow()
+        db_session.commit()
+        logging.info(f"[semantic_cache] hit para a turma {entry.class_code} (similaridade {similarity:.3f})")
+        return entry.response
+    except Exception as e:
+        db_session.rollback()
+        logging.error(f"Erro ao consultar o cache semântico: {str(e)}")
+        return None
+    finally:
+        db_session.close()
+
+
+def store_cached_answer(class_code: Optional[str], prompt: str, embedding: List[float], response: str) -> None:
+    """
+    Armazena a resposta no cache e remove as entradas expiradas e as menos usadas recentemente
+    além de SEMANTIC_CACHE_MAX_ENTRIES_PER_CLASS.
+    """
+    scope = cache_scope(class_code)
+    db_session = SessionLocal()
+    try:
+        db_session.add(SemanticCacheModel(
+            class_code=scope,
+            prompt=prompt,
+            response=response,
+            embedding=embedding,
+        ))
+
+        cutoff = datetime.utcnow() - timedelta(seconds=SEMANTIC_CACHE_TTL_SECONDS)
+        db_session.execute(
+            delete(SemanticCacheModel).where(
+                SemanticCacheModel.class_code == scope,
+                SemanticCacheModel.created_at < cutoff,
+            )
+        )
+        keep = (
+            select(SemanticCacheModel.id)
+            .where(SemanticCacheModel.class_code == scope)
+            .order_by(SemanticCacheModel.last_hit_at.desc())
+            .limit(SEMANTIC_CACHE_MAX_ENTRIES_PER_CLASS)
+        )
+        db_session.execute(
+            delete(SemanticCacheModel).where(
+                SemanticCacheModel.class_code == scope,
+                SemanticCacheModel.id.not_in(keep.scalar_subquery()),
+            )
+        )
+        db_session.commit()
+    except Exception as e:
+        db_session.rollback()
+        logging.error(f"Erro ao gravar no cache semântico: {str(e)}")
+    finally:
+        db_session.close()
+
+
+def invalidate_class_cache(class_code: Optional[str]) -> None:
+    """
+    Invalida as respostas em cache afetadas por uma mudança na base de conhecimento da turma.
+    Arquivos do admin valem para todas as turmas, então invalidam o cache inteiro; os de uma turma
+    invalidam também o escopo global, que busca em toda a base.
+    """
+    db_session = SessionLocal()
+    try:
+        stmt = delete(SemanticCacheModel)
+        if class_code and class_code != ADMIN_CLASS_CODE:
+            stmt = stmt.where(or_(
+                SemanticCacheModel.class_code == class_code,
+                SemanticCacheModel.class_code == ALL_CLASSES_SCOPE,
+            ))
+        result = db_session.execute(stmt)
+        db_session.commit()
+        logging.info(f"[semantic_cache] {result.rowcount} entradas invalidadas para a turma {class_code}")
+    except Exception as e:
+        db_session.rollback()
+        logging.error(f"Erro ao invalidar o cache semântico: {str(e)}")
+    finally:
+        db_session.close()
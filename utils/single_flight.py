@@ -0,0 +1,49 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+@dataclass
+class FlightResult:
+    value: Any
+    index: int  # 0 para a requisição que iniciou a execução
+    participants: int
+
+
+class _Flight:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.participants = 0
+
+
+class SingleFlight:
+    """
+    Agrupa chamadas concorrentes com a mesma chave em uma única execução, cujo resultado (ou
+    exceção) é entregue a todas. Não é um cache: a chave é liberada assim que a execução termina.
+    A execução roda em uma task própria, de modo que o cancelamento de uma requisição não
+    interrompe as demais.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> FlightResult:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.create_task(self._run(key, factory))
+            self._flights[key] = flight
+        index = flight.participants
+        flight.participants += 1
+        value = await asyncio.shield(flight.task)
+        # A chave sai do dicionário antes de a task terminar, então o total já é definitivo
+        return FlightResult(value=value, index=index, participants=flight.participants)
+
+    async def _run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await factory()
+        finally:
+            self._flights.pop(key, None)
+
+    def in_flight(self) -> int:
+        return len(self._flights)
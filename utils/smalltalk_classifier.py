@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import math
+import random
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from configs.settings import SMALLTALK_CONFIDENCE_THRESHOLD, SMALLTALK_TRAINING_METRICS_LIMIT
+from configs.smalltalk_examples import CANNED_REPLIES, DOMAIN_EXAMPLES, DOMAIN_INTENT, SMALLTALK_EXAMPLES
+from models.DatabaseModels import MetricsModel
+from utils.db_session import SessionLocal
+
+# Mensagens de smalltalk são curtas; acima disso a decisão fica com o LLM
+MAX_SMALLTALK_WORDS = 8
+# Suavização de Lidstone: com poucos exemplos por intenção, alpha=1 achata demais as probabilidades
+SMOOTHING_ALPHA = 0.1
+ENHANCED_PROMPT_PREFIX = re.compile(r"^Sobre a disciplina .+?, responda:\s*", re.IGNORECASE)
+CLAUSE_SEPARATORS = re.compile(r"[,.;:!?\n]+")
+# Numa segunda oração, indicam uma pergunta de verdade ("tudo bem? qual a data da prova")
+INTERROGATIVES = {"quem", "qual", "quais", "quando", "onde", "como", "quanto", "quantos", "quantas", "que", "porque", "por"}
+
+_gate_stats = {"local_smalltalk": 0, "local_domain": 0, "llm_fallback": 0}
+_stats_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9?! ]+", " ", text).strip()
+
+
+def extract_features(text: str) -> List[str]:
+    words = re.findall(r"[a-z0-9]+|\?", normalize_text(text))
+    bigrams = [f"{a}_{b}" for a, b in zip(words, words[1:])]
+    return words + bigrams
+
+
+class SmalltalkClassifier:
+    """
+    Classificador Naive Bayes multinomial sobre unigramas e bigramas, treinado com exemplos
+    rotulados por intenção. Prioris uniformes, para que o volume de exemplos de domínio
+    vindos das métricas não enviese a decisão.
+    """
+
+    def __init__(self):
+        self.feature_counts: Dict[str, Counter] = {}
+        self.total_counts: Dict[str, int] = {}
+        self.vocabulary: set = set()
+        self.intent_words: Dict[str, set] = {}
+
+    def train(self, examples: Dict[str, List[str]]) -> "SmalltalkClassifier":
+        for intent, texts in examples.items():
+            counts = self.feature_counts.setdefault(intent, Counter())
+            for text in texts:
+                counts.update(extract_features(text))
+        self.total_counts = {intent: sum(c.values()) for intent, c in self.feature_counts.items()}
+        self.vocabulary = set().union(*self.feature_counts.values())
+        self.intent_words = {
+            intent: {f for f in counts if "_" not in f and f != "?"} for intent, counts in self.feature_counts.items()
+        }
+        return self
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        """
+        Retorna (intenção, probabilidade a posteriori). Sem nenhuma feature conhecida,
+        retorna (None, 0.0).
+        """
+        features = [f for f in extract_features(text) if f in self.vocabulary]
+        if not features:
+            return None, 0.0
+
+        vocab_size = len(self.vocabulary)
+        log_likelihoods = {}
+        for intent, counts in self.feature_counts.items():
+            denominator = self.total_counts[intent] + SMOOTHING_ALPHA * vocab_size
+            log_likelihoods[intent] = sum(math.log((counts[f] + SMOOTHING_ALPHA) / denominator) for f in features)
+
+        best = max(log_likelihoods.values())
+        exp_scores = {intent: math.exp(score - best) for intent, score in log_likelihoods.items()}
+        total = sum(exp_scores.values())
+        intent = max(exp_scores, key=exp_scores.get)  # type: ignore
+        return intent, exp_scores[intent] / total
+
+
+def split_clauses(text: str) -> List[List[str]]:
+    """
+    Divide a mensagem nas orações separadas por pontuação e retorna as palavras de cada uma.
+    """
+    clauses = [re.findall(r"[a-z0-9]+", normalize_text(part)) for part in CLAUSE_SEPARATORS.split(text.lower())]
+    return [words for words in clauses if words]
+
+
+def is_whole_smalltalk(classifier: SmalltalkClassifier, text: str) -> bool:
+    """
+    A mensagem inteira é smalltalk: cada oração usa só palavras dos exemplos de uma mesma intenção
+    com resposta pronta, e nenhuma oração depois da primeira é uma pergunta. Barra perguntas reais
+    parecidas com smalltalk, como "quem é o coordenador?" ou "legal, e quem é o professor?".
+    """
+    clauses = split_clauses(text)
+    if not clauses:
+        return False
+    for index, words in enumerate(clauses):
+        if index > 0 and INTERROGATIVES & set(words):
+            return False
+        if not any(set(words) <= classifier.intent_words.get(intent, set()) for intent in CANNED_REPLIES):
+            return False
+    return True
+
+
+def seed_examples() -> Dict[str, List[str]]:
+    examples = dict(SMALLTALK_EXAMPLES)
+    examples[DOMAIN_INTENT] = list(DOMAIN_EXAMPLES)
+    return examples
+
+
+def load_logged_domain_prompts(limit: int) -> List[str]:
+    """
+    Os prompts registrados em MetricsModel passaram pelo fluxo de RAG, ou seja, não foram
+    classificados como smalltalk: servem como exemplos de domínio.
+    """
+    if limit <= 0:
+        return []
+    db_session = SessionLocal()
+    try:
+        prompts = db_session.execute(
+            select(MetricsModel.prompt).order_by(MetricsModel.timestamp.desc()).limit(limit)
+        ).scalars().all()
+        return [ENHANCED_PROMPT_PREFIX.sub("", p) for p in prompts if p]
+    except Exception as e:
+        logging.error(f"Erro ao carregar prompts de treino do classificador de smalltalk: {str(e)}")
+        return []
+    finally:
+        db_session.close()
+
+
+_classifier: Optional[SmalltalkClassifier] = None
+_classifier_lock = threading.Lock()
+
+
+def get_smalltalk_classifier() -> SmalltalkClassifier:
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                examples = seed_examples()
+                examples[DOMAIN_INTENT] += load_logged_domain_prompts(SMALLTALK_TRAINING_METRICS_LIMIT)
+                _classifier = SmalltalkClassifier().train(examples)
+                logging.info(f"Classificador de smalltalk treinado com {len(examples[DOMAIN_INTENT])} exemplos de domínio.")
+    return _classifier
+
+
+def render_canned_reply(intent: str, user_name: Optional[str] = None) -> str:
+    first_name = user_name.split()[0] if user_name else ""
+    return random.choice(CANNED_REPLIES[intent]).format(nome=f", {first_name}" if first_name else "")
+
+
+def record_gate_decision(decision: str) -> None:
+    with _stats_lock:
+        _gate_stats[decision] += 1
+        avoided = _gate_stats["local_smalltalk"] + _gate_stats["local_domain"]
+    logging.info(f"[smalltalk_gate] decisão: {decision} - chamadas ao LLM evitadas: {avoided}")
+
+
+def get_gate_stats() -> Dict[str, int]:
+    with _stats_lock:
+        stats = dict(_gate_stats)
+    stats["llm_calls_avoided"] = stats["local_smalltalk"] + stats["local_domain"]
+    return stats
+
+
+def classify_smalltalk(user_prompt: str, user_name: Optional[str] = None, classifier: Optional[SmalltalkClassifier] = None) -> Tuple[Optional[bool], Optional[str]]:
+    """
+    Decide localmente se a mensagem é smalltalk. Só responde com a resposta pronta quando a
+    mensagem inteira é smalltalk (ver is_whole_smalltalk); os demais casos vão para o LLM.
+
+    Returns:
+        (True, resposta_pronta) se for smalltalk com confiança;
+        (False, None) se for pergunta de domínio com confiança;
+        (None, None) se o classificador estiver inseguro e o LLM deve decidir.
+    """
+    classifier = classifier or get_smalltalk_classifier()
+    intent, confidence = classifier.predict(user_prompt)
+    if intent is None or confidence < SMALLTALK_CONFIDENCE_THRESHOLD:
+        record_gate_decision("llm_fallback")
+        return None, None
+
+    if intent == DOMAIN_INTENT:
+        record_gate_decision("local_domain")
+        return False, None
+
+    if (
+        intent in CANNED_REPLIES
+        and len(user_prompt.split()) <= MAX_SMALLTALK_WORDS
+        and is_whole_smalltalk(classifier, user_prompt)
+    ):
+        record_gate_decision("local_smalltalk")
+        return True, render_canned_reply(intent, user_name)
+
+    record_gate_decision("llm_fallback")
+    return None, None
+
+
+async def aclassify_smalltalk(user_prompt: str, user_name: Optional[str] = None) -> Tuple[Optional[bool], Optional[str]]:
+    """
+    Variante de classify_smalltalk para o event loop: o primeiro uso treina o classificador,
+    que lê os prompts da tabela metrics, em uma thread.
+    """
+    if _classifier is None:
+        await asyncio.to_thread(get_smalltalk_classifier)
+    return classify_smalltalk(user_prompt, user_name)
@@ -0,0 +1,14 @@
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def get_token_encoding():
+    import tiktoken
+
+    return tiktoken.get_encoding("cl100k_base")
+
+def token_count(input_string) -> int:
+    encoding = get_token_encoding()
+    tokens = encoding.encode(input_string)
+    token_count = len(tokens)
+    return token_count
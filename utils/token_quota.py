@@ -0,0 +1,349 @@
+import atexit
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from configs.openai_client import DEFAULT_MAX_TOKENS
+from configs.settings import (
+    CONTEXT_TOKEN_BUDGET,
+    QUOTA_ENABLED,
+    QUOTA_USER_TOKENS_PER_MINUTE,
+    QUOTA_USER_BURST_TOKENS,
+    QUOTA_CLASS_TOKENS_PER_MINUTE,
+    QUOTA_CLASS_BURST_TOKENS,
+    QUOTA_SYNC_INTERVAL_SECONDS,
+)
+from configs.system_prompt import DEFAULT_PROMPT
+from models.Roles import Role
+from utils.db_session import SessionLocal
+from utils.token_counter import token_count
+
+# As instruções fixas não mudam: tokenizadas uma vez só
+DEFAULT_PROMPT_TOKENS = token_count(DEFAULT_PROMPT)
+
+# Refill pelo tempo decorrido no banco, desconto do que esta instância consumiu desde a última
+# sincronização e, no RETURNING, o saldo global que passa a valer localmente
+SYNC_BUCKET_SQL = text("""
+    INSERT INTO token_buckets (key, tokens, capacity, refill_per_second, consumed_tokens, rejected_requests, updated_at)
+    VALUES (:key, :capacity - :consumed, :capacity, :refill_per_second, :consumed, :rejected, timezone('utc', now()))
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = LEAST(
+            EXCLUDED.capacity,
+            token_buckets.tokens
+                + EXTRACT(EPOCH FROM (timezone('utc', now()) - token_buckets.updated_at)) * EXCLUDED.refill_per_second
+        ) - :consumed,
+        capacity = EXCLUDED.capacity,
+        refill_per_second = EXCLUDED.refill_per_second,
+        consumed_tokens = token_buckets.consumed_tokens + :consumed,
+        rejected_requests = token_buckets.rejected_requests + :rejected,
+        updated_at = timezone('utc', now())
+    RETURNING tokens
+""")
+
+
+class TokenBucket:
+    """
+    Token bucket em memória. O saldo pode ficar negativo: quando o uso real supera a estimativa,
+    a diferença é cobrada das próximas requisições.
+    """
+
+    def __init__(self, key: str, capacity: float, refill_per_second: float):
+        self.key = key
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        # Variações ainda não enviadas ao Postgres
+        self.pending_consumed = 0.0
+        self.pending_rejected = 0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def retry_after(self, amount: float) -> float:
+        # Pedidos maiores que a capacidade só esperam o bucket encher
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.refill_per_second) if self.refill_per_second else math.inf
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= amount
+        self.pending_consumed += amount
+
+
+@dataclass
+class QuotaExceeded:
+    scope: str  # "student" ou "class"
+    retry_after: int
+
+
+class QuotaExceededError(Exception):
+    """
+    Cota esgotada no meio de uma requisição (ex.: em uma pergunta do lote).
+    """
+
+    def __init__(self, exceeded: QuotaExceeded):
+        super().__init__(quota_exceeded_payload(exceeded)["error"])
+        self.exceeded = exceeded
+
+
+class QuotaReservation:
+    """
+    Tokens reservados para uma requisição a partir da estimativa. O uso real de cada chamada ao
+    modelo é somado com `record` e a diferença é acertada uma única vez em `settle`.
+    """
+
+    def __init__(self, manager: "TokenQuotaManager", keys: List[str], estimated: int):
+        self._manager = manager
+        self.keys = keys
+        self.estimated = estimated
+        self.used = 0
+        self._settled = False
+
+    def extend(self, prompts: List[str]) -> Optional[QuotaExceeded]:
+        """
+        Reserva também a estimativa de `prompts` nos mesmos buckets (ex.: cada pergunta do lote,
+        antes da sua completion). Sem saldo, não reserva nada e retorna QuotaExceeded.
+        """
+        estimated = estimate_request_tokens(prompts)
+        exceeded = self._manager.try_consume(self.keys, estimated)
+        if exceeded is None:
+            self.estimated += estimated
+        return exceeded
+
+    def record(self, response) -> None:
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.used += usage.total_tokens
+
+    def settle(self) -> None:
+        if self._settled:
+            return
+        self._settled = True
+        self._manager.adjust(self.keys, self.used - self.estimated)
+
+
+class TokenQuotaManager:
+    """
+    Cotas de tokens por aluno (e-mail) e por turma. Os buckets ficam na memória do processo
+    e uma thread os sincroniza com a tabela token_buckets, compartilhada entre as instâncias.
+    """
+
+    def __init__(self, sync_interval: float = QUOTA_SYNC_INTERVAL_SECONDS):
+        self.sync_interval = sync_interval
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if key.startswith("class:"):
+                bucket = TokenBucket(key, QUOTA_CLASS_BURST_TOKENS, QUOTA_CLASS_TOKENS_PER_MINUTE / 60)
+            else:
+                bucket = TokenBucket(key, QUOTA_USER_BURST_TOKENS, QUOTA_USER_TOKENS_PER_MINUTE / 60)
+            self._buckets[key] = bucket
+        return bucket
+
+    def _ensure_started(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="token-quota-sync", daemon=True)
+            self._thread.start()
+
+    def reserve(self, keys: List[str], estimated: int):
+        """
+        Reserva `estimated` tokens em todos os buckets de uma vez. Retorna uma QuotaReservation,
+        ou QuotaExceeded com o bucket mais restritivo (a turma antes do aluno, em caso de empate).
+        """
+        exceeded = self.try_consume(keys, estimated)
+        if exceeded is not None:
+            return exceeded
+        return QuotaReservation(self, keys, estimated)
+
+    def try_consume(self, keys: List[str], estimated: int, consume: bool = True) -> Optional[QuotaExceeded]:
+        """
+        Consome `estimated` tokens de todos os buckets, se todos tiverem saldo. Com consume=False,
+        só confere o saldo. Retorna QuotaExceeded com o bucket mais restritivo, ou None.
+        """
+        self._ensure_started()
+        now = time.monotonic()
+        with self._lock:
+            buckets = [self._bucket(key) for key in keys]
+            for bucket in buckets:
+                bucket.refill(now)
+            blocked = [bucket for bucket in buckets if bucket.tokens < min(estimated, bucket.capacity)]
+            if blocked:
+                worst = max(blocked, key=lambda bucket: (bucket.retry_after(estimated), bucket.key.startswith("class:")))
+                for bucket in blocked:
+                    bucket.pending_rejected += 1
+                scope = "class" if worst.key.startswith("class:") else "student"
+                return QuotaExceeded(scope=scope, retry_after=max(1, math.ceil(worst.retry_after(estimated))))
+            if consume:
+                for bucket in buckets:
+                    bucket.consume(estimated)
+        return None
+
+    def adjust(self, keys: List[str], delta: int) -> None:
+        if not delta:
+            return
+        with self._lock:
+            for key in keys:
+                self._bucket(key).consume(delta)
+
+    def sync(self) -> None:
+        """
+        Envia ao Postgres o consumo local de cada bucket e adota o saldo global devolvido.
+        Se o banco falhar, as variações voltam a ficar pendentes e os buckets seguem só em memória.
+        """
+        with self._lock:
+            snapshot = [
+                (bucket, bucket.pending_consumed, bucket.pending_rejected)
+                for bucket in self._buckets.values()
+            ]
+            for bucket, _, _ in snapshot:
+                bucket.pending_consumed = 0.0
+                bucket.pending_rejected = 0
+
+        db_session = SessionLocal()
+        try:
+            synced = []
+            for bucket, consumed, rejected in snapshot:
+                tokens = db_session.execute(SYNC_BUCKET_SQL, {
+                    "key": bucket.key,
+                    "capacity": bucket.capacity,
+                    "refill_per_second": bucket.refill_per_second,
+                    "consumed": consumed,
+                    "rejected": rejected,
+                }).scalar_one()
+                synced.append((bucket, tokens))
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            logging.error(f"Erro ao sincronizar as cotas de tokens: {str(e)}")
+            with self._lock:
+                for bucket, consumed, rejected in snapshot:
+                    bucket.pending_consumed += consumed
+                    bucket.pending_rejected += rejected
+            return
+        finally:
+            db_session.close()
+
+        now = time.monotonic()
+        with self._lock:
+            for bucket, tokens in synced:
+                # O que foi consumido durante a sincronização ainda não está no saldo global
+                bucket.tokens = tokens - bucket.pending_consumed
+                bucket.updated_at = now
+                # Buckets cheios e sem pendências saem da memória; o banco guarda o histórico
+                if bucket.tokens >= bucket.capacity and not bucket.pending_consumed and not bucket.pending_rejected:
+                    self._buckets.pop(bucket.key, None)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+    def close(self) -> None:
+        self._stop.set()
+        self.sync()
+
+
+quota_manager = TokenQuotaManager()
+atexit.register(quota_manager.close)
+
+
+def quota_keys(user: dict) -> List[str]:
+    keys = []
+    if user.get("classCode"):
+        keys.append(f"class:{user.get('classCode')}")
+    if user.get("email"):
+        keys.append(f"email:{user.get('email')}")
+    return keys
+
+
+def estimate_request_tokens(prompts: List[str], history: Optional[list] = None) -> int:
+    """
+    Estimativa conservadora de uma requisição de chat: instruções fixas, histórico, orçamento
+    do contexto e o máximo de tokens da resposta, para cada pergunta.
+    """
+    history_tokens = sum(token_count(str(message.get("content", ""))) for message in history or [])
+    fixed_tokens = DEFAULT_PROMPT_TOKENS + CONTEXT_TOKEN_BUDGET + DEFAULT_MAX_TOKENS + history_tokens
+    return sum(token_count(prompt) + fixed_tokens for prompt in prompts)
+
+
+def applicable_quota_keys(user: dict) -> List[str]:
+    # Sem chaves, não há cota a aplicar (desligada ou admin)
+    if not QUOTA_ENABLED or user.get("role") == Role.ADMIN.value:
+        return []
+    return quota_keys(user)
+
+
+def reserve_tokens(user: dict, prompts: List[str], history: Optional[list] = None):
+    """
+    Reserva a estimativa da requisição nos buckets do aluno e da turma. Retorna None quando não
+    há cota a aplicar (desligada ou admin), uma QuotaReservation ou QuotaExceeded.
+    """
+    keys = applicable_quota_keys(user)
+    if not keys:
+        return None
+    return quota_manager.reserve(keys, estimate_request_tokens(prompts, history))
+
+
+def check_tokens(user: dict, prompts: List[str], history: Optional[list] = None) -> Optional[QuotaExceeded]:
+    """
+    Confere, sem reservar, se os buckets do aluno e da turma comportam a estimativa da requisição.
+    Usado quando a reserva só pode ser feita mais tarde (ex.: dentro do gerador do streaming).
+    """
+    keys = applicable_quota_keys(user)
+    if not keys:
+        return None
+    return quota_manager.try_consume(keys, estimate_request_tokens(prompts, history), consume=False)
+
+
+def quota_exceeded_payload(exceeded: QuotaExceeded) -> dict:
+    target = "da turma" if exceeded.scope == "class" else "do aluno"
+    return {
+        "error": f"Cota de tokens {target} esgotada. Tente novamente em {exceeded.retry_after} s.",
+        "scope": exceeded.scope,
+        "retry_after": exceeded.retry_after,
+    }
+
+
+def list_token_buckets(class_codes: Optional[List[str]] = None, emails: Optional[List[str]] = None) -> List[dict]:
+    """
+    Estado dos buckets no Postgres, com o saldo projetado para agora. Sem filtros, retorna todos.
+    """
+    sql = """
+        SELECT key, capacity, refill_per_second, consumed_tokens, rejected_requests, updated_at,
+               LEAST(capacity, tokens + EXTRACT(EPOCH FROM (timezone('utc', now()) - updated_at)) * refill_per_second) AS available
+        FROM token_buckets
+    """
+    params: dict = {}
+    if class_codes is not None or emails is not None:
+        sql += " WHERE key = ANY(:keys)"
+        params["keys"] = [f"class:{code}" for code in class_codes or []] + [f"email:{email}" for email in emails or []]
+    sql += " ORDER BY consumed_tokens DESC"
+
+    db_session = SessionLocal()
+    try:
+        rows = db_session.execute(text(sql), params).mappings().all()
+        return [
+            {
+                "scope": "class" if row["key"].startswith("class:") else "student",
+                "id": row["key"].split(":", 1)[1],
+                "available_tokens": round(float(row["available"])),
+                "capacity": row["capacity"],
+                "tokens_per_minute": round(row["refill_per_second"] * 60),
+                "consumed_tokens": round(row["consumed_tokens"]),
+                "rejected_requests": row["rejected_requests"],
+                "updated_at": row["updated_at"].isoformat(),
+            }
+            for row in rows
+        ]
+    finally:
+        db_session.close()
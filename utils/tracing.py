@@ -0,0 +1,135 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from models.DatabaseModels import RequestSpanModel
+from utils.db_session import SessionLocal
+from utils.metrics_writer import MetricsWriter
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+# As etapas são diagnóstico: ficam só em memória até o próximo flush, sem spool
+span_writer = MetricsWriter(mode="memory", model=RequestSpanModel, conflict_columns=())
+
+
+class RequestTrace:
+    """
+    Etapas cronometradas de uma requisição. É compartilhada pelas tasks e threads que a
+    requisição dispara (asyncio.to_thread e create_task copiam o contexto).
+    """
+
+    def __init__(self, request_id: str, route: str):
+        self.request_id = request_id
+        self.route = route
+        self.started_at = time.perf_counter()
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, started_at: float, ended_at: float) -> None:
+        with self._lock:
+            self.spans.append({
+                "stage": stage,
+                "start_ms": (started_at - self.started_at) * 1000,
+                "duration_ms": (ended_at - started_at) * 1000,
+            })
+
+    def durations(self) -> Dict[str, float]:
+        # Etapas repetidas (ex.: completions do lote) são somadas
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span["stage"]] = totals.get(span["stage"], 0.0) + span["duration_ms"]
+        return totals
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in self.durations().items())
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+def start_trace(request_id: str, route: str) -> RequestTrace:
+    trace = RequestTrace(request_id, route)
+    _current_trace.set(trace)
+    return trace
+
+
+def activate_trace(trace: RequestTrace) -> None:
+    # Para código que roda fora do contexto em que o trace foi criado (ex.: o gerador do streaming)
+    _current_trace.set(trace)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Cronometra o bloco como uma etapa da requisição atual. Sem requisição em andamento, não faz nada.
+    """
+    trace = _current_trace.get()
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.record(stage, started_at, time.perf_counter())
+
+
+def build_span_rows(trace: RequestTrace) -> List[RequestSpanModel]:
+    created_at = datetime.utcnow()
+    return [
+        RequestSpanModel(
+            id=str(uuid.uuid4()),
+            request_id=trace.request_id,
+            route=trace.route,
+            stage=span["stage"],
+            start_ms=span["start_ms"],
+            duration_ms=span["duration_ms"],
+            created_at=created_at,
+        )
+        for span in list(trace.spans)
+    ]
+
+
+def persist_trace(trace: RequestTrace) -> None:
+    """
+    Enfileira as etapas da requisição para a tabela request_spans, gravadas em lote em segundo
+    plano (ver utils/metrics_writer.py), sem uma ida ao Postgres antes da resposta.
+    """
+    span_writer.enqueue(build_span_rows(trace))
+
+
+def stage_latency_percentiles(hours: int = 24, route: Optional[str] = None) -> List[Dict]:
+    """
+    p50/p95/p99 da duração de cada etapa nas últimas `hours` horas, opcionalmente de uma rota.
+    """
+    sql = text(f"""
+        SELECT route, stage, COUNT(*) AS count,
+               percentile_cont(ARRAY[{", ".join(str(p) for p in PERCENTILES)}]) WITHIN GROUP (ORDER BY duration_ms) AS percentiles
+        FROM request_spans
+        WHERE created_at >= :since AND (CAST(:route AS varchar) IS NULL OR route = :route)
+        GROUP BY route, stage
+        ORDER BY route, stage
+    """)
+    db_session = SessionLocal()
+    try:
+        rows = db_session.execute(sql, {"since": datetime.utcnow() - timedelta(hours=hours), "route": route}).all()
+        return [
+            {
+                "route": row.route,
+                "stage": row.stage,
+                "count": row.count,
+                **{f"p{round(p * 100)}": round(value, 1) for p, value in zip(PERCENTILES, row.percentiles)},
+            }
+            for row in rows
+        ]
+    finally:
+        db_session.close()
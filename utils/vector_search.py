@@ -0,0 +1,449 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from constants import KNOWLEDGE_COLLECTION_NAME
+from utils.ann_index import (
+    IndexLayout,
+    active_index_layout,
+    create_ann_index,
+    embedding_sql,
+    ensure_global_ann_index,
+    index_layout_stale,
+    search_tuning_statements,
+)
+from utils.db_session import SessionLocal, AsyncSessionLocal, db_engine
+
+ADMIN_CLASS_CODE = "admin"
+TEXT_SEARCH_CONFIG = "portuguese"
+# Colunas geradas criadas por migrate_knowledge_schema; sem elas, as consultas usam as expressões equivalentes
+MIGRATED_COLUMNS = ("class_code", "document_tsv")
+# De quanto em quanto tempo as consultas verificam se a migração já foi feita
+SCHEMA_REFRESH_SECONDS = 30
+MIGRATION_LOCK_TIMEOUT = "5s"
+
+_schema_lock = threading.Lock()
+_schema_migrated = False
+_schema_state: Dict[str, Any] = {"columns": frozenset(), "checked_at": 0.0}
+_partitioned_classes: Set[str] = set()
+
+
+def to_pgvector_literal(embedding: List[float]) -> str:
+    return "[" + ",".join(str(value) for value in embedding) + "]"
+
+
+def knowledge_schema_stale() -> bool:
+    pending = set(MIGRATED_COLUMNS) - _schema_state["columns"]
+    return bool(pending) and time.monotonic() - _schema_state["checked_at"] > SCHEMA_REFRESH_SECONDS
+
+
+def migrated_columns() -> frozenset:
+    """
+    Colunas de MIGRATED_COLUMNS já presentes em langchain_pg_embedding. Só lê o catálogo (relido a
+    cada SCHEMA_REFRESH_SECONDS enquanto faltar alguma), para que as consultas nunca alterem o schema.
+    """
+    if knowledge_schema_stale():
+        try:
+            with db_engine.connect() as conn:
+                columns = conn.execute(text("""
+                    SELECT column_name FROM information_schema.columns
+                    WHERE table_name = 'langchain_pg_embedding' AND column_name = ANY(:columns)
+                """), {"columns": list(MIGRATED_COLUMNS)}).scalars().all()
+            _schema_state["columns"] = frozenset(columns)
+        except Exception as e:
+            logging.error(f"Erro ao verificar as colunas da base de conhecimento: {str(e)}")
+        _schema_state["checked_at"] = time.monotonic()
+    return _schema_state["columns"]
+
+
+def class_code_sql(alias: str = "e") -> str:
+    # Antes da migração, o mesmo valor sai do cmetadata (sem os índices parciais)
+    if "class_code" in _schema_state["columns"]:
+        return f"{alias}.class_code"
+    return f"({alias}.cmetadata->>'class_code')"
+
+
+def document_tsv_sql(alias: str = "e") -> str:
+    # Antes da migração, o tsvector é calculado na consulta (sem o índice GIN)
+    if "document_tsv" in _schema_state["columns"]:
+        return f"{alias}.document_tsv"
+    return f"to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce({alias}.document, ''))"
+
+
+def class_filter_sql(user_class: Optional[str]) -> str:
+    """
+    Mesmo escopo do filtro do PGVector: documentos da turma, do admin ou sem turma.
+    Sem turma (professores/admin), busca em toda a coleção.
+    """
+    if not user_class:
+        return "TRUE"
+    class_code = class_code_sql()
+    return f"({class_code} IN (:class_code, '{ADMIN_CLASS_CODE}') OR {class_code} IS NULL)"
+
+
+def partition_index_name(class_code: str) -> str:
+    # Códigos de turma podem ter caracteres inválidos em identificadores
+    return f"ix_langchain_pg_embedding_class_{hashlib.md5(class_code.encode('utf-8')).hexdigest()[:16]}"
+
+
+def partition_predicate_sql(class_code: Optional[str], column: str = "class_code") -> str:
+    # O código da turma vai como literal (e não como parâmetro) para que o planner sempre
+    # consiga casar a consulta com o predicado do índice parcial
+    if class_code is None:
+        return f"{column} IS NULL"
+    return f"{column} = '" + class_code.replace("'", "''") + "'"
+
+
+def ensure_class_partition(class_code: Optional[str]) -> None:
+    """
+    Cria o índice ANN parcial de uma turma (ou dos documentos sem turma), usado pela busca
+    por partição. Idempotente.
+    """
+    key = class_code if class_code is not None else ""
+    if key in _partitioned_classes:
+        return
+
+    try:
+        create_ann_index(partition_index_name(key), partition_predicate_sql(class_code))
+        _partitioned_classes.add(key)
+    except Exception as e:
+        logging.error(f"Erro ao criar o índice vetorial da turma {class_code}: {str(e)}")
+
+
+def migrate_knowledge_schema() -> None:
+    """
+    Migração da busca por partição e da busca híbrida: cria as colunas geradas class_code (a partir
+    do cmetadata) e document_tsv (tsvector do documento), preenchidas pelo Postgres também para as
+    linhas existentes, o índice B-tree, o índice GIN, o índice ANN da coleção inteira e um índice
+    ANN parcial para cada turma já ingerida, para o admin e para os documentos sem turma.
+    Idempotente; o ALTER TABLE (que reescreve a tabela) só roda se faltar alguma coluna. Executada pela ingestão e por `python -m scripts.migrate_knowledge_schema`,
+    nunca pelas consultas.
+    """
+    global _schema_migrated
+    with _schema_lock:
+        if _schema_migrated:
+            return
+
+        _schema_state["checked_at"] = 0.0
+        existing = migrated_columns()
+        with db_engine.begin() as conn:
+            # Sem o lock em poucos segundos, desiste em vez de enfileirar (e bloquear) as buscas atrás do ALTER
+            conn.execute(text(f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'"))
+            if "class_code" not in existing:
+                conn.execute(text(
+                    "ALTER TABLE langchain_pg_embedding ADD COLUMN IF NOT EXISTS class_code varchar "
+                    "GENERATED ALWAYS AS (cmetadata->>'class_code') STORED"
+                ))
+            if "document_tsv" not in existing:
+                conn.execute(text(
+                    "ALTER TABLE langchain_pg_embedding ADD COLUMN IF NOT EXISTS document_tsv tsvector "
+                    f"GENERATED ALWAYS AS (to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(document, ''))) STORED"
+                ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_collection_class "
+                "ON langchain_pg_embedding (collection_id, class_code)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_document_tsv "
+                "ON langchain_pg_embedding USING gin (document_tsv)"
+            ))
+            class_codes = conn.execute(text("SELECT DISTINCT class_code FROM langchain_pg_embedding")).scalars().all()
+        _schema_state.update({"columns": frozenset(MIGRATED_COLUMNS), "checked_at": time.monotonic()})
+
+        ensure_global_ann_index()
+        for class_code in {*class_codes, ADMIN_CLASS_CODE, None}:
+            ensure_class_partition(class_code)
+        _schema_migrated = True
+        logging.info(f"[vector_search] schema da base de conhecimento migrado ({len(_partitioned_classes)} partições)")
+
+
+def nearest_neighbors_sql(user_class: Optional[str], distance: str, limit: str) -> str:
+    """
+    Os `limit` vizinhos mais próximos por `distance` dentro do escopo do usuário. Com turma, busca
+    separadamente na partição da turma, na do admin e na dos documentos sem turma (cada uma usando
+    o seu índice parcial) e junta os resultados; sem turma, busca em toda a coleção.
+    """
+    collection = "e.collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = :collection)"
+    if not user_class:
+        return f"""
+            SELECT e.id, e.document, e.cmetadata, e.embedding, {distance} AS distance
+            FROM langchain_pg_embedding e
+            WHERE {collection}
+            ORDER BY distance
+            LIMIT {limit}
+        """
+
+    partitions = [
+        f"""(
+            SELECT e.id, e.document, e.cmetadata, e.embedding, {distance} AS distance
+            FROM langchain_pg_embedding e
+            WHERE {collection} AND {partition_predicate_sql(class_code, class_code_sql())}
+            ORDER BY distance
+            LIMIT {limit}
+        )"""
+        # O admin consulta a própria partição uma vez só, sem chunks repetidos
+        for class_code in dict.fromkeys((user_class, ADMIN_CLASS_CODE, None))
+    ]
+    return f"""
+        SELECT id, document, cmetadata, embedding, distance
+        FROM ({" UNION ALL ".join(partitions)}) partitions
+        ORDER BY distance
+        LIMIT {limit}
+    """
+
+
+def partitioned_vector_sql(user_class: Optional[str], query_embedding: str, limit: str = ":k", layout: Optional[IndexLayout] = None) -> str:
+    """
+    Subconsulta com os `limit` vizinhos mais próximos (distância de cosseno) dentro do escopo do
+    usuário. Com o índice quantizado ou só com o prefixo do embedding (ver utils/ann_index.py),
+    o índice devolve `limit` x oversampling candidatos, reordenados pelo vetor completo da tabela.
+    Retorna id, document, cmetadata, embedding e distance.
+    """
+    layout = layout or active_index_layout()
+    distance = f"{embedding_sql('embedding')} <=> {query_embedding}"
+    if not layout.two_stage:
+        return nearest_neighbors_sql(user_class, f"{embedding_sql('e.embedding')} <=> {query_embedding}", limit)
+
+    first_pass = nearest_neighbors_sql(
+        user_class,
+        layout.distance_sql(embedding_sql("e.embedding"), query_embedding),
+        f"{limit} * {layout.oversampling()}",
+    )
+    return f"""
+        SELECT id, document, cmetadata, embedding, {distance} AS distance
+        FROM ({first_pass}) candidates
+        ORDER BY distance
+        LIMIT {limit}
+    """
+
+
+def text_query_sql(query: str = ":query") -> str:
+    """
+    tsquery que casa com qualquer termo da pergunta (OR), em vez de todos (o AND do plainto_tsquery).
+    Os lexemas do plainto_tsquery já saem normalizados: o texto reescrito é convertido direto em
+    tsquery, porque passar de novo pelo to_tsquery aplicaria o stemmer outra vez ("avaliação" vira
+    avali e depois aval) e o lexema não casaria mais com document_tsv.
+    """
+    return f"CAST(replace(plainto_tsquery('{TEXT_SEARCH_CONFIG}', {query})::text, '&', '|') AS tsquery)"
+
+
+def hybrid_search_sql(user_class: Optional[str], with_embeddings: bool = False):
+    embedding_column = "CAST(e.embedding AS text)" if with_embeddings else "NULL"
+    class_filter = class_filter_sql(user_class)
+    document_tsv = document_tsv_sql()
+    return text(f"""
+        WITH collection AS (
+            SELECT uuid FROM langchain_pg_collection WHERE name = :collection
+        ),
+        vector_hits AS (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+            FROM ({partitioned_vector_sql(user_class, embedding_sql(':embedding'), ':candidates')}) nearest
+        ),
+        text_query AS (
+            SELECT {text_query_sql()} AS q
+        ),
+        text_hits AS (
+            SELECT e.id, ROW_NUMBER() OVER (ORDER BY ts_rank_cd({document_tsv}, tq.q) DESC) AS rank
+            FROM langchain_pg_embedding e, text_query tq
+            WHERE e.collection_id = (SELECT uuid FROM collection) AND {class_filter}
+              AND {document_tsv} @@ tq.q
+            ORDER BY ts_rank_cd({document_tsv}, tq.q) DESC
+            LIMIT :candidates
+        ),
+        fused AS (
+            SELECT id, SUM(1.0 / (:rrf_k + rank)) AS rrf_score
+            FROM (SELECT id, rank FROM vector_hits UNION ALL SELECT id, rank FROM text_hits) hits
+            GROUP BY id
+        )
+        SELECT e.document, e.cmetadata, f.rrf_score,
+               1 - (e.embedding <=> CAST(:embedding AS vector)) AS similarity, {embedding_column} AS embedding
+        FROM fused f
+        JOIN langchain_pg_embedding e ON e.id = f.id
+        ORDER BY f.rrf_score DESC
+        LIMIT :k
+    """)
+
+
+def vector_search_sql(user_class: Optional[str], with_embeddings: bool = False):
+    embedding_column = "CAST(embedding AS text)" if with_embeddings else "NULL"
+    return text(f"""
+        SELECT document, cmetadata, 1 - distance AS similarity, {embedding_column} AS embedding
+        FROM ({partitioned_vector_sql(user_class, embedding_sql(':embedding'))}) nearest
+        ORDER BY distance
+    """)
+
+
+def vector_search_params(embedding: List[float], user_class: Optional[str], k: int) -> dict:
+    return {
+        "collection": KNOWLEDGE_COLLECTION_NAME,
+        "embedding": to_pgvector_literal(embedding),
+        "class_code": user_class,
+        "k": k,
+    }
+
+
+def vector_search(
+    embedding: List[float],
+    user_class: Optional[str],
+    k: int,
+    with_embeddings: bool = False,
+) -> List[Tuple[str, Dict[str, Any], float, Optional[str]]]:
+    """
+    Busca vetorial no escopo do usuário, por partição de turma (ver partitioned_vector_sql).
+
+    Returns:
+        Lista de (documento, cmetadata, similaridade_cosseno, embedding), da mais similar à menos.
+        O embedding vem no formato texto do pgvector, e apenas com with_embeddings.
+    """
+    migrated_columns()
+    db_session = SessionLocal()
+    try:
+        for statement in search_tuning_statements(k):
+            db_session.execute(text(statement))
+        rows = db_session.execute(
+            vector_search_sql(user_class, with_embeddings), vector_search_params(embedding, user_class, k)
+        ).all()
+        return [(row.document, row.cmetadata or {}, float(row.similarity), row.embedding) for row in rows]
+    finally:
+        db_session.close()
+
+
+def hybrid_search_params(query: str, embedding: List[float], user_class: Optional[str], k: int, candidates: int, rrf_k: int) -> dict:
+    return {
+        "collection": KNOWLEDGE_COLLECTION_NAME,
+        "embedding": to_pgvector_literal(embedding),
+        "query": query,
+        "class_code": user_class,
+        "candidates": candidates,
+        "rrf_k": rrf_k,
+        "k": k,
+    }
+
+
+def hybrid_search(
+    query: str,
+    embedding: List[float],
+    user_class: Optional[str],
+    k: int,
+    candidates: int,
+    rrf_k: int,
+    with_embeddings: bool = False,
+) -> List[Tuple[str, Dict[str, Any], float, float, Optional[str]]]:
+    """
+    Executa, em uma única consulta, a busca vetorial (pgvector) e a busca textual
+    (tsvector, configuração portuguese) e funde os rankings com Reciprocal Rank Fusion.
+    Os termos da busca textual são combinados com OR para não exigir todos na mesma passagem.
+
+    Returns:
+        Lista de (documento, cmetadata, score_rrf, similaridade_cosseno, embedding), do mais
+        relevante ao menos. O embedding vem no formato texto do pgvector, e apenas com with_embeddings.
+    """
+    migrated_columns()
+    db_session = SessionLocal()
+    try:
+        for statement in search_tuning_statements(candidates):
+            db_session.execute(text(statement))
+        rows = db_session.execute(
+            hybrid_search_sql(user_class, with_embeddings), hybrid_search_params(query, embedding, user_class, k, candidates, rrf_k)
+        ).all()
+        return [(row.document, row.cmetadata or {}, float(row.rrf_score), float(row.similarity), row.embedding) for row in rows]
+    finally:
+        db_session.close()
+
+
+async def ahybrid_search(
+    query: str,
+    embedding: List[float],
+    user_class: Optional[str],
+    k: int,
+    candidates: int,
+    rrf_k: int,
+    with_embeddings: bool = False,
+) -> List[Tuple[str, Dict[str, Any], float, float, Optional[str]]]:
+    """
+    Variante assíncrona de hybrid_search, usando o engine assíncrono.
+    """
+    if knowledge_schema_stale():
+        await asyncio.to_thread(migrated_columns)
+    if index_layout_stale():
+        await asyncio.to_thread(active_index_layout)
+    async with AsyncSessionLocal() as db_session:
+        for statement in search_tuning_statements(candidates):
+            await db_session.execute(text(statement))
+        result = await db_session.execute(
+            hybrid_search_sql(user_class, with_embeddings), hybrid_search_params(query, embedding, user_class, k, candidates, rrf_k)
+        )
+        return [
+            (row.document, row.cmetadata or {}, float(row.rrf_score), float(row.similarity), row.embedding)
+            for row in result.all()
+        ]
+
+
+async def avector_search(
+    embedding: List[float],
+    user_class: Optional[str],
+    k: int,
+    with_embeddings: bool = False,
+) -> List[Tuple[str, Dict[str, Any], float, Optional[str]]]:
+    """
+    Variante assíncrona de vector_search, usando o engine assíncrono.
+    """
+    if knowledge_schema_stale():
+        await asyncio.to_thread(migrated_columns)
+    if index_layout_stale():
+        await asyncio.to_thread(active_index_layout)
+    async with AsyncSessionLocal() as db_session:
+        for statement in search_tuning_statements(k):
+            await db_session.execute(text(statement))
+        result = await db_session.execute(
+            vector_search_sql(user_class, with_embeddings), vector_search_params(embedding, user_class, k)
+        )
+        return [(row.document, row.cmetadata or {}, float(row.similarity), row.embedding) for row in result.all()]
+
+
+async def avector_search_batch(
+    embeddings: List[List[float]],
+    user_class: Optional[str],
+    k: int,
+    with_embeddings: bool = False,
+) -> List[List[Tuple[str, Dict[str, Any], float, Optional[str]]]]:
+    """
+    Busca vetorial de várias consultas em uma única ida ao banco: os embeddings vão como um
+    array e cada um é resolvido em um JOIN LATERAL com a mesma busca por partição de turma.
+
+    Returns:
+        Uma lista de resultados por consulta, na ordem de `embeddings`.
+    """
+    if knowledge_schema_stale():
+        await asyncio.to_thread(migrated_columns)
+    if index_layout_stale():
+        await asyncio.to_thread(active_index_layout)
+    embedding_column = "CAST(embedding AS text)" if with_embeddings else "NULL"
+    sql = text(f"""
+        SELECT q.ord, hit.document, hit.cmetadata, hit.similarity, hit.embedding
+        FROM unnest(CAST(:embeddings AS text[])) WITH ORDINALITY AS q(embedding, ord)
+        CROSS JOIN LATERAL (
+            SELECT document, cmetadata, 1 - distance AS similarity, {embedding_column} AS embedding
+            FROM ({partitioned_vector_sql(user_class, embedding_sql('q.embedding'))}) nearest
+        ) hit
+        ORDER BY q.ord, hit.similarity DESC
+    """)
+    params = {
+        "collection": KNOWLEDGE_COLLECTION_NAME,
+        "embeddings": [to_pgvector_literal(embedding) for embedding in embeddings],
+        "class_code": user_class,
+        "k": k,
+    }
+    results: List[List[Tuple[str, Dict[str, Any], float, Optional[str]]]] = [[] for _ in embeddings]
+    async with AsyncSessionLocal() as db_session:
+        for statement in search_tuning_statements(k):
+            await db_session.execute(text(statement))
+        rows = (await db_session.execute(sql, params)).all()
+    for row in rows:
+        results[row.ord - 1].append((row.document, row.cmetadata or {}, float(row.similarity), row.embedding))
+    return results